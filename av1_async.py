@@ -0,0 +1,318 @@
+"""
+AV1 Encoder Pro - Async Runner
+asyncio versions of the engine's FFmpeg/ffprobe runners, so a single thread
+can supervise many processes, and a Supervisor that runs them for the
+threaded front ends.
+"""
+import asyncio
+import os
+import re
+import subprocess
+import threading
+import time
+
+import av1_engine as engine
+
+# Bytes read from a child's pipe at a time
+READ_CHUNK = 64 * 1024
+
+# ffprobe processes probe_videos() keeps in flight
+PROBE_LIMIT = 16
+
+
+# ============ PROCESSES ============
+
+async def read_lines(stream):
+    """Yield the non-empty lines of an asyncio stream
+
+    FFmpeg ends its stats lines with a bare carriage return, so "\\r" splits
+    lines just like "\\n" does.
+    """
+    buffer = b""
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+        for line in lines:
+            line = line.decode("utf-8", "replace").strip()
+            if line:
+                yield line
+    line = buffer.decode("utf-8", "replace").strip()
+    if line:
+        yield line
+
+async def capture(cmd, timeout=30):
+    """Run a short command (ffprobe) and return its stdout, or None if it failed to run"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            **engine.popen_options(env=False, session=True))
+    except OSError:
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        engine.kill_process(process)
+        await process.wait()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        return None
+    return stdout.decode("utf-8", "replace")
+
+async def run_ffmpeg(cmd, duration=None, on_process=None, on_progress=None, on_line=None,
+                     stall_timeout=None, timeout=None, priority=0, preempt="pause"):
+    """Coroutine counterpart of engine.run_ffmpeg
+
+    Takes the same callbacks and returns the same dict, plus timed_out when
+    the process was killed after timeout seconds in total. FFmpeg runs in
+    its own process group and takes part in encode windows and preemption
+    (priority, preempt) like any other encode. Cancelling the coroutine
+    kills the process group. The event loop reaps the child
+    itself, so cpu_time, peak_rss and io are the last values sampled from
+    /proc while it ran (None without /proc).
+    """
+    start_time = time.monotonic()
+    frames = None
+    last_activity = [start_time]
+    stalled = asyncio.Event()
+
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        **engine.popen_options(session=True))
+    preempted = engine.admit_process(process, priority, preempt)
+    if on_process is not None:
+        on_process(process)
+
+    async def watchdog():
+        while True:
+            await asyncio.sleep(min(5.0, stall_timeout / 4))
+            if process in engine._suspended:
+                last_activity[0] = time.monotonic()
+            elif time.monotonic() - last_activity[0] > stall_timeout:
+                stalled.set()
+                engine.kill_process(process)
+                return
+
+    usage = {"cpu": None, "peak_rss": None, "io": None}
+    sampled = [start_time]
+
+    def sample():
+        sampled[0] = time.monotonic()
+        usage["cpu"] = engine.read_proc_cpu(process.pid) or usage["cpu"]
+        usage["peak_rss"] = engine.read_proc_peak_rss(process.pid) or usage["peak_rss"]
+        usage["io"] = engine.read_proc_io(process.pid) or usage["io"]
+
+    async def read():
+        nonlocal frames
+        position = None
+        async for line in read_lines(process.stderr):
+            if time.monotonic() - sampled[0] >= engine.IO_SAMPLE_SECONDS:
+                sample()
+            progress = engine.parse_progress(line)
+            if progress is not None:
+                frames = progress.get("frame", frames)
+                current = (progress.get("frame"), progress.get("size"), progress.get("time"))
+                if current != position:
+                    position = current
+                    last_activity[0] = time.monotonic()
+                if on_progress is not None:
+                    on_progress(engine.add_estimates(progress, duration, time.monotonic() - start_time),
+                                line)
+            else:
+                if position is None:
+                    last_activity[0] = time.monotonic()
+                if on_line is not None:
+                    on_line(line)
+        # Last chance before the loop reaps it (a race: the earlier samples stand if lost)
+        sample()
+        await process.wait()
+
+    guard = asyncio.ensure_future(watchdog()) if stall_timeout else None
+    timed_out = False
+    try:
+        await asyncio.wait_for(read(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        engine.kill_process(process)
+        await process.wait()
+    except asyncio.CancelledError:
+        engine.kill_process(process)
+        await process.wait()
+        raise
+    finally:
+        if guard is not None:
+            guard.cancel()
+        engine.release_process(process)
+
+    user_time, sys_time = usage["cpu"] or (None, None)
+    return {
+        "exit_code": process.returncode,
+        "wall_time": round(time.monotonic() - start_time, 2),
+        "cpu_time": None if usage["cpu"] is None else round(user_time + sys_time, 2),
+        "user_time": user_time,
+        "sys_time": sys_time,
+        "frames": frames,
+        "peak_rss": usage["peak_rss"],
+        "io": usage["io"],
+        "stalled": stalled.is_set(),
+        "timed_out": timed_out,
+        "preempted": preempted,
+    }
+
+
+# ============ PROBING ============
+
+async def probe_duration(input_path, ffprobe=None):
+    output = await capture(engine.duration_probe_command(input_path, ffprobe))
+    try:
+        return float(output.strip())
+    except (AttributeError, ValueError):
+        return None
+
+async def probe_video(input_path, ffprobe=None):
+    return engine.parse_video_probe(await capture(engine.video_probe_command(input_path, ffprobe)))
+
+async def probe_has_audio(input_path, ffprobe=None):
+    output = await capture(engine.audio_probe_command(input_path, ffprobe), timeout=10)
+    return bool(output and output.strip())
+
+async def probe_videos(paths, ffprobe=None, limit=PROBE_LIMIT):
+    """Probe many files with up to limit ffprobe processes at once; returns {path: info}"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def probe(path):
+        async with semaphore:
+            return await probe_video(path, ffprobe)
+
+    return dict(zip(paths, await asyncio.gather(*(probe(path) for path in paths))))
+
+
+# ============ ENCODING ============
+
+async def encode(input_path, output_path, quality=50, preset=6, encoder="libsvtav1",
+                 audio_codec="libopus", audio_bitrate="128k", resolution=None, tune=0, grain=0,
+                 threads=0, crf=None, scratch_dir=None, stall_timeout=None, timeout=None,
+                 ffmpeg=None, ffprobe=None, on_note=None, on_command=None, on_process=None,
+                 on_progress=None, on_line=None, priority=0, preempt="pause"):
+    """Coroutine counterpart of engine.encode; returns an EncodeResult
+
+    Covers the straight encode (audio handling, staging and publishing)
+    without crop detection, decimation, retries or segments. timeout (seconds)
+    bounds the whole FFmpeg run; priority and preempt go to run_ffmpeg.
+    """
+    if crf is None:
+        crf = engine.quality_to_crf(quality)
+    has_audio = audio_codec == "none" or await probe_has_audio(input_path, ffprobe)
+    audio_codec, audio_bitrate, note = engine.resolve_audio(audio_codec, audio_bitrate,
+                                                            output_path, has_audio)
+    if note and on_note is not None:
+        on_note(note)
+
+    info = await probe_video(input_path, ffprobe)
+    part_path = engine.staging_path(output_path, scratch_dir)
+    cmd = engine.build_command(input_path, output_path, crf, preset=preset, encoder=encoder,
+                               audio_codec=audio_codec, audio_bitrate=audio_bitrate,
+                               resolution=resolution, tune=tune, grain=grain, threads=threads,
+                               frame_size=engine.output_frame_size(info, resolution),
+                               ffmpeg=ffmpeg)
+    cmd = engine.stage_command(cmd, part_path)
+    duration = info["duration"]
+    if on_command is not None:
+        on_command(cmd, duration)
+
+    engine.claim_part(part_path)
+    try:
+        try:
+            run = await run_ffmpeg(cmd, duration=duration, on_process=on_process,
+                                   on_progress=on_progress, on_line=on_line,
+                                   stall_timeout=stall_timeout, timeout=timeout,
+                                   priority=priority, preempt=preempt)
+        except OSError as e:
+            return engine.EncodeResult(input_path, output_path, None, command=cmd,
+                                       duration=duration, error=f"Could not start FFmpeg: {e}")
+        result = engine.EncodeResult(input_path, output_path, run["exit_code"], command=cmd,
+                                     duration=duration, wall_time=run["wall_time"],
+                                     cpu_time=run["cpu_time"], frames=run["frames"],
+                                     peak_rss=run["peak_rss"], user_time=run["user_time"],
+                                     sys_time=run["sys_time"], io=run["io"])
+        if run["stalled"]:
+            result.error = f"FFmpeg stalled (no progress for {stall_timeout:g}s)"
+        elif run["timed_out"]:
+            result.error = f"FFmpeg timed out after {engine.format_duration(timeout)}"
+        if result.ok:
+            try:
+                engine.publish(part_path, output_path)
+                result.size = os.path.getsize(output_path)
+            except OSError as e:
+                result.error = f"Could not publish output: {e}"
+        return result
+    finally:
+        engine.discard_part(part_path)
+
+
+# ============ SUPERVISOR ============
+
+class Supervisor:
+    """An asyncio event loop on one background thread, for callers that are not async
+
+    submit(coro) schedules a coroutine and returns a concurrent.futures.Future,
+    run(coro) waits for its result. With limit, at most that many submitted
+    coroutines run at a time and the rest wait their turn. cancel_all()
+    cancels everything submitted, which kills the processes they run.
+    """
+
+    def __init__(self, limit=None):
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+        self._tasks = set()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def _guarded(self, coro):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            if self._semaphore is None:
+                return await coro
+            async with self._semaphore:
+                return await coro
+        finally:
+            self._tasks.discard(task)
+
+    def submit(self, coro, on_done=None):
+        """Schedule coro; on_done(future) is called on the loop thread when it finishes"""
+        future = asyncio.run_coroutine_threadsafe(self._guarded(coro), self.loop)
+        if on_done is not None:
+            future.add_done_callback(on_done)
+        return future
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def cancel_all(self):
+        def cancel():
+            for task in list(self._tasks):
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel)
+
+    def close(self):
+        self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+def tk_callback(results, callback):
+    """on_done for Supervisor.submit that queues (callback, result) on results
+
+    Tk isn't thread-safe, so the loop thread never touches a widget; the GUI
+    drains results on its Tk thread and calls callback(result) there.
+    callback receives None when the coroutine failed or was cancelled.
+    """
+    def done(future):
+        try:
+            result = future.result()
+        except BaseException:
+            result = None
+        results.put((callback, result))
+    return done
@@ -0,0 +1,516 @@
+"""
+AV1 Encoder Pro - Distributed Encoding
+A coordinator that owns a batch's job queue and hands it out over HTTP, and
+a worker agent that leases jobs, encodes them and uploads the results.
+"""
+import hmac
+import http.server
+import ipaddress
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import av1_engine as engine
+
+# Seconds a lease lives without a heartbeat before its job is reassigned
+LEASE_SECONDS = 60
+
+# Leases (expired or failed) a job gets before it is given up
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker waits before asking for work again
+POLL_SECONDS = 5
+
+# Seconds the coordinator keeps answering "done" after the last job finished,
+# so idle workers learn the batch is over instead of seeing it disappear
+DONE_GRACE = 10
+
+COPY_CHUNK = 1024 * 1024
+
+# The coordinator only listens beyond this host when it has a token
+DEFAULT_HOST = "127.0.0.1"
+
+def is_loopback(host):
+    """True for addresses only this machine can reach (127.0.0.0/8, ::1, localhost)"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# ============ COORDINATOR ============
+
+class Coordinator:
+    """Own a batch's job queue and hand it out to workers over HTTP
+
+    jobs are dicts with input and output paths; settings (JSON-safe
+    encode_video options) go out with every lease. Workers POST /lease,
+    download GET /jobs/<id>/input, POST /jobs/<id>/heartbeat while encoding
+    and finish with PUT /jobs/<id>/result, POST /jobs/<id>/fail or, when the
+    Size Guard kept the original, POST /jobs/<id>/oversize (never requeued:
+    another worker would only get the same result). A lease
+    that is not renewed within lease_seconds is reassigned; a job fails for
+    good after max_attempts leases. Uploads are staged in scratch_dir (next
+    to the output by default) and published atomically. With token, every
+    request must carry it in X-AV1-Token; without one, anyone who can reach
+    the port could fetch the sources and upload outputs, so binding a host
+    other than a loopback address raises ValueError. on_event(event,
+    **fields) reports leased, expired, requeued, done, oversize and failed jobs.
+    """
+
+    def __init__(self, jobs, settings, host=DEFAULT_HOST, port=8765, lease_seconds=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, token=None, scratch_dir=None, on_event=None):
+        if not token and not is_loopback(host):
+            raise ValueError(f"refusing to listen on {host} without a token; "
+                             "set --token (or AV1_CLUSTER_TOKEN) on the coordinator and workers")
+        self.jobs = [dict(job, id=str(index), status="queued", attempts=0, worker=None, lease=None,
+                          progress=None)
+                     for index, job in enumerate(jobs, start=1)]
+        self._jobs_by_id = {job["id"]: job for job in self.jobs}
+        self.settings = settings
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.token = token
+        self.scratch_dir = scratch_dir
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._finished_at = None
+        self.server = http.server.ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def finished(self):
+        return all(job["status"] in ("done", "oversize", "failed") for job in self.jobs)
+
+    def run(self):
+        """Serve until every job is done or failed, then return the jobs"""
+        threading.Thread(target=self._reaper, daemon=True).start()
+        try:
+            self.server.serve_forever(poll_interval=0.5)
+        finally:
+            self.server.server_close()
+        return self.jobs
+
+    def _emit(self, event, job, **fields):
+        if self.on_event is not None:
+            self.on_event(event, input=job["input"], attempt=job["attempts"], **fields)
+
+    def _reaper(self):
+        while True:
+            time.sleep(1)
+            with self._lock:
+                self._expire()
+                if self.finished and self._finished_at is None:
+                    self._finished_at = time.monotonic()
+                done = self._finished_at is not None and \
+                    time.monotonic() - self._finished_at >= DONE_GRACE
+            if done:
+                self.server.shutdown()
+                return
+
+    def _expire(self):
+        now = time.monotonic()
+        for job in self.jobs:
+            if job["status"] == "leased" and job["lease"]["expires"] < now:
+                self._emit("expired", job, worker=job["worker"])
+                self._release(job, f"lease expired on {job['worker']}")
+
+    def _release(self, job, error):
+        """Requeue a job whose lease ended without a result (caller holds the lock)"""
+        job["lease"] = None
+        if job["attempts"] >= self.max_attempts:
+            job["status"] = "failed"
+            job["error"] = error
+            self._emit("failed", job, worker=job["worker"], error=error)
+        else:
+            job["status"] = "queued"
+            self._emit("requeued", job, worker=job["worker"], error=error)
+
+    def _lease(self, worker):
+        with self._lock:
+            self._expire()
+            job = next((job for job in self.jobs if job["status"] == "queued"), None)
+            if job is None:
+                return {"job": None, "done": self.finished}
+            job["status"] = "leased"
+            job["attempts"] += 1
+            job["worker"] = worker
+            job["progress"] = None
+            job["lease"] = {"token": uuid.uuid4().hex,
+                            "expires": time.monotonic() + self.lease_seconds}
+            self._emit("leased", job, worker=worker)
+            return {
+                "job": {
+                    "id": job["id"],
+                    "name": os.path.basename(job["input"]),
+                    "size": job.get("size"),
+                    "output_ext": os.path.splitext(job["output"])[1],
+                    "settings": self.settings,
+                },
+                "lease": job["lease"]["token"],
+                "lease_seconds": self.lease_seconds,
+            }
+
+    def _leased_job(self, job_id, lease):
+        """The job if lease is still its current lease (caller holds the lock)"""
+        job = self._jobs_by_id.get(job_id)
+        if job is None or job["status"] != "leased" or job["lease"]["token"] != lease:
+            return None
+        return job
+
+    def _heartbeat(self, job_id, lease, progress):
+        with self._lock:
+            job = self._leased_job(job_id, lease)
+            if job is None:
+                return False
+            job["lease"]["expires"] = time.monotonic() + self.lease_seconds
+            job["progress"] = progress
+            return True
+
+    def _fail(self, job_id, lease, error):
+        with self._lock:
+            job = self._leased_job(job_id, lease)
+            if job is None:
+                return False
+            self._release(job, error)
+            return True
+
+    def _oversize(self, job_id, lease, oversize):
+        with self._lock:
+            job = self._leased_job(job_id, lease)
+            if job is None:
+                return False
+            job.update(status="oversize", lease=None, oversize=oversize)
+            self._emit("oversize", job, worker=job["worker"], oversize=oversize)
+            return True
+
+    def _store_result(self, job_id, lease, stream, length, summary):
+        """Receive an encoded file; False when the lease was lost meanwhile"""
+        with self._lock:
+            job = self._leased_job(job_id, lease)
+            if job is None:
+                return False
+            output = job["output"]
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        part = engine.staging_path(output, self.scratch_dir)
+        engine.claim_part(part)
+        try:
+            with open(part, "wb") as f:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(COPY_CHUNK, remaining))
+                    if not chunk:
+                        raise OSError("upload ended early")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            with self._lock:
+                job = self._leased_job(job_id, lease)
+                if job is None:
+                    return False
+                # Out of the lease's reach while the file is moved into place
+                job["status"] = "publishing"
+            try:
+                engine.publish(part, output)
+            except OSError as e:
+                with self._lock:
+                    self._release(job, f"could not publish output: {e}")
+                raise
+            with self._lock:
+                job.update(status="done", lease=None, size=length, result=summary)
+                self._emit("done", job, worker=job["worker"], size=length,
+                           wall_time=summary.get("wall_time"))
+            return True
+        finally:
+            engine.discard_part(part)
+
+    def status(self):
+        """JSON-safe snapshot of the queue (GET /status)"""
+        with self._lock:
+            counts = {}
+            for job in self.jobs:
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {
+                "counts": counts,
+                "jobs": [{"id": job["id"], "input": job["input"], "status": job["status"],
+                          "worker": job["worker"], "attempts": job["attempts"],
+                          "progress": job["progress"]} for job in self.jobs],
+            }
+
+    def _handler_class(self):
+        coordinator = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, payload=None):
+                body = json.dumps(payload if payload is not None else {}).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self):
+                given = (self.headers.get("X-AV1-Token") or "").encode("utf-8")
+                expected = (coordinator.token or "").encode("utf-8")
+                if coordinator.token and not hmac.compare_digest(given, expected):
+                    self._reply(403, {"error": "bad token"})
+                    return False
+                return True
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _route(self):
+                """(job_id, action) for /jobs/<id>/<action>, else (None, path)"""
+                parts = urllib.parse.urlparse(self.path).path.strip("/").split("/")
+                if len(parts) == 3 and parts[0] == "jobs":
+                    return parts[1], parts[2]
+                return None, "/".join(parts)
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                job_id, action = self._route()
+                if job_id is None and action == "status":
+                    self._reply(200, coordinator.status())
+                elif action == "input":
+                    with coordinator._lock:
+                        job = coordinator._leased_job(job_id, self.headers.get("X-AV1-Lease"))
+                    if job is None:
+                        self._reply(409, {"error": "lease lost"})
+                        return
+                    try:
+                        f = open(job["input"], "rb")
+                    except OSError as e:
+                        self._reply(500, {"error": str(e)})
+                        return
+                    with f:
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/octet-stream")
+                        self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                        self.end_headers()
+                        shutil.copyfileobj(f, self.wfile, COPY_CHUNK)
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                job_id, action = self._route()
+                try:
+                    body = self._body()
+                except ValueError:
+                    self._reply(400, {"error": "invalid JSON"})
+                    return
+                if job_id is None and action == "lease":
+                    self._reply(200, coordinator._lease(body.get("worker") or self.client_address[0]))
+                elif action == "heartbeat":
+                    ok = coordinator._heartbeat(job_id, body.get("lease"), body.get("progress"))
+                    self._reply(200 if ok else 409)
+                elif action == "fail":
+                    ok = coordinator._fail(job_id, body.get("lease"), body.get("error") or "failed")
+                    self._reply(200 if ok else 409)
+                elif action == "oversize":
+                    ok = coordinator._oversize(job_id, body.get("lease"), body.get("oversize"))
+                    self._reply(200 if ok else 409)
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_PUT(self):
+                if not self._authorized():
+                    return
+                job_id, action = self._route()
+                if action != "result":
+                    self._reply(404, {"error": "not found"})
+                    return
+                try:
+                    summary = json.loads(self.headers.get("X-AV1-Summary") or "{}")
+                    stored = coordinator._store_result(job_id, self.headers.get("X-AV1-Lease"),
+                                                       self.rfile,
+                                                       int(self.headers.get("Content-Length") or 0),
+                                                       summary)
+                except (OSError, ValueError) as e:
+                    self._reply(500, {"error": str(e)})
+                    return
+                self._reply(200 if stored else 409)
+
+        return Handler
+
+
+# ============ WORKER ============
+
+class LeaseLost(Exception):
+    """The coordinator gave the job to someone else"""
+
+
+class IncompleteDownload(OSError):
+    """The source arrived shorter than its Content-Length"""
+
+
+class WorkerAgent:
+    """Lease jobs from a coordinator and encode them until the batch is done
+
+    encode(source, output, settings, on_progress) encodes one leased job
+    locally and returns a result dict (status, error, wall_time, ...).
+    Sources are downloaded to scratch_dir (a temp folder by default) and
+    removed with the output once uploaded. While a job runs, a heartbeat
+    renews its lease with the latest progress; if the lease is lost the
+    encode is killed. A source that arrives short of its Content-Length is
+    handed back with /fail instead of being encoded. on_event(event, **fields) reports what the agent
+    does. An unreachable coordinator is retried for up to wait seconds.
+    """
+
+    def __init__(self, coordinator, encode, name=None, scratch_dir=None, token=None,
+                 poll=POLL_SECONDS, wait=300, on_event=None):
+        self.coordinator = coordinator.rstrip("/")
+        self.encode = encode
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.scratch_dir = scratch_dir
+        self.token = token
+        self.poll = poll
+        self.wait = wait
+        self.on_event = on_event
+        self.completed = 0
+        self.kept = 0
+        self.failed = 0
+
+    def _emit(self, event, **fields):
+        if self.on_event is not None:
+            self.on_event(event, worker=self.name, **fields)
+
+    def _request(self, method, path, payload=None, data=None, headers=None, timeout=60):
+        headers = dict(headers or {})
+        if self.token:
+            headers["X-AV1-Token"] = self.token
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.coordinator + path, data=data, method=method,
+                                         headers=headers)
+        return urllib.request.urlopen(request, timeout=timeout)
+
+    def _call(self, method, path, payload=None):
+        with self._request(method, path, payload) as response:
+            return json.loads(response.read() or b"{}")
+
+    def run(self):
+        """Work until the coordinator reports the batch done; returns jobs completed"""
+        unreachable_since = None
+        while True:
+            try:
+                lease = self._call("POST", "/lease", {"worker": self.name})
+            except urllib.error.HTTPError as e:
+                self._emit("error", error=f"coordinator refused the lease: {e}")
+                return self.completed
+            except (urllib.error.URLError, OSError) as e:
+                unreachable_since = unreachable_since or time.monotonic()
+                if time.monotonic() - unreachable_since > self.wait:
+                    self._emit("unreachable", error=str(e))
+                    return self.completed
+                time.sleep(self.poll)
+                continue
+            unreachable_since = None
+            if lease["job"] is None:
+                if lease["done"]:
+                    self._emit("finished", completed=self.completed, kept=self.kept,
+                               failed=self.failed)
+                    return self.completed
+                time.sleep(self.poll)
+                continue
+            self._run_job(lease["job"], lease["lease"], lease["lease_seconds"])
+
+    def _run_job(self, job, lease, lease_seconds):
+        workdir = tempfile.mkdtemp(prefix=f"av1-job{job['id']}-", dir=self.scratch_dir)
+        source = os.path.join(workdir, job["name"])
+        output = os.path.join(workdir, os.path.splitext(job["name"])[0] + job["output_ext"])
+        headers = {"X-AV1-Lease": lease}
+        progress = {}
+        lost = threading.Event()
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(max(1.0, lease_seconds / 3)):
+                try:
+                    self._call("POST", f"/jobs/{job['id']}/heartbeat",
+                               {"lease": lease, "progress": dict(progress)})
+                except urllib.error.HTTPError as e:
+                    if e.code == 409:
+                        lost.set()
+                        # This agent runs one job at a time: its FFmpeg is the only one
+                        engine.terminate_all()
+                        return
+                except (urllib.error.URLError, OSError):
+                    pass  # Coordinator briefly unreachable; the lease may still hold
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            self._emit("job", input=job["name"], job=job["id"])
+            with self._request("GET", f"/jobs/{job['id']}/input", headers=headers) as response, \
+                    open(source, "wb") as f:
+                shutil.copyfileobj(response, f, COPY_CHUNK)
+                expected = response.headers.get("Content-Length")
+                if expected is not None and f.tell() != int(expected):
+                    raise IncompleteDownload(f"source download ended after {f.tell()} of "
+                                             f"{expected} bytes")
+            result = self.encode(source, output, job["settings"], progress.update)
+            if lost.is_set():
+                raise LeaseLost()
+            if result.get("status") == "ok":
+                summary = {key: result.get(key) for key in ("wall_time", "cpu_time", "user_time",
+                                                            "sys_time", "frames", "peak_rss", "io")}
+                with open(output, "rb") as f:
+                    upload = dict(headers, **{"X-AV1-Summary": json.dumps(summary),
+                                              "Content-Length": str(os.path.getsize(output))})
+                    self._request("PUT", f"/jobs/{job['id']}/result", data=f, headers=upload,
+                                  timeout=600).close()
+                self.completed += 1
+            elif result.get("status") == "oversize":
+                self._call("POST", f"/jobs/{job['id']}/oversize",
+                           {"lease": lease, "oversize": result.get("oversize")})
+                self.kept += 1
+            else:
+                self._call("POST", f"/jobs/{job['id']}/fail",
+                           {"lease": lease, "error": result.get("error") or
+                            f"exit code {result.get('exit_code')}"})
+                self.failed += 1
+        except (LeaseLost, urllib.error.HTTPError) as e:
+            if lost.is_set() or getattr(e, "code", None) == 409:
+                self._emit("lease_lost", input=job["name"], job=job["id"])
+            else:
+                self._emit("error", input=job["name"], job=job["id"], error=str(e))
+            self.failed += 1
+        except IncompleteDownload as e:
+            # Hand the job back now rather than encoding a truncated source
+            self._emit("error", input=job["name"], job=job["id"], error=str(e))
+            self.failed += 1
+            try:
+                self._call("POST", f"/jobs/{job['id']}/fail", {"lease": lease, "error": str(e)})
+            except (urllib.error.URLError, OSError):
+                pass  # The lease expires instead
+        except (urllib.error.URLError, OSError) as e:
+            # The lease expires on the coordinator and the job is reassigned
+            self._emit("error", input=job["name"], job=job["id"], error=str(e))
+            self.failed += 1
+        finally:
+            stop.set()
+            beat.join()
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -1,16 +1,24 @@
 # AV1 Video Encoder Pro
 # Professional AV1 video encoding application
 
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import customtkinter as ctk
 import tkinter as tk
-from PIL import Image
 import os
 import sys
 import subprocess
 import threading
 import queue
 import datetime
-import webbrowser
+import sqlite3
+
+import av1_async
+import av1_engine as engine
+
+# Seconds from launch until the window is responsive before we warn in the console
+STARTUP_BUDGET = 1.0
 
 # Platform detection for cross-platform compatibility
 IS_WINDOWS = sys.platform == 'win32'
@@ -42,6 +50,72 @@ COLORS = {
 }
 
 
+class VirtualListView(ctk.CTkFrame):
+    """Scrollable list that renders only its visible rows
+    
+    A fixed pool of row labels is re-pointed at a window of the backing
+    list on scroll, so the widget cost stays constant no matter how many
+    items the list holds.
+    """
+    
+    def __init__(self, master, rows=8, row_height=18, **kwargs):
+        super().__init__(master, **kwargs)
+        self.items = []
+        self.offset = 0
+        self.rows = rows
+        
+        body = ctk.CTkFrame(self, fg_color="transparent")
+        body.pack(side="left", fill="both", expand=True, padx=(8, 0), pady=4)
+        self.labels = []
+        for _ in range(rows):
+            label = ctk.CTkLabel(body, text="", anchor="w", height=row_height,
+                                 font=ctk.CTkFont(size=11), text_color="white")
+            label.pack(fill="x")
+            self.labels.append(label)
+        
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        
+        for widget in [self, body] + self.labels:
+            widget.bind("<MouseWheel>", self._on_wheel)
+            widget.bind("<Button-4>", lambda e: self.scroll_by(-3))
+            widget.bind("<Button-5>", lambda e: self.scroll_by(3))
+    
+    def set_items(self, items):
+        """Point the view at a (live) list and redraw"""
+        self.items = items
+        self.refresh()
+    
+    def refresh(self):
+        total = len(self.items)
+        self.offset = max(0, min(self.offset, total - self.rows))
+        for i, label in enumerate(self.labels):
+            index = self.offset + i
+            text = f"{index + 1:>6}  {self.items[index]}" if index < total else ""
+            if label.cget("text") != text:
+                label.configure(text=text)
+        if total <= self.rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.rows) / total)
+    
+    def scroll_by(self, rows):
+        self.offset += rows
+        self.refresh()
+    
+    def _on_wheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+    
+    def _on_scrollbar(self, *args):
+        # Tk scrollbar protocol: ("moveto", fraction) or ("scroll", n, "units"|"pages")
+        if args and args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.items))
+        elif args and args[0] == "scroll":
+            step = self.rows if len(args) > 2 and args[2] == "pages" else 1
+            self.offset += int(args[1]) * step
+        self.refresh()
+
+
 class AV1EncoderPro(ctk.CTk):
     @staticmethod
     def resource_path(relative_path):
@@ -68,10 +142,19 @@ class AV1EncoderPro(ctk.CTk):
         except (OSError, tk.TclError):
             pass  # Icon not critical
         
-        # Console queue
+        # Console queue, plus supervisor results waiting for the Tk thread
         self.console_queue = queue.Queue()
+        self.callback_queue = queue.Queue()
         self.after(100, self.process_console_queue)
         
+        # Track active encoding processes for cleanup
+        self.active_processes = []
+        # One threading.Event per running engine.encode, set by Cancel
+        self.active_cancels = []
+        
+        # One event loop thread runs the ffprobe calls the UI waits on
+        self.supervisor = av1_async.Supervisor()
+        
         # Build UI
         self.build_tabs()
         
@@ -79,50 +162,49 @@ class AV1EncoderPro(ctk.CTk):
         self.tab_container = ctk.CTkFrame(self, fg_color="transparent")
         self.tab_container.pack(fill="both", expand=True, padx=25)
         
-        # Create all tab content frames
+        # Tab content frames are built on first visit (see ensure_tab)
         self.tab_frames = {}
+        self.tab_builders = {
+            "Video Encoder": self.build_video_encoder_tab,
+            "Batch Processing": self.build_batch_tab,
+            "Scheduler": self.build_scheduler_tab,
+            "Settings": self.build_settings_tab,
+            "About": self.build_about_tab,
+        }
         self.current_tab = "Video Encoder"
         
-        # Video Encoder tab (main content)
-        self.build_video_encoder_tab()
-        
-        # Other tabs
-        self.build_batch_tab()
-        self.build_scheduler_tab()
-        self.build_settings_tab()
-        self.build_about_tab()
-        
         # Show Video Encoder by default
         self.show_tab("Video Encoder")
         
         # Console at bottom
         self.build_console()
         
-        # Check FFmpeg
+        # Check FFmpeg (version probe runs in the background)
         self.check_ffmpeg()
         
-        # Track active encoding processes for cleanup
-        self.active_processes = []
-        
         # Setup Drag and Drop (Windows only)
         if windnd is not None:
             windnd.hook_dropfiles(self, func=self.on_drop)
         
         # Handle window close - kill running processes
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        
+        # Report startup time once the event loop is idle (window responsive)
+        self.after_idle(self._report_startup_time)
+    
+    def _report_startup_time(self):
+        elapsed = time.perf_counter() - _STARTUP_T0
+        if elapsed > STARTUP_BUDGET:
+            self.log(f"[WARNING] Startup took {elapsed:.2f}s (budget {STARTUP_BUDGET:.1f}s)")
+        else:
+            self.log(f"[INFO] Ready in {elapsed:.2f}s")
     
     def on_closing(self):
         """Clean up running processes when window is closed"""
         for proc in self.active_processes:
-            try:
-                if proc.poll() is None:  # Process still running
-                    proc.terminate()
-                    proc.wait(timeout=2)
-            except (OSError, subprocess.TimeoutExpired):
-                try:
-                    proc.kill()  # Force kill if terminate fails
-                except OSError:
-                    pass
+            if proc.poll() is None:  # Process still running
+                engine.kill_process(proc)
+        self.supervisor.close()
         self.destroy()
     
     def on_drop(self, filenames):
@@ -139,32 +221,7 @@ class AV1EncoderPro(ctk.CTk):
         
         # Check if we're on Batch Processing tab
         if self.current_tab == "Batch Processing":
-            video_extensions = ('.mp4', '.mkv', '.avi', '.mov', '.webm', '.wmv', '.flv')
-            added_count = 0
-            
-            for path in paths:
-                if os.path.isdir(path):
-                    # It's a folder - recursively add all video files inside
-                    self.log(f"[INFO] Folder dropped: {path}")
-                    for root, dirs, files in os.walk(path):
-                        for f in files:
-                            if f.lower().endswith(video_extensions):
-                                full_path = os.path.join(root, f)
-                                if full_path not in self.batch_files:
-                                    self.batch_files.append(full_path)
-                                    self.batch_listbox.insert("end", full_path + "\n")
-                                    added_count += 1
-                elif os.path.isfile(path) and path.lower().endswith(video_extensions):
-                    # It's a video file
-                    if path not in self.batch_files:
-                        self.batch_files.append(path)
-                        self.batch_listbox.insert("end", path + "\n")
-                        added_count += 1
-            
-            if added_count > 0:
-                self.log(f"[INFO] Added {added_count} files to batch queue.")
-            else:
-                self.log("[INFO] No video files found in dropped items.")
+            self.start_batch_scan(paths)
             return
         
         # Default: Video Encoder tab - single file behavior
@@ -219,8 +276,14 @@ class AV1EncoderPro(ctk.CTk):
                 btn.configure(fg_color="transparent", text_color=COLORS['text_dim'])
         self.show_tab(name)
     
+    def ensure_tab(self, name):
+        """Build a tab's content the first time it is needed"""
+        if name not in self.tab_frames:
+            self.tab_builders[name]()
+    
     def show_tab(self, name):
         """Show/hide tab content frames"""
+        self.ensure_tab(name)
         for tab_name, frame in self.tab_frames.items():
             if tab_name == name:
                 frame.pack(fill="both", expand=True)
@@ -269,11 +332,22 @@ class AV1EncoderPro(ctk.CTk):
                     font=ctk.CTkFont(size=12),
                     text_color=COLORS['text_dim']).pack(anchor="w", padx=15, pady=(0, 15))
         
+        # Ordered queue plus a path -> size index for O(1) dedup and totals
         self.batch_files = []
-        self.batch_listbox = ctk.CTkTextbox(card, height=150,
-                                            fg_color=COLORS['input'],
-                                            text_color="white")
-        self.batch_listbox.pack(fill="x", padx=15, pady=(0, 10))
+        self.batch_index = {}
+        self.batch_total_bytes = 0
+        self.scan_queue = queue.Queue()
+        self.scan_generation = 0
+        self.scans_active = 0
+        
+        self.batch_listbox = VirtualListView(card, rows=8, fg_color=COLORS['input'])
+        self.batch_listbox.pack(fill="x", padx=15, pady=(0, 4))
+        self.batch_listbox.set_items(self.batch_files)
+        
+        self.batch_count_label = ctk.CTkLabel(card, text="0 files",
+                                              font=ctk.CTkFont(size=10),
+                                              text_color=COLORS['text_dim'])
+        self.batch_count_label.pack(anchor="w", padx=15, pady=(0, 10))
         
         # Save to Folder option
         save_row = ctk.CTkFrame(card, fg_color="transparent")
@@ -296,6 +370,50 @@ class AV1EncoderPro(ctk.CTk):
                      text_color="white", width=70, height=30,
                      corner_radius=4, command=self.batch_browse_output).pack(side="right")
         
+        # Processing order (probed duration x resolution x preset)
+        order_row = ctk.CTkFrame(card, fg_color="transparent")
+        order_row.pack(fill="x", padx=15, pady=(0, 10))
+        
+        ctk.CTkLabel(order_row, text="Order:",
+                    font=ctk.CTkFont(size=11),
+                    text_color=COLORS['text']).pack(side="left")
+        
+        self.batch_order_var = ctk.StringVar(value="As added")
+        ctk.CTkOptionMenu(order_row, variable=self.batch_order_var,
+                         values=["As added", "Shortest first", "Longest first"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=140, height=28).pack(side="left", padx=(10, 0))
+        
+        # Copy upcoming inputs to the scratch disk while the current one encodes
+        self.batch_prefetch_var = ctk.StringVar(value="Off")
+        ctk.CTkOptionMenu(order_row, variable=self.batch_prefetch_var,
+                         values=["Off", "1 file", "2 files", "3 files"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=100, height=28).pack(side="right")
+        
+        ctk.CTkLabel(order_row, text="Prefetch:",
+                    font=ctk.CTkFont(size=11),
+                    text_color=COLORS['text']).pack(side="right", padx=(0, 10))
+        
+        # Per-title analysis: CRF within +/-6 of the slider, preset within +/-2
+        auto_row = ctk.CTkFrame(card, fg_color="transparent")
+        auto_row.pack(fill="x", padx=15, pady=(0, 10))
+        
+        self.batch_auto_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(auto_row, text="Auto CRF/Preset per Title",
+                     variable=self.batch_auto_var,
+                     font=ctk.CTkFont(size=11),
+                     text_color=COLORS['text'],
+                     fg_color=COLORS['text_dim'],
+                     progress_color=COLORS['accent'],
+                     button_color="white").pack(side="left")
+        
+        ctk.CTkLabel(auto_row, text="CRF ±6, preset ±2 around the sliders; grain up to the Film Grain value",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(side="left", padx=(15, 0))
+        
         # Schedule toggle row
         schedule_row = ctk.CTkFrame(card, fg_color="transparent")
         schedule_row.pack(fill="x", padx=15, pady=(0, 10))
@@ -336,6 +454,7 @@ class AV1EncoderPro(ctk.CTk):
     
     def toggle_schedule(self):
         """Toggle schedule mode and update display"""
+        self.ensure_tab("Scheduler")
         if self.schedule_enabled_var.get():
             # Get time from scheduler tab
             hour = self.schedule_hour.get() or "00"
@@ -354,6 +473,13 @@ class AV1EncoderPro(ctk.CTk):
         if folder:
             self.batch_output_var.set(folder)
     
+    def browse_scratch(self):
+        """Browse for the scratch folder used for in-progress encodes"""
+        from tkinter import filedialog
+        folder = filedialog.askdirectory()
+        if folder:
+            self.scratch_var.set(folder)
+    
     def build_scheduler_tab(self):
         """Scheduler tab - Set time for scheduled batch encoding"""
         frame = ctk.CTkFrame(self.tab_container, fg_color="transparent")
@@ -419,6 +545,59 @@ class AV1EncoderPro(ctk.CTk):
                     text="Enable 'Schedule Encoding' in Batch Processing tab to use this time",
                     font=ctk.CTkFont(size=10),
                     text_color=COLORS['text_dim']).pack(anchor="w")
+        
+        # Recurring windows card (saved across restarts)
+        saved = engine.load_schedule()
+        windows_card = ctk.CTkFrame(frame, fg_color=COLORS['card'], corner_radius=6,
+                                   border_width=1, border_color=COLORS['border'])
+        windows_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(windows_card, text="Encode Windows",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(windows_card, text="Batches only encode inside these recurring windows, e.g. \"mon-fri 22:00-07:00; sat-sun\"",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        self.windows_var = ctk.StringVar(value=saved.get("windows", "mon-fri 22:00-07:00; sat-sun"))
+        ctk.CTkEntry(windows_card, textvariable=self.windows_var,
+                    fg_color=COLORS['input'], border_width=1,
+                    border_color=COLORS['text_dim'],
+                    text_color="white", height=30).pack(fill="x", padx=12, pady=(0, 8))
+        
+        windows_row = ctk.CTkFrame(windows_card, fg_color="transparent")
+        windows_row.pack(fill="x", padx=12, pady=(0, 8))
+        
+        self.windows_enabled_var = ctk.BooleanVar(value=saved.get("enabled", False))
+        ctk.CTkSwitch(windows_row, text="Use encode windows",
+                     variable=self.windows_enabled_var,
+                     font=ctk.CTkFont(size=11),
+                     text_color=COLORS['text'],
+                     fg_color=COLORS['text_dim'],
+                     progress_color=COLORS['accent'],
+                     button_color="white").pack(side="left")
+        
+        self.window_close_var = ctk.StringVar(
+            value="Throttle to 1 core" if saved.get("on_close") == "throttle" else "Pause encodes")
+        ctk.CTkOptionMenu(windows_row, variable=self.window_close_var,
+                         values=["Pause encodes", "Throttle to 1 core"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=150, height=28).pack(side="right")
+        
+        ctk.CTkLabel(windows_row, text="Outside a window:",
+                    font=ctk.CTkFont(size=11),
+                    text_color=COLORS['text']).pack(side="right", padx=(0, 10))
+        
+        self.windows_status = ctk.CTkLabel(windows_card, text="",
+                                          font=ctk.CTkFont(size=10),
+                                          text_color=COLORS['text_dim'])
+        self.windows_status.pack(anchor="w", padx=12, pady=(0, 12))
+        
+        for var in (self.windows_var, self.windows_enabled_var, self.window_close_var):
+            var.trace_add("write", lambda *_: self._save_windows())
+        self._save_windows(persist=False)
 
     def build_settings_tab(self):
         """Settings tab with encoder options and threading"""
@@ -460,6 +639,7 @@ class AV1EncoderPro(ctk.CTk):
             
             rb = ctk.CTkRadioButton(row, text=name, variable=self.encoder_var,
                                    value=value, font=ctk.CTkFont(size=11),
+                                   command=self.update_summary,
                                    text_color=COLORS['text'],
                                    fg_color=COLORS['accent'],
                                    hover_color="#6b3fd4",
@@ -506,6 +686,7 @@ class AV1EncoderPro(ctk.CTk):
             v = int(float(val))
             self.thread_var.set(v)
             self.thread_label.configure(text="Auto" if v == 0 else str(v))
+            self.update_summary()
         
         thread_slider = ctk.CTkSlider(thread_row, from_=0, to=max_threads,
                                      number_of_steps=max_threads,
@@ -522,6 +703,162 @@ class AV1EncoderPro(ctk.CTk):
                     font=ctk.CTkFont(size=9),
                     text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 12))
         
+        # === SCRATCH DISK ===
+        scratch_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
+                                   border_width=1, border_color=COLORS['border'])
+        scratch_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(scratch_card, text="Scratch Disk",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(scratch_card, text="Encodes are written here as .part files and moved to the output folder when finished",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        scratch_row = ctk.CTkFrame(scratch_card, fg_color="transparent")
+        scratch_row.pack(fill="x", padx=12, pady=(0, 12))
+        
+        self.scratch_var = ctk.StringVar()
+        ctk.CTkEntry(scratch_row, textvariable=self.scratch_var,
+                    fg_color=COLORS['input'], border_width=1,
+                    border_color=COLORS['text_dim'],
+                    text_color="white", height=30,
+                    placeholder_text="Next to the output (default)").pack(side="left", fill="x", expand=True, padx=(0, 8))
+        
+        ctk.CTkButton(scratch_row, text="Browse",
+                     fg_color=COLORS['input'], hover_color="#2d333b",
+                     text_color="white", width=70, height=30,
+                     corner_radius=4, command=self.browse_scratch).pack(side="right")
+        
+        # === STALL WATCHDOG ===
+        watchdog_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
+                                    border_width=1, border_color=COLORS['border'])
+        watchdog_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(watchdog_card, text="Stall Watchdog",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(watchdog_card, text="Kill an encode that stops making progress (hung network share, GPU driver) and retry it",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        watchdog_row = ctk.CTkFrame(watchdog_card, fg_color="transparent")
+        watchdog_row.pack(fill="x", padx=12, pady=(0, 8))
+        
+        ctk.CTkLabel(watchdog_row, text="No progress for:",
+                    font=ctk.CTkFont(size=11),
+                    text_color=COLORS['text']).pack(side="left")
+        
+        self.stall_var = ctk.StringVar(value="Off")
+        ctk.CTkOptionMenu(watchdog_row, variable=self.stall_var,
+                         values=["Off", "2 min", "5 min", "10 min", "30 min"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=100, height=28).pack(side="left", padx=(10, 0))
+        
+        self.retry_var = ctk.StringVar(value="No retry")
+        ctk.CTkOptionMenu(watchdog_row, variable=self.retry_var,
+                         values=["No retry", "1 retry", "2 retries", "3 retries"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=110, height=28).pack(side="right")
+        
+        ctk.CTkLabel(watchdog_row, text="Then:",
+                    font=ctk.CTkFont(size=11),
+                    text_color=COLORS['text']).pack(side="right", padx=(0, 10))
+        
+        self.fallback_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(watchdog_card, text="Retry GPU encodes with SVT-AV1, CPU encodes two presets faster",
+                     variable=self.fallback_var,
+                     font=ctk.CTkFont(size=11),
+                     text_color=COLORS['text'],
+                     fg_color=COLORS['text_dim'],
+                     progress_color=COLORS['accent'],
+                     button_color="white").pack(anchor="w", padx=12, pady=(0, 8))
+        
+        self.resumable_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(watchdog_card, text="Resumable: encode in ~5 min segments so a crashed or cancelled encode picks up where it stopped",
+                     variable=self.resumable_var,
+                     font=ctk.CTkFont(size=11),
+                     text_color=COLORS['text'],
+                     fg_color=COLORS['text_dim'],
+                     progress_color=COLORS['accent'],
+                     button_color="white").pack(anchor="w", padx=12, pady=(0, 12))
+        
+        # === SIZE GUARD ===
+        guard_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
+                                 border_width=1, border_color=COLORS['border'])
+        guard_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(guard_card, text="Size Guard",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(guard_card, text="Abort encodes projected to end up larger than this share of the source",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        guard_row = ctk.CTkFrame(guard_card, fg_color="transparent")
+        guard_row.pack(fill="x", padx=12, pady=(0, 12))
+        
+        self.max_ratio_var = ctk.StringVar(value="Off")
+        ctk.CTkOptionMenu(guard_row, variable=self.max_ratio_var,
+                         values=["Off", "100%", "90%", "75%", "50%"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=100, height=28).pack(side="left")
+        
+        self.oversize_var = ctk.StringVar(value="Keep the original")
+        ctk.CTkOptionMenu(guard_row, variable=self.oversize_var,
+                         values=["Keep the original", f"Retry at CRF +{engine.OVERSIZE_CRF_STEP}"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=170, height=28).pack(side="right")
+        
+        # === PROFILING ===
+        profile_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
+                                   border_width=1, border_color=COLORS['border'])
+        profile_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(profile_card, text="Profiling",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(profile_card, text=f"Time every stage and save a Chrome/Perfetto trace to {engine.TRACE_DIR}",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        self.profile_var = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(profile_card, text="Profile encodes (stage summary in the console)",
+                     variable=self.profile_var,
+                     font=ctk.CTkFont(size=11),
+                     text_color=COLORS['text'],
+                     fg_color=COLORS['text_dim'],
+                     progress_color=COLORS['accent'],
+                     button_color="white").pack(anchor="w", padx=12, pady=(0, 12))
+        
+        # === INTERACTIVE PRIORITY ===
+        priority_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
+                                    border_width=1, border_color=COLORS['border'])
+        priority_card.pack(fill="x", pady=(0, 10))
+        
+        ctk.CTkLabel(priority_card, text="Interactive Priority",
+                    font=ctk.CTkFont(size=14, weight="bold"),
+                    text_color="white").pack(anchor="w", padx=12, pady=(12, 4))
+        
+        ctk.CTkLabel(priority_card, text="What a running batch does while an encode from the Video Encoder tab runs",
+                    font=ctk.CTkFont(size=10),
+                    text_color=COLORS['text_dim']).pack(anchor="w", padx=12, pady=(0, 8))
+        
+        self.preempt_var = ctk.StringVar(value="Pause the batch")
+        ctk.CTkOptionMenu(priority_card, variable=self.preempt_var,
+                         values=["Pause the batch", "Shrink the batch to 1 core", "Share cores"],
+                         fg_color=COLORS['input'], button_color=COLORS['input'],
+                         button_hover_color="#2d333b", dropdown_fg_color=COLORS['card'],
+                         width=200, height=28).pack(anchor="w", padx=12, pady=(0, 12))
+        
         # === GPU INFO ===
         gpu_card = ctk.CTkFrame(scroll, fg_color=COLORS['card'], corner_radius=6,
                                border_width=1, border_color=COLORS['border'])
@@ -557,8 +894,9 @@ class AV1EncoderPro(ctk.CTk):
         card = ctk.CTkFrame(frame, fg_color="transparent", corner_radius=0)
         card.pack(fill="both", expand=True, pady=(0, 10))
         
-        # Logo at original dimensions
+        # Logo at original dimensions (PIL is only loaded when this tab is first shown)
         try:
+            from PIL import Image
             # Use cleaned transparent logo if available
             # Prioritize assets folder path
             logo_name = "assets/av1_codec_logo.png"
@@ -598,35 +936,101 @@ class AV1EncoderPro(ctk.CTk):
                                   text_color=COLORS['text'],
                                   hover_color="#30363d",
                                   width=140, height=32,
-                                  command=lambda: webbrowser.open("https://github.com/3453-315h"))
+                                  command=self.open_github)
         github_btn.pack(pady=(0, 20))
         
         ctk.CTkLabel(card, text=f"© {datetime.datetime.now().year} AV1 Encoder Pro",
                     font=ctk.CTkFont(size=10),
                     text_color=COLORS['text_dim']).pack(pady=(10, 20))
     
+    def open_github(self):
+        import webbrowser
+        webbrowser.open("https://github.com/3453-315h")
+    
     def batch_add_folder(self):
         from tkinter import filedialog
         folder = filedialog.askdirectory()
         if not folder:
             return
-            
-        video_exts = {".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".wmv"}
-        count = 0
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if os.path.splitext(file.lower())[1] in video_exts:
-                    full_path = os.path.join(root, file)
-                    if full_path not in self.batch_files:
-                        self.batch_files.append(full_path)
-                        self.batch_listbox.insert("end", full_path + "\n")
-                        count += 1
-                        
-        self.log(f"[INFO] Added {count} files from folder.")
+        self.start_batch_scan([folder])
+    
+    def start_batch_scan(self, paths):
+        """Scan files/folders for videos on a worker thread, adding results incrementally"""
+        for path in paths:
+            if os.path.isdir(path):
+                self.log(f"[INFO] Scanning folder: {path}")
+        if self.scans_active == 0:
+            self.after(100, self._poll_scan_queue)
+        self.scans_active += 1
+        threading.Thread(target=self._scan_worker, args=(list(paths), self.scan_generation),
+                         daemon=True).start()
+    
+    def _scan_worker(self, paths, generation):
+        """Walk the given paths and post (path, size) chunks to the scan queue
+
+        A path that vanished or can't be read is logged and skipped; the final
+        (generation, None) always follows so the poller stops.
+        """
+        chunk = []
+        last_flush = time.monotonic()
+        try:
+            for path in paths:
+                try:
+                    if os.path.isdir(path):
+                        found = engine.discover_videos(path)
+                    elif os.path.isfile(path) and path.lower().endswith(engine.VIDEO_EXTENSIONS):
+                        found = [(path, os.path.getsize(path))]
+                    else:
+                        found = []
+                    for entry in found:
+                        chunk.append(entry)
+                        if len(chunk) >= 500 or time.monotonic() - last_flush > 0.25:
+                            self.scan_queue.put((generation, chunk))
+                            chunk = []
+                            last_flush = time.monotonic()
+                except OSError as e:
+                    self.log(f"[WARNING] Skipped {path}: {e}")
+            self.scan_queue.put((generation, chunk))
+        finally:
+            self.scan_queue.put((generation, None))
+    
+    def _poll_scan_queue(self):
+        """Merge scanned chunks into the batch queue on the Tk thread"""
+        try:
+            while True:
+                generation, chunk = self.scan_queue.get_nowait()
+                if chunk is None:
+                    self.scans_active -= 1
+                    if generation == self.scan_generation:
+                        self.log(f"[INFO] Scan finished: {len(self.batch_files)} files in batch queue.")
+                elif generation == self.scan_generation:
+                    self._add_batch_entries(chunk)
+        except queue.Empty:
+            pass
+        if self.scans_active > 0:
+            self.after(100, self._poll_scan_queue)
+    
+    def _add_batch_entries(self, entries):
+        for path, size in entries:
+            if path not in self.batch_index:
+                self.batch_index[path] = size
+                self.batch_files.append(path)
+                self.batch_total_bytes += size
+        self._update_batch_view()
+    
+    def _update_batch_view(self):
+        self.batch_listbox.refresh()
+        count = len(self.batch_files)
+        self.batch_count_label.configure(
+            text=f"{count:,} file{'s' if count != 1 else ''} • {engine.format_size(self.batch_total_bytes)}")
     
     def batch_clear(self):
-        self.batch_files = []
-        self.batch_listbox.delete("1.0", "end")
+        # Results still arriving from running scans belong to the old generation and are dropped
+        self.scan_generation += 1
+        self.batch_files.clear()
+        self.batch_index.clear()
+        self.batch_total_bytes = 0
+        self._update_batch_view()
     
     def batch_start(self):
         if not self.batch_files:
@@ -635,6 +1039,7 @@ class AV1EncoderPro(ctk.CTk):
         
         # Check if scheduled encoding is enabled
         if hasattr(self, 'schedule_enabled_var') and self.schedule_enabled_var.get():
+            self.ensure_tab("Scheduler")
             # Calculate delay until scheduled time
             try:
                 hour = int(self.schedule_hour.get() or 0)
@@ -654,7 +1059,7 @@ class AV1EncoderPro(ctk.CTk):
                 if delay > 0:
                     self.log(f"[SCHEDULED] Batch will start at {scheduled.strftime('%Y-%m-%d %H:%M')}")
                     self.log(f"[INFO] Waiting {int(delay // 60)} minutes...")
-                    threading.Thread(target=self._scheduled_batch_start, args=(delay,), daemon=True).start()
+                    threading.Thread(target=self._scheduled_batch_start, args=(scheduled,), daemon=True).start()
                     return
             except (ValueError, AttributeError):
                 self.log("[WARNING] Invalid schedule time, starting immediately...")
@@ -662,6 +1067,61 @@ class AV1EncoderPro(ctk.CTk):
         self.log(f"[INFO] Starting batch of {len(self.batch_files)} files...")
         threading.Thread(target=self.run_batch, daemon=True).start()
     
+    def _open_history(self):
+        """The local encode history, or None when its database can't be opened"""
+        try:
+            return engine.EncodeHistory()
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"[WARNING] Encode history unavailable ({e}); continuing without it")
+            return None
+    
+    def _record_history(self, history, result, info, encoder, preset, crf, threads, resolution,
+                        profiler=None):
+        """Add a finished encode to the history, with the settings of the attempt that produced it"""
+        if result.attempts:
+            last = result.attempts[-1]
+            encoder, preset, crf = last["encoder"], last["preset"], last["crf"]
+        try:
+            with engine.profile_span(profiler, "history"):
+                history.record(result, info, encoder, preset, crf, threads, resolution)
+        except sqlite3.Error as e:
+            self.log(f"[WARNING] Could not record encode history: {e}")
+    
+    def _encode_windows_settings(self):
+        """(spec, on_close) of the encode windows, or None when they are switched off"""
+        if not getattr(self, 'windows_enabled_var', ctk.BooleanVar(value=False)).get():
+            return None
+        on_close = "throttle" if self.window_close_var.get().startswith("Throttle") else "pause"
+        return self.windows_var.get().strip(), on_close
+    
+    def _save_windows(self, persist=True):
+        """Validate the encode windows, show their state and save them for the next start"""
+        spec = self.windows_var.get().strip()
+        try:
+            is_open, next_change = engine.window_state(engine.parse_windows(spec))
+        except ValueError as e:
+            self.windows_status.configure(text=f"⚠ {e}", text_color=COLORS['text'])
+            return
+        when = next_change.strftime("%a %d %b %H:%M") if next_change else "-"
+        state = f"Open now, closes {when}" if is_open else f"Closed now, opens {when}"
+        self.windows_status.configure(text=state, text_color=COLORS['text_dim'])
+        if persist:
+            settings = self._encode_windows_settings()
+            try:
+                engine.save_schedule({"enabled": settings is not None, "windows": spec,
+                                      "on_close": settings[1] if settings else "pause"})
+            except OSError as e:
+                self.log(f"[WARNING] Could not save the schedule: {e}")
+    
+    def _log_window_change(self, is_open, next_change, affected):
+        until = next_change.strftime("%a %d %b %H:%M") if next_change else "further notice"
+        if is_open:
+            self.log(f"[WINDOW] Encode window open until {until}"
+                     + (f"; resumed {affected} encode(s)" if affected else ""))
+        else:
+            self.log(f"[WINDOW] Outside the encode windows until {until}"
+                     + (f"; suspended {affected} running encode(s)" if affected else ""))
+    
     def _validate_schedule_time(self):
         """Clamp schedule hour/minute inputs to valid ranges"""
         try:
@@ -679,28 +1139,30 @@ class AV1EncoderPro(ctk.CTk):
         except (ValueError, TypeError):
             pass
     
-    def _scheduled_batch_start(self, delay):
-        """Wait for scheduled time then start batch (cancellable)"""
-        import time
+    def _scheduled_batch_start(self, scheduled):
+        """Wait for the scheduled datetime then start batch (cancellable)"""
         self._schedule_cancelled = False
-        elapsed = 0
-        while elapsed < delay:
+        last_logged = None
+        while True:
+            # Measure against the wall clock each time: sleeps overrun and the machine may suspend
+            remaining = (scheduled - datetime.datetime.now()).total_seconds()
+            if remaining <= 0:
+                break
             if self._schedule_cancelled:
                 self.log("[INFO] Scheduled batch was cancelled.")
                 return
-            time.sleep(min(5, delay - elapsed))
-            elapsed += 5
-            remaining_min = max(0, int((delay - elapsed) // 60))
-            if remaining_min > 0 and elapsed % 60 < 6:
+            remaining_min = int(remaining // 60)
+            if remaining_min > 0 and remaining_min != last_logged and last_logged is not None:
                 self.log(f"[SCHEDULE] {remaining_min} minutes remaining...")
+            last_logged = remaining_min
+            time.sleep(min(5, remaining))
         self.log(f"[INFO] Schedule triggered! Starting batch of {len(self.batch_files)} files...")
         self.run_batch()
     
     def run_batch(self):
         """Run batch encoding of all files with progress and cancel support"""
         try:
-            q = self.quality_var.get()
-            crf = int(63 - (q * 0.63))
+            crf = engine.quality_to_crf(self.quality_var.get())
             preset = self.preset_var.get().split()[0]
         except (AttributeError, ValueError, IndexError):
             crf = 30
@@ -708,9 +1170,71 @@ class AV1EncoderPro(ctk.CTk):
             
         succeeded = 0
         failed = 0
+        kept = 0
+        usage = []
+        profiler = self._new_profiler()
+        self._schedule_cancelled = False
+        self._batch_active = True
+        # Snapshot so the queue can be edited while the batch runs
+        files = list(self.batch_files)
+        
+        encoder = getattr(self, 'encoder_var', ctk.StringVar(value="libsvtav1")).get()
+        threads = getattr(self, 'thread_var', ctk.IntVar(value=0)).get()
+        resolution = self._resolution_key()
+        history = self._open_history()
+        infos = {}
+        
+        order = {"Shortest first": "spt", "Longest first": "lpt"}.get(
+            getattr(self, 'batch_order_var', ctk.StringVar(value="As added")).get(), "fifo")
+        # Ordering and estimates both need every file probed up front
+        if files and ((order != "fifo" and len(files) > 1) or (history is not None and history.rows())):
+            self.log(f"[INFO] Probing {len(files)} files to plan the batch...")
+            with engine.profile_span(profiler, "probe", files=len(files)):
+                infos = self.supervisor.run(av1_async.probe_videos(files, self.ffprobe_path))
+        if order != "fifo" and len(files) > 1:
+            costs = {f: engine.estimate_cost(infos[f], self.batch_index.get(f), preset=preset,
+                                             encoder=encoder, resolution=resolution)
+                     for f in files}
+            files = engine.order_by_cost(files, costs.get, order)
+        
+        if history is not None and infos:
+            predicted = [p for p in (history.predict(infos[f], encoder, preset, crf, threads, resolution)
+                                     for f in files) if p]
+            if predicted:
+                wall_time = engine.plan_makespan([p["wall_time"] for p in predicted])
+                size = sum(p["size"] or 0 for p in predicted)
+                self.log(f"[ESTIMATE] ~{engine.format_duration(wall_time)}, ~{engine.format_size(size)} "
+                         f"output ({len(predicted)}/{len(files)} files predicted from "
+                         f"{len(history.rows())} past encodes)")
+        
+        auto = getattr(self, 'batch_auto_var', ctk.BooleanVar(value=False)).get()
+        scratch = self._prepare_scratch()
+        swept = set()
+        prefetcher = None
+        depth = getattr(self, 'batch_prefetch_var', ctk.StringVar(value="Off")).get().split()[0]
+        if depth.isdigit() and len(files) > 1:
+            if scratch:
+                prefetcher = engine.Prefetcher(files, scratch, depth=int(depth), profiler=profiler)
+                self.log(f"[INFO] Prefetching the next {depth} file(s) to {scratch}")
+                prefetcher.start()
+            else:
+                self.log("[WARNING] Prefetch needs a scratch folder (Settings > Scratch Disk)")
         
-        for i, inp in enumerate(self.batch_files):
-            self.log(f"[BATCH {i+1}/{len(self.batch_files)}] {os.path.basename(inp)}")
+        windows = None
+        settings = self._encode_windows_settings()
+        if settings:
+            try:
+                windows = engine.EncodeWindows(settings[0], on_close=settings[1],
+                                               on_change=self._log_window_change)
+                windows.start()
+            except ValueError as e:
+                self.log(f"[WARNING] Ignoring encode windows ({e})")
+        
+        for i, inp in enumerate(files):
+            if windows and not windows.wait_open(lambda: self._schedule_cancelled):
+                self.log("[INFO] Batch cancelled while waiting for an encode window.")
+                break
+            self.log(f"[BATCH {i+1}/{len(files)}] {os.path.basename(inp)}")
             
             # Use custom output folder if specified, else same as source
             custom_folder = getattr(self, 'batch_output_var', ctk.StringVar()).get()
@@ -720,57 +1244,64 @@ class AV1EncoderPro(ctk.CTk):
             # Output extension based on dropdown
             ext = ".webm" if self.format_var.get() == "WebM" else ".mp4"
             out = os.path.join(folder, f"{name}_AV1{ext}")
+            if folder not in swept:
+                swept.add(folder)
+                self._clean_output_partials(out)
             
+            with engine.profile_span(profiler, "prefetch wait"):
+                source = prefetcher.acquire(inp) if prefetcher else inp
+            job_start = time.perf_counter()
             try:
-                steps = self.compile_encode_commands(inp, out, crf, preset)
-                for step_name, cmd in steps:
-                    self.log(f"  > Executing {step_name}...")
-                    self.log(f"  [CMD] {' '.join(cmd)}")
-                    
-                    # Set UTF-8 environment for unicode filename support
-                    env = os.environ.copy()
-                    env['PYTHONIOENCODING'] = 'utf-8'
-                    env['PYTHONUTF8'] = '1'
-                    
-                    popen_kwargs = {
-                        'stderr': subprocess.PIPE,
-                        'stdout': subprocess.DEVNULL,
-                        'env': env,
-                    }
-                    if IS_WINDOWS:
-                        startupinfo = subprocess.STARTUPINFO()
-                        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                        startupinfo.wShowWindow = subprocess.SW_HIDE
-                        popen_kwargs['startupinfo'] = startupinfo
-                        popen_kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-                    
-                    process = subprocess.Popen(cmd, **popen_kwargs)
-                    self.active_processes.append(process)
-                    
-                    # Stream progress from stderr
-                    for line in process.stderr:
-                        try:
-                            decoded = line.decode('utf-8', errors='replace') if isinstance(line, bytes) else line
-                            if "frame=" in decoded or "size=" in decoded or "time=" in decoded:
-                                self.log(f"  [PROGRESS] {decoded.strip()}")
-                        except Exception:
-                            pass
-                    
-                    process.wait()
-                    
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-                    
-                    if process.returncode != 0:
-                        raise Exception(f"{step_name} failed with code {process.returncode}")
-                        
+                job_crf, job_preset, job_grain = crf, preset, None
+                if auto:
+                    with engine.profile_span(profiler, "analysis"):
+                        job_crf, job_preset, job_grain = self._analyze_title(source, crf, preset)
+                if history is not None:
+                    info = infos.get(inp) or engine.probe_video(inp, self.ffprobe_path)
+                    prediction = history.predict(info, encoder, job_preset, job_crf, threads, resolution)
+                    if prediction:
+                        size = f", ~{engine.format_size(prediction['size'])}" if prediction["size"] else ""
+                        self.log(f"  [INFO] Estimate: ~{engine.format_duration(prediction['wall_time'])}"
+                                 f"{size} (from {prediction['samples']} past encodes)")
+                result = self._encode(source, out, job_crf, job_preset, grain=job_grain,
+                                      scratch_dir=scratch, indent="  ", label="  [PROGRESS]",
+                                      profiler=profiler, source_path=inp)
+                result.input_path = inp
+                if not self._check_result(result, "  "):
+                    kept += 1
+                    continue
+                
+                if history is not None:
+                    self._record_history(history, result, info, encoder, job_preset, job_crf,
+                                         threads, resolution, profiler)
                 self.log(f"[DONE] {os.path.basename(out)}")
+                self._log_resources(result.to_dict(), "  ")
+                usage.append(result.to_dict())
                 succeeded += 1
             except Exception as e:
                 self.log(f"[ERROR] Failed {os.path.basename(inp)}: {str(e)}")
                 failed += 1
-        
-        self.log(f"[BATCH COMPLETED] {succeeded} succeeded, {failed} failed out of {len(self.batch_files)} files.")
+            finally:
+                if prefetcher:
+                    prefetcher.release(inp)
+                if profiler is not None:
+                    profiler.add("job", job_start, time.perf_counter(), input=inp)
+        
+        if prefetcher:
+            prefetcher.stop()
+        if windows:
+            windows.stop()
+        self._batch_active = False
+        
+        kept_note = f", {kept} kept as original" if kept else ""
+        self.log(f"[BATCH COMPLETED] {succeeded} succeeded, {failed} failed{kept_note} out of {len(files)} files.")
+        if usage:
+            totals = engine.total_resources(usage)
+            self._log_resources(totals)
+            if totals["cpu_per_output_hour"] is not None:
+                self.log(f"[RESOURCES] {totals['cpu_per_output_hour']:.2f} CPU-hours per hour of output")
+        if profiler is not None:
+            self._finish_profile(profiler, "batch")
     
     def build_input_card(self, parent):
         """Input Source card"""
@@ -883,7 +1414,16 @@ class AV1EncoderPro(ctk.CTk):
         
         self.resolution_var = ctk.StringVar(value="Original")
         self.make_dropdown(card, "Resolution", self.resolution_var,
-                          ["Original", "4K (3840x2160)", "1080p (1920x1080)", "720p (1280x720)", "480p (854x480)"])
+                          ["Original", "4K (3840x2160)", "1080p (1920x1080)", "720p (1280x720)", "480p (854x480)"],
+                          command=lambda _: self.update_summary())
+        
+        # Screen recordings/slideshows: skip repeated frames, keep timestamps
+        self.frame_mode_var = ctk.StringVar(value="Constant")
+        self.make_dropdown(card, "Frame Rate", self.frame_mode_var,
+                          ["Constant", "Drop Duplicates (VFR)"])
+        
+        self.crop_var = ctk.StringVar(value="Off")
+        self.make_dropdown(card, "Crop Black Bars", self.crop_var, ["Off", "Auto-detect"])
         
         # Film Grain row
         grain_row = ctk.CTkFrame(card, fg_color="transparent")
@@ -1063,7 +1603,7 @@ class AV1EncoderPro(ctk.CTk):
 
     def update_quality(self, val=None):
         q = self.quality_var.get()
-        crf = int(63 - (q * 0.63))
+        crf = engine.quality_to_crf(q)
         self.crf_label.set(f"{q}% (CRF {crf})")
         self.update_summary()
     
@@ -1072,23 +1612,48 @@ class AV1EncoderPro(ctk.CTk):
         # Determine actual video dimensions would require probing, hardcoding for visual match or keeping generic
         # Use generic or just parsed filename for now
         
-        q = self.quality_var.get()
-        crf = int(63 - (q * 0.63))
+        crf = engine.quality_to_crf(self.quality_var.get())
         preset = self.preset_var.get().split()[0]
         
         audio_full = self.audio_var.get()
         audio = "Copy Audio" if audio_full == "Copy" else audio_full
         
+        encoder = getattr(self, 'encoder_var', ctk.StringVar(value="libsvtav1")).get()
+        threads = getattr(self, 'thread_var', ctk.IntVar(value=0)).get()
+        frame_size = engine.output_frame_size(self._input_info(), self._resolution_key())
+        
         self.summary_var.set(
             f"Input: {inp}\n"
-            f"Output: {self.format_var.get()} (AV1, {audio}), CRF {crf}, Preset {preset}"
+            f"Output: {self.format_var.get()} (AV1, {audio}), CRF {crf}, Preset {preset}\n"
+            f"Parallelism: {engine.describe_parallelism(encoder, frame_size, threads)}"
         )
     
+    def _input_info(self):
+        """Probed size of the current input, cached per path (None until it has been probed)
+        
+        The probe runs on the supervisor, off the Tk thread; the summary is
+        refreshed once its result is in.
+        """
+        path = self.input_var.get()
+        if not path or not os.path.isfile(path):
+            return None
+        if getattr(self, '_input_info_cache', (None, None))[0] != path:
+            self._input_info_cache = (path, None)
+            
+            def probed(info):
+                if self.input_var.get() == path:
+                    self._input_info_cache = (path, info)
+                    self.update_summary()
+            
+            self.supervisor.submit(av1_async.probe_video(path, self.ffprobe_path),
+                                   av1_async.tk_callback(self.callback_queue, probed))
+        return self._input_info_cache[1]
+    
     def log(self, msg):
         self.console_queue.put(msg + "\n")
     
     def process_console_queue(self):
-        """Process queued console messages (capped at 5000 lines)"""
+        """Process queued console messages (capped at 5000 lines) and supervisor results"""
         try:
             while True:
                 msg = self.console_queue.get_nowait()
@@ -1100,10 +1665,24 @@ class AV1EncoderPro(ctk.CTk):
                     self.console.delete('1.0', f'{line_count - 5000}.0')
         except queue.Empty:
             pass
+        try:
+            while True:
+                callback, result = self.callback_queue.get_nowait()
+                try:
+                    callback(result)
+                except Exception as e:
+                    self.log(f"[ERROR] Background task callback failed: {e}")
+        except queue.Empty:
+            pass
         self.after(100, self.process_console_queue)
     
     def check_ffmpeg(self):
-        """Check for bundled or system FFmpeg"""
+        """Check for bundled or system FFmpeg
+        
+        Paths are resolved immediately; the "-version" probe runs on a
+        background thread and reports through the console queue so it never
+        blocks the window from appearing.
+        """
         self.ffmpeg_path = self.resource_path("ffmpeg.exe")
         if not os.path.exists(self.ffmpeg_path):
             # Fall back to system ffmpeg
@@ -1117,29 +1696,17 @@ class AV1EncoderPro(ctk.CTk):
             if not os.path.exists(self.ffprobe_path):
                 self.ffprobe_path = "ffprobe"
         
+        threading.Thread(target=self._probe_ffmpeg, daemon=True).start()
+    
+    def _probe_ffmpeg(self):
         try:
-            result = subprocess.run([self.ffmpeg_path, "-version"], capture_output=True, text=True)
+            result = subprocess.run([self.ffmpeg_path, "-version"], capture_output=True, text=True,
+                                    **engine.popen_options(env=False))
             if result.returncode == 0:
                 self.log("[INFO] FFmpeg found - Video encoding enabled")
         except (FileNotFoundError, OSError):
             self.log("[ERROR] FFmpeg not found. Please install FFmpeg.")
     
-    def _probe_has_audio(self, input_path):
-        """Use ffprobe to check if the input file has an audio stream"""
-        try:
-            cmd = [
-                self.ffprobe_path, "-v", "error",
-                "-select_streams", "a",
-                "-show_entries", "stream=codec_type",
-                "-of", "csv=p=0",
-                input_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            return bool(result.stdout.strip())
-        except (FileNotFoundError, OSError, subprocess.TimeoutExpired):
-            # If ffprobe fails, assume no audio (avoids spurious -b:a warnings on video-only files)
-            return False
-    
     def start_encode(self):
         inp = self.input_var.get()
         out = self.output_var.get()
@@ -1150,8 +1717,7 @@ class AV1EncoderPro(ctk.CTk):
             self.log("[ERROR] Please specify an output file path.")
             return
         
-        q = self.quality_var.get()
-        crf = int(63 - (q * 0.63))
+        crf = engine.quality_to_crf(self.quality_var.get())
         preset = self.preset_var.get().split()[0]
         
         self.log(f"[INFO] Input: {inp}")
@@ -1161,85 +1727,61 @@ class AV1EncoderPro(ctk.CTk):
         
         threading.Thread(target=self.run_encode, args=(inp, out, crf, preset), daemon=True).start()
     
-    def compile_encode_commands(self, inp, out, crf, preset):
-        """Generate FFmpeg commands based on current UI settings"""
+    def _resolution_key(self):
+        """Engine resolution key for the dropdown ("1080p (1920x1080)" -> "1080p"), None for Original"""
+        resolution = self.resolution_var.get()
+        return None if resolution == "Original" else resolution.split()[0].lower()
+    
+    def _decimate(self):
+        return getattr(self, 'frame_mode_var', ctk.StringVar(value="Constant")).get().startswith("Drop")
+    
+    def _analyze_title(self, inp, crf, preset):
+        """Pick (crf, preset, grain) for one batch file from a short content analysis"""
+        encoder = getattr(self, 'encoder_var', ctk.StringVar(value="libsvtav1")).get()
+        max_grain = self.grain_var.get()
+        analysis = engine.analyze_content(inp, ffmpeg=self.ffmpeg_path, ffprobe=self.ffprobe_path)
+        if analysis is None:
+            self.log("  [WARNING] Content analysis failed; using the slider settings")
+            return crf, preset, None
+        chosen = engine.choose_settings(analysis, (max(0, crf - 6), min(63, crf + 6)),
+                                        (max(0, int(preset) - 2), min(13, int(preset) + 2)),
+                                        max_grain=max_grain, encoder=encoder)
+        self.log(f"  [ANALYSIS] SI {analysis['si']}, TI {analysis['ti']}, noise {analysis['noise']} "
+                 f"({analysis['time']:.1f}s) -> CRF {chosen['crf']}, preset {chosen['preset']}, "
+                 f"grain {chosen['grain']}")
+        return chosen["crf"], str(chosen["preset"]), chosen["grain"]
+    
+    def _encode_options(self, inp, out, grain=None):
+        """engine.encode keyword arguments for the current UI settings (grain overrides the slider)"""
         # Film Grain (must be read before tune check)
-        grain = self.grain_var.get()
+        if grain is None:
+            grain = self.grain_var.get()
 
-        # Audio — probe input to check if audio stream exists
-        audio = self.audio_var.get()
-        bitrate = self.audio_bitrate_var.get()
-        has_audio = self._probe_has_audio(inp)
-        
-        if not has_audio:
-            # No audio stream in input — force no audio regardless of UI setting
-            if audio != "No Audio":
-                self.log("[INFO] Input has no audio stream — skipping audio options.")
-            audio_opts = ["-an"]
-        else:
-            # Safety for WebM container: Force Opus if Copy is selected (usually AAC)
-            is_webm = out.lower().endswith(".webm")
-            
-            if audio == "Copy":
-                if is_webm:
-                    self.log("[INFO] 'Copy' audio into WebM is unsafe. Auto-switching to Opus (128k).")
-                    audio_opts = ["-c:a", "libopus", "-b:a", "128k"]
-                else:
-                    audio_opts = ["-c:a", "copy"]
-            elif audio == "Opus (Recommended)":
-                audio_opts = ["-c:a", "libopus", "-b:a", bitrate]
-            elif audio == "AAC":
-                audio_opts = ["-c:a", "aac", "-b:a", bitrate]
-            elif audio == "No Audio":
-                audio_opts = ["-an"]
-            else:
-                audio_opts = ["-c:a", "copy"]
+        audio_map = {"Copy": "copy", "Opus (Recommended)": "libopus", "AAC": "aac", "No Audio": "none"}
 
         # Tune
         tune = self.tune_var.get()
-        tune_map = {"VQ (Visual Quality)": "0", "PSNR": "1", "SSIM": "2", "Film": "0"}
-        tune_val = tune_map.get(tune, "0")
+        tune_map = {"VQ (Visual Quality)": 0, "PSNR": 1, "SSIM": 2, "Film": 0}
         # "Film" mode: auto-apply film grain if not manually set
         if tune == "Film" and grain == 0:
             grain = 8
             self.log("[INFO] Film tune selected — auto-applying film-grain=8")
 
-        # Resolution
-        resolution = self.resolution_var.get()
-        scale_opts = []
-        if resolution != "Original":
-            res_map = {
-                "4K (3840x2160)": "3840:2160",
-                "1080p (1920x1080)": "1920:1080",
-                "720p (1280x720)": "1280:720",
-                "480p (854x480)": "854:480"
-            }
-            if resolution in res_map:
-                scale_opts = ["-vf", f"scale={res_map[resolution]}:flags=lanczos"]
+        resolution = self._resolution_key()
         
         # Get encoder from Settings
         encoder = getattr(self, 'encoder_var', ctk.StringVar(value="libsvtav1")).get()
         threads = getattr(self, 'thread_var', ctk.IntVar(value=0)).get()
         
+        # Tile layout follows the encoded frame size
+        frame_size = None
+        if encoder in ("libaom-av1", "librav1e"):
+            frame_size = engine.output_frame_size(engine.probe_video(inp, self.ffprobe_path), resolution)
+        
         # Log encoder
-        self.log(f"[INFO] Encoder: {encoder}")
-        
-        # Check if encoder is SVT-AV1 (supports svtav1-params)
-        is_svt = encoder == "libsvtav1"
-        is_gpu = encoder in ["av1_nvenc", "av1_amf", "av1_qsv"]
-        
-        # Build encoder-specific options
-        encoder_opts = []
-        
-        if is_svt:
-            svt_params = f"tune={tune_val}"
-            if grain > 0:
-                svt_params += f":film-grain={grain}:film-grain-denoise=1"
-            # SVT-AV1 does NOT accept bare -threads; pass thread count via svtav1-params
-            if threads > 0:
-                svt_params += f":logical-processors={threads}"
-            encoder_opts = ["-c:v", encoder, "-crf", str(crf), "-preset", str(preset), "-svtav1-params", svt_params]
-        elif is_gpu:
+        self.log(f"[INFO] Encoder: {encoder} ({engine.describe_parallelism(encoder, frame_size, threads)})")
+        
+        if encoder in engine.GPU_ENCODERS:
             # GPU encoders require specific hardware - warn user
             gpu_requirements = {
                 "av1_nvenc": "NVIDIA RTX 40 series GPU",
@@ -1248,111 +1790,188 @@ class AV1EncoderPro(ctk.CTk):
             }
             self.log(f"[WARNING] {encoder} requires {gpu_requirements.get(encoder, 'specific GPU hardware')}")
             self.log("[INFO] If encoding fails, switch to SVT-AV1 (CPU) in Settings")
-            
-            # GPU encoders use different quality parameters (clamped to 0-51)
-            gpu_crf = min(51, crf)
-            encoder_opts = ["-c:v", encoder]
-            if encoder == "av1_nvenc":
-                encoder_opts.extend(["-cq", str(gpu_crf), "-preset", "p" + str(min(7, max(1, 8 - int(preset))))])
-            elif encoder == "av1_amf":
-                encoder_opts.extend(["-rc", "cqp", "-qp_i", str(gpu_crf), "-qp_p", str(gpu_crf)])
-            elif encoder == "av1_qsv":
-                encoder_opts.extend(["-global_quality", str(max(1, gpu_crf))])
-        elif encoder == "librav1e":
-            # rav1e uses -speed (not -cpu-used) and doesn't accept -threads
-            encoder_opts = ["-c:v", encoder, "-qp", str(crf), "-speed", str(preset)]
-        else:
-            # libaom-av1: uses -cpu-used and -threads
-            encoder_opts = ["-c:v", encoder, "-crf", str(crf), "-cpu-used", str(preset)]
-            if threads > 0:
-                encoder_opts.extend(["-threads", str(threads)])
 
         # Warn if output already exists
         if os.path.exists(out):
             self.log(f"[WARNING] Output file already exists and will be overwritten: {os.path.basename(out)}")
         
-        # Build single-pass encode command
-        cmd = [self.ffmpeg_path, "-y", "-i", inp]
-        cmd.extend(encoder_opts)
-        cmd.extend(scale_opts)
-        cmd.extend(audio_opts)
-        cmd.append(out)
-        
-        return [("ENCODE", cmd)]
+        # Stall Watchdog, Resumable and Size Guard cards
+        stall = getattr(self, 'stall_var', ctk.StringVar(value="Off")).get().split()[0]
+        retries = getattr(self, 'retry_var', ctk.StringVar(value="No retry")).get().split()[0]
+        resumable = getattr(self, 'resumable_var', ctk.BooleanVar(value=False)).get()
+        max_ratio = getattr(self, 'max_ratio_var', ctk.StringVar(value="Off")).get().rstrip("%")
+        oversize = getattr(self, 'oversize_var', ctk.StringVar(value="Keep the original")).get()
+        
+        return {
+            "encoder": encoder,
+            "audio_codec": audio_map.get(self.audio_var.get(), "copy"),
+            "audio_bitrate": self.audio_bitrate_var.get(),
+            "resolution": resolution,
+            "tune": tune_map.get(tune, 0),
+            "grain": grain,
+            "threads": threads,
+            "decimate": self._decimate(),
+            # Black bars: sample the title and crop ahead of scaling when the result is stable
+            "crop": "auto" if getattr(self, 'crop_var', ctk.StringVar(value="Off")).get() == "Auto-detect" else None,
+            "stall_timeout": int(stall) * 60 if stall.isdigit() else None,
+            "retries": int(retries) if retries.isdigit() else 0,
+            "fallback": getattr(self, 'fallback_var', ctk.BooleanVar(value=False)).get(),
+            "segment_seconds": engine.SEGMENT_SECONDS if resumable else None,
+            "max_ratio": int(max_ratio) / 100 if max_ratio.isdigit() else None,
+            "oversize": "retry" if oversize.startswith("Retry") else "keep",
+            "ffmpeg": self.ffmpeg_path,
+            "ffprobe": self.ffprobe_path,
+        }
 
     def run_encode(self, inp, out, crf, preset):
+        profiler = self._new_profiler()
         try:
-            steps = self.compile_encode_commands(inp, out, crf, preset)
-            
-            for name, cmd in steps:
-                label = "[INFO]" if name == "ENCODE" else f"[{name}]"
-                self.log(f"{label} Starting...")
-                self.log(f"[CMD] {' '.join(cmd)}")
-                
-                # Set UTF-8 environment for unicode filename support
-                env = os.environ.copy()
-                env['PYTHONIOENCODING'] = 'utf-8'
-                env['PYTHONUTF8'] = '1'
-                
-                popen_kwargs = {
-                    'stderr': subprocess.PIPE,
-                    'stdout': subprocess.DEVNULL,
-                    'env': env,
-                }
-                if IS_WINDOWS:
-                    startupinfo = subprocess.STARTUPINFO()
-                    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                    startupinfo.wShowWindow = subprocess.SW_HIDE
-                    popen_kwargs['startupinfo'] = startupinfo
-                    popen_kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-                
-                process = subprocess.Popen(cmd, **popen_kwargs)
-                self.active_processes.append(process)
-                
-                # Read stderr as bytes and decode
-                for line in process.stderr:
-                    try:
-                        decoded = line.decode('utf-8', errors='replace') if isinstance(line, bytes) else line
-                        if "frame=" in decoded or "size=" in decoded or "time=" in decoded:
-                            self.log(f"{label} {decoded.strip()}")
-                    except Exception:
-                        pass
-                        
-                process.wait()
-                
-                if process in self.active_processes:
-                    self.active_processes.remove(process)
-                
-                if process.returncode != 0:
-                    raise Exception(f"{name} failed with code {process.returncode}")
-            
-            self.log("[DONE] Encoding complete!")
+            if getattr(self, '_batch_active', False):
+                self.log("[PRIORITY] A batch is running; it yields to this encode until it finishes")
+            # Single encodes are the interactive lane: they preempt running batch encodes
+            self._clean_output_partials(out)
+            result = self._encode(inp, out, crf, preset, scratch_dir=self._prepare_scratch(),
+                                  priority=1, profiler=profiler)
+            if self._check_result(result):
+                self.log("[DONE] Encoding complete!")
+                self._log_resources(result.to_dict())
             
         except Exception as e:
             self.log(f"[ERROR] {str(e)}")
+        finally:
+            if profiler is not None:
+                self._finish_profile(profiler, "encode")
+    
+    def _new_profiler(self):
+        """An engine.Profiler when Settings > Profiling is on, else None"""
+        if getattr(self, 'profile_var', ctk.BooleanVar(value=False)).get():
+            return engine.Profiler()
+        return None
+    
+    def _finish_profile(self, profiler, name):
+        """Save the trace under engine.TRACE_DIR and log the per-stage summary"""
+        path = os.path.join(engine.TRACE_DIR,
+                            f"{name}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        try:
+            profiler.write_trace(path)
+            self.log(f"[PROFILE] Trace saved to {path} (open in ui.perfetto.dev)")
+        except OSError as e:
+            self.log(f"[WARNING] Could not save the trace: {e}")
+        for line in profiler.format_summary():
+            self.log(f"[PROFILE] {line}")
+    
+    def _prepare_scratch(self):
+        """Return the configured scratch folder (None = next to the output), clearing stale partials"""
+        scratch = getattr(self, 'scratch_var', ctk.StringVar()).get().strip() or None
+        if scratch:
+            try:
+                os.makedirs(scratch, exist_ok=True)
+            except OSError as e:
+                self.log(f"[WARNING] Scratch folder unavailable ({e}); writing next to the output")
+                return None
+            removed = engine.clean_stale_partials(scratch)
+            if removed:
+                self.log(f"[INFO] Removed {removed} stale partial file(s) from {scratch}")
+        return scratch
+    
+    def _clean_output_partials(self, out):
+        """Remove stale partials an interrupted encode left in out's folder"""
+        removed = engine.clean_output_partials([out])
+        if removed:
+            self.log(f"[INFO] Removed {removed} stale partial file(s) from {os.path.dirname(os.path.abspath(out))}")
+    
+    def _log_resources(self, usage, indent=""):
+        """Log the CPU time, peak RSS and I/O of a run (or batch totals)"""
+        resources = engine.format_resources(usage)
+        if resources:
+            self.log(f"{indent}[RESOURCES] {resources}")
+    
+    def _encode(self, inp, out, crf, preset, grain=None, scratch_dir=None, indent="",
+                label="[INFO]", priority=0, profiler=None, source_path=None):
+        """Encode one file with engine.encode and the current UI settings; returns its EncodeResult
+        
+        The engine stages, retries, falls back, runs resumable segments and
+        applies the Size Guard as set in Settings; this logs its notes,
+        command, progress lines (after label) and retries. priority > 0
+        (single encodes) preempts running batch encodes as set under Settings >
+        Interactive Priority. Every FFmpeg process is tracked for Cancel.
+        source_path is the original file when inp is a prefetched copy.
+        """
+        options = self._encode_options(inp, out, grain)
+        preempt = {"Pause the batch": "pause", "Shrink the batch to 1 core": "throttle"}.get(
+            getattr(self, 'preempt_var', ctk.StringVar(value="Pause the batch")).get())
+        processes = []
+        cancel = threading.Event()
+        self.active_cancels.append(cancel)
+        
+        def track(process):
+            processes.append(process)
+            self.active_processes.append(process)
+        
+        def line(line):
+            if engine.line_level(line) == "error":
+                self.log(f"{indent}[ERROR] {line}")
+        
+        def retry(attempt, delay, encoder, preset):
+            if attempt["stalled"]:
+                reason = f"stalled (no progress for {options['stall_timeout'] // 60} min)"
+            else:
+                reason = f"failed with code {attempt['exit_code']}"
+            self.log(f"{indent}[RETRY] Attempt {attempt['attempt']} {reason}; retrying in "
+                     f"{engine.format_duration(delay)} with {encoder} preset {preset} "
+                     f"(attempt {attempt['attempt'] + 1} of {options['retries'] + 1})")
+        
+        try:
+            return engine.encode(
+                inp, out, crf=int(crf), preset=int(preset), scratch_dir=scratch_dir,
+                priority=priority, preempt=preempt, cancel=cancel, source_path=source_path,
+                profiler=profiler,
+                on_note=lambda note: self.log(f"{indent}[INFO] {note}"),
+                on_command=lambda cmd, duration: self.log(f"{indent}[CMD] {' '.join(cmd)}"),
+                on_process=track, on_progress=lambda progress, text: self.log(f"{label} {text}"),
+                on_line=line, on_retry=retry, **options)
+        finally:
+            if cancel in self.active_cancels:
+                self.active_cancels.remove(cancel)
+            for process in processes:
+                if process in self.active_processes:
+                    self.active_processes.remove(process)
+    
+    def _check_result(self, result, indent=""):
+        """Log an EncodeResult's outcome: True once published, False when the Size Guard kept
+        the original; raises when the encode failed"""
+        if result.oversize:
+            self.log(f"{indent}[OVERSIZE] {result.error}")
+            return False
+        if not result.ok:
+            raise Exception(result.error or f"Encoding failed with code {result.exit_code}")
+        if result.dropped_frames is not None:
+            source_frames = result.frames + result.dropped_frames
+            self.log(f"{indent}[INFO] Dropped {result.dropped_frames} of {source_frames} frames as "
+                     f"duplicates ({100 * result.dropped_frames / max(1, source_frames):.0f}%)")
+        return True
     
     def cancel_encode(self):
         """Cancel all running encode processes and scheduled batches"""
         # Cancel scheduled batch if waiting
         self._schedule_cancelled = True
         
+        # Encodes waiting to retry stop too, and a killed encode is never retried
+        waiting = len(self.active_cancels)
+        for cancel in list(self.active_cancels):
+            cancel.set()
         cancelled = 0
         for proc in list(self.active_processes):
-            try:
-                if proc.poll() is None:
-                    proc.terminate()
-                    proc.wait(timeout=2)
-                    cancelled += 1
-            except (OSError, subprocess.TimeoutExpired):
-                try:
-                    proc.kill()
-                    cancelled += 1
-                except OSError:
-                    pass
+            if proc.poll() is None:
+                # Kills FFmpeg's whole process group
+                engine.kill_process(proc)
+                cancelled += 1
         self.active_processes.clear()
         
         if cancelled > 0:
             self.log(f"[CANCELLED] Stopped {cancelled} running process(es).")
+        elif waiting:
+            self.log("[CANCELLED] Stopped the encode waiting to retry.")
         else:
             self.log("[INFO] No active encoding to cancel.")
     
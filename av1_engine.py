@@ -0,0 +1,2218 @@
+"""
+AV1 Encoder Pro - Encoding Engine
+Shared FFmpeg command builder, runner and progress parser used by the
+desktop GUI, the CLI and the web UI.
+"""
+import contextlib
+import datetime
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IS_WINDOWS = sys.platform == 'win32'
+
+ENCODERS = ["libsvtav1", "libaom-av1", "librav1e", "av1_nvenc", "av1_amf", "av1_qsv"]
+GPU_ENCODERS = ["av1_nvenc", "av1_amf", "av1_qsv"]
+AUDIO_CODECS = ["libopus", "aac", "copy", "none"]
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".webm", ".wmv", ".flv")
+
+# Target resolutions for the scale filter
+RESOLUTIONS = {
+    "4k": "3840:2160",
+    "1080p": "1920:1080",
+    "720p": "1280:720",
+    "480p": "854:480",
+}
+
+# Batch ordering strategies: longest-processing-time first minimizes makespan
+# on parallel workers, shortest first minimizes average time-to-result
+ORDER_STRATEGIES = ["lpt", "spt", "fifo"]
+
+# Muxer to force when writing a staged ".part" file (FFmpeg can't infer it from the name)
+MUXERS = {".webm": "webm", ".mp4": "mp4", ".mkv": "matroska", ".mov": "mov"}
+
+# Partials from other processes are only removed after this many seconds
+# where process liveness can't be checked (Windows, or output folders that
+# other machines may be writing to)
+STALE_PART_AGE = 3600
+
+# Each preset step is roughly this much faster for the CPU encoders
+PRESET_SPEEDUP = 1.4
+
+# FFmpeg stats line fields, e.g. "frame= 120 fps= 48 q=30.0 size= 512kB time=00:00:05.00 bitrate= 838.9kbits/s speed=1.9x"
+PROGRESS_RE = re.compile(r"\b(frame|fps|size|time|bitrate|speed)=\s*(\S+)")
+
+
+def get_ffmpeg_path():
+    """Find FFmpeg binary"""
+    return "ffmpeg"
+
+def get_ffprobe_path():
+    """Find FFprobe binary"""
+    return "ffprobe"
+
+def format_size(num_bytes):
+    """Human-readable byte count, e.g. 1.4 GB"""
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if size < 1024 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_duration(seconds):
+    """Compact duration, e.g. 1h 05m or 4m 12s"""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def quality_to_crf(quality):
+    """Map the 0-100 quality percentage to a CRF value (0-63)"""
+    return int(63 - (quality * 0.63))
+
+def nvenc_preset(preset):
+    """Map a 0-13 speed preset to the NVENC p1 (fastest) - p7 (slowest) scale"""
+    return "p" + str(min(7, max(1, 8 - int(preset))))
+
+
+# ============ PROBING ============
+
+def duration_probe_command(input_path, ffprobe=None):
+    return [ffprobe or get_ffprobe_path(), "-v", "error", "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1", input_path]
+
+def video_probe_command(input_path, ffprobe=None):
+    return [ffprobe or get_ffprobe_path(), "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,avg_frame_rate:format=duration",
+            "-of", "json", input_path]
+
+def audio_probe_command(input_path, ffprobe=None):
+    return [ffprobe or get_ffprobe_path(), "-v", "error", "-select_streams", "a",
+            "-show_entries", "stream=codec_type", "-of", "csv=p=0", input_path]
+
+def probe_duration(input_path, ffprobe=None):
+    """Return the input duration in seconds, or None if it can't be probed"""
+    try:
+        result = subprocess.run(
+            duration_probe_command(input_path, ffprobe),
+            capture_output=True, text=True, timeout=30, **popen_options(env=False)
+        )
+        return float(result.stdout.strip())
+    except (FileNotFoundError, OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+
+def probe_video(input_path, ffprobe=None):
+    """Probe duration, frame size and frame rate of the first video stream
+
+    Returns a dict with duration, width, height and fps; fields that can't be
+    determined are None.
+    """
+    try:
+        result = subprocess.run(
+            video_probe_command(input_path, ffprobe),
+            capture_output=True, text=True, timeout=30, **popen_options(env=False)
+        )
+    except (FileNotFoundError, OSError, subprocess.TimeoutExpired):
+        return parse_video_probe("")
+    return parse_video_probe(result.stdout)
+
+def parse_video_probe(output):
+    """probe_video()'s dict from the JSON output of video_probe_command()"""
+    info = {"duration": None, "width": None, "height": None, "fps": None}
+    try:
+        data = json.loads(output or "{}")
+    except ValueError:
+        return info
+
+    try:
+        info["duration"] = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    streams = data.get("streams") or [{}]
+    info["width"] = streams[0].get("width")
+    info["height"] = streams[0].get("height")
+    try:
+        num, den = streams[0].get("avg_frame_rate", "0/0").split("/")
+        info["fps"] = float(num) / float(den) if float(den) else None
+    except ValueError:
+        pass
+    return info
+
+def probe_videos(paths, ffprobe=None, workers=8):
+    """Probe many files concurrently; returns {path: probe_video(path)}"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(lambda p: probe_video(p, ffprobe), paths)))
+
+def probe_has_audio(input_path, ffprobe=None):
+    """Use ffprobe to check if the input file has an audio stream"""
+    try:
+        result = subprocess.run(
+            audio_probe_command(input_path, ffprobe),
+            capture_output=True, text=True, timeout=10, **popen_options(env=False)
+        )
+        return bool(result.stdout.strip())
+    except (FileNotFoundError, OSError, subprocess.TimeoutExpired):
+        # If ffprobe fails, assume no audio (avoids spurious -b:a warnings on video-only files)
+        return False
+
+
+# ============ DISCOVERY ============
+
+def discover_videos(root):
+    """Recursively yield (path, size) for every video file under root
+
+    Uses os.scandir so sizes come from the directory walk itself; entries
+    are sorted per directory and unreadable folders are skipped.
+    """
+    try:
+        entries = sorted(os.scandir(root), key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from discover_videos(entry.path)
+            elif entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                yield entry.path, entry.stat().st_size
+        except OSError:
+            continue
+
+
+# ============ BATCH PLANNING ============
+
+def _output_pixels(info, resolution=None):
+    if resolution and resolution.lower() in RESOLUTIONS:
+        width, height = (int(v) for v in RESOLUTIONS[resolution.lower()].split(":"))
+        return width * height
+    return (info.get("width") or 1920) * (info.get("height") or 1080)
+
+def estimate_cost(info, size=None, preset=6, encoder="libsvtav1", resolution=None):
+    """Estimate the relative cost of an encode in "1080p30 seconds"
+
+    Cost scales with frames x encoded pixels and with the preset speed; only
+    ratios between jobs matter. When probing failed, the file size is used
+    as a proxy (about 1 MB per 1080p30 second for typical sources).
+    """
+    duration = info.get("duration") if info else None
+    if not duration:
+        return (size or 0) / 1e6
+
+    fps = info.get("fps") or 30.0
+    cost = duration * (fps / 30.0) * _output_pixels(info, resolution) / (1920 * 1080)
+    if encoder in GPU_ENCODERS:
+        return cost * 0.1
+    return cost * PRESET_SPEEDUP ** (6 - int(preset))
+
+def order_by_cost(items, cost, strategy="lpt"):
+    """Return items reordered by cost(item): "lpt" longest first, "spt" shortest first, "fifo" unchanged"""
+    if strategy == "lpt":
+        return sorted(items, key=cost, reverse=True)
+    if strategy == "spt":
+        return sorted(items, key=cost)
+    return list(items)
+
+
+# ============ HISTORY ============
+
+# Where finished encodes are recorded (override with AV1_HISTORY_DB)
+HISTORY_DB = os.environ.get("AV1_HISTORY_DB") or os.path.join(
+    os.path.expanduser("~"), ".av1_encoder_pro", "history.db")
+
+# Output size roughly doubles for every this many CRF steps down
+CRF_DOUBLING = 6
+
+# Fewer matching encodes than this and the predictor widens its match
+MIN_SAMPLES = 3
+
+class EncodeHistory:
+    """Local SQLite record of finished encodes and a predictor trained on it
+
+    Wall time is modelled as seconds per estimate_cost() unit, so resolution,
+    frame rate, duration and preset differences between past and new jobs
+    are already accounted for; the ratio is taken from the closest matching
+    past encodes (same encoder, preset, threads and concurrency, widening
+    when there are too few). Output size is modelled as bits per output
+    pixel per frame, normalized across CRF values.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or HISTORY_DB
+        self._lock = threading.Lock()
+        self._rows = None
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS encodes (
+                id INTEGER PRIMARY KEY,
+                finished_at REAL, input TEXT, input_size INTEGER,
+                width INTEGER, height INTEGER, fps REAL, duration REAL,
+                encoder TEXT, preset INTEGER, crf INTEGER, threads INTEGER,
+                resolution TEXT, workers INTEGER,
+                wall_time REAL, cpu_time REAL, output_size INTEGER, peak_rss INTEGER)""")
+            columns = {row[1] for row in db.execute("PRAGMA table_info(encodes)")}
+            if "peak_rss" not in columns:
+                db.execute("ALTER TABLE encodes ADD COLUMN peak_rss INTEGER")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, result, info, encoder, preset, crf, threads=0, resolution=None, workers=1):
+        """Store a successful EncodeResult together with its probed source info"""
+        if not result.ok or not info or not info.get("duration"):
+            return
+        try:
+            input_size = os.path.getsize(result.input_path)
+        except OSError:
+            input_size = None
+        with self._lock, self._connect() as db:
+            db.execute("""INSERT INTO encodes (finished_at, input, input_size, width, height,
+                          fps, duration, encoder, preset, crf, threads, resolution, workers,
+                          wall_time, cpu_time, output_size, peak_rss)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                       (time.time(), os.path.abspath(result.input_path), input_size,
+                        info.get("width"), info.get("height"), info.get("fps"), info["duration"],
+                        encoder, int(preset), int(crf), int(threads), resolution, int(workers),
+                        result.wall_time, result.cpu_time, result.size, result.peak_rss))
+            self._rows = None
+
+    def rows(self):
+        """All recorded encodes as dicts (cached until the next record())"""
+        with self._lock:
+            if self._rows is None:
+                with self._connect() as db:
+                    db.row_factory = sqlite3.Row
+                    self._rows = [dict(row) for row in db.execute("SELECT * FROM encodes")]
+            return self._rows
+
+    def memory_factor(self, encoder):
+        """How far observed peak RSS ran above estimate_memory()'s model (90th percentile, 1.0 without data)"""
+        ratios = []
+        for r in self.rows():
+            if r["encoder"] != encoder or not r.get("peak_rss"):
+                continue
+            model = estimate_memory(encoder, output_frame_size(r, r["resolution"]), r["preset"],
+                                    r["threads"])
+            ratios.append(r["peak_rss"] / model)
+        if not ratios:
+            return 1.0
+        ratios.sort()
+        return ratios[int(0.9 * (len(ratios) - 1))]
+
+    def predict(self, info, encoder, preset, crf, threads=0, resolution=None, workers=1):
+        """Predict {"wall_time", "size", "samples"} for a new encode, or None without history"""
+        if not info or not info.get("duration"):
+            return None
+        rows = [r for r in self.rows() if r["encoder"] == encoder and r["wall_time"]]
+        if not rows:
+            return None
+        for narrowed in (
+                [r for r in rows if r["preset"] == int(preset) and r["threads"] == int(threads)
+                 and r["workers"] == int(workers)],
+                [r for r in rows if r["preset"] == int(preset)]):
+            if len(narrowed) >= MIN_SAMPLES:
+                rows = narrowed
+                break
+
+        ratios = []
+        bpps = []
+        for r in rows:
+            cost = estimate_cost(r, preset=r["preset"], encoder=encoder, resolution=r["resolution"])
+            if cost:
+                ratios.append(r["wall_time"] / cost)
+            frames = _output_pixels(r, r["resolution"]) * (r["fps"] or 30.0) * r["duration"]
+            if r["output_size"] and frames:
+                bpps.append(r["output_size"] * 8 / frames * 2 ** ((r["crf"] - int(crf)) / CRF_DOUBLING))
+        if not ratios:
+            return None
+
+        frames = _output_pixels(info, resolution) * (info.get("fps") or 30.0) * info["duration"]
+        return {
+            "wall_time": statistics.median(ratios) * estimate_cost(info, preset=preset, encoder=encoder,
+                                                                    resolution=resolution),
+            "size": int(statistics.median(bpps) * frames / 8) if bpps else None,
+            "samples": len(rows),
+        }
+
+def plan_makespan(durations, workers=1):
+    """Wall time of running durations in order on `workers` slots (greedy list scheduling)"""
+    slots = [0.0] * max(1, workers)
+    for duration in durations:
+        slots[slots.index(min(slots))] += duration
+    return max(slots)
+
+
+# ============ CONTENT ANALYSIS ============
+
+# The analysis decodes ANALYSIS_WINDOWS short windows spread over the title,
+# downscaled to ANALYSIS_WIDTH; nearest-neighbour scaling keeps per-pixel
+# grain visible in the temporal noise floor
+ANALYSIS_WINDOWS = 6
+ANALYSIS_SECONDS = 2.0
+ANALYSIS_WIDTH = 640
+ANALYSIS_RE = re.compile(r"lavfi\.(siti\.si|siti\.ti|scd\.time)=([\d.]+)")
+
+def analyze_content(input_path, duration=None, ffmpeg=None, ffprobe=None):
+    """Measure spatial/temporal complexity, grain and scene-cut rate of a title
+
+    Returns a dict with si/ti (median ITU-T P.910 spatial and temporal
+    information), noise (10th percentile of TI, the noise floor of the
+    calmest frames, which film grain raises), cuts_per_min, frames and time (seconds spent), or None
+    when nothing could be measured (e.g. FFmpeg without the siti filter).
+    """
+    start_time = time.monotonic()
+    if duration is None:
+        duration = probe_duration(input_path, ffprobe)
+    if duration and duration > 2 * ANALYSIS_WINDOWS * ANALYSIS_SECONDS:
+        length = ANALYSIS_SECONDS
+        starts = [duration * (i + 0.5) / ANALYSIS_WINDOWS - length / 2
+                  for i in range(ANALYSIS_WINDOWS)]
+    else:
+        length = duration or 2 * ANALYSIS_WINDOWS * ANALYSIS_SECONDS
+        starts = [0.0]
+
+    si, ti = [], []
+    cuts = 0
+    sampled = 0.0
+    for start in starts:
+        cmd = [ffmpeg or get_ffmpeg_path(), "-hide_banner", "-nostats",
+               "-ss", f"{start:.2f}", "-t", f"{length:.2f}", "-i", input_path, "-an", "-sn",
+               "-vf", f"scale={ANALYSIS_WIDTH}:-2:flags=neighbor,format=gray,siti,scdet,"
+                      "metadata=mode=print:file=-",
+               "-f", "null", "-"]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8",
+                                    errors="replace", timeout=300, **popen_options())
+        except (FileNotFoundError, OSError, subprocess.TimeoutExpired):
+            continue
+        window_ti = []
+        for key, value in ANALYSIS_RE.findall(result.stdout):
+            if key == "siti.si":
+                si.append(float(value))
+            elif key == "siti.ti":
+                window_ti.append(float(value))
+            else:
+                cuts += 1
+        # The first frame of a window has nothing to difference against
+        ti.extend(window_ti[1:])
+        sampled += length
+    if not si:
+        return None
+
+    ti.sort()
+    return {
+        "si": round(statistics.median(si), 1),
+        "ti": round(statistics.median(ti), 1) if ti else 0.0,
+        "noise": round(ti[len(ti) // 10], 1) if ti else 0.0,
+        "cuts_per_min": round(cuts * 60 / sampled, 1),
+        "frames": len(si),
+        "time": round(time.monotonic() - start_time, 2),
+    }
+
+def choose_settings(analysis, crf_range, preset_range, max_grain=0, encoder="libsvtav1"):
+    """Pick CRF, preset and film grain for a title from analyze_content() results
+
+    A 0 (easy) .. 1 (hard) complexity blends spatial and temporal information
+    and the scene-cut rate; easy content gets the highest CRF and fastest
+    preset in range, hard content the lowest CRF and slowest preset. Film
+    grain synthesis (SVT-AV1 only) scales with the noise floor up to max_grain.
+    """
+    def scale(value, low, high):
+        return min(1.0, max(0.0, (value - low) / (high - low)))
+
+    complexity = (0.45 * scale(analysis["si"], 15, 70)
+                  + 0.4 * scale(analysis["ti"], 1, 25)
+                  + 0.15 * scale(analysis["cuts_per_min"], 2, 30))
+    crf_low, crf_high = sorted(crf_range)
+    preset_slow, preset_fast = sorted(preset_range)
+    grain = 0
+    if encoder == "libsvtav1" and max_grain:
+        grain = round(max_grain * scale(analysis["noise"], 1.0, 6.0))
+    return {
+        "crf": round(crf_high - complexity * (crf_high - crf_low)),
+        "preset": round(preset_fast - complexity * (preset_fast - preset_slow)),
+        "grain": grain,
+        "complexity": round(complexity, 2),
+    }
+
+
+# ============ CROP DETECTION ============
+
+CROP_SAMPLES = 10
+CROP_FRAMES = 5
+CROP_CONFIDENCE = 0.8
+CROP_RE = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+
+def detect_crop(input_path, info=None, samples=CROP_SAMPLES, min_confidence=CROP_CONFIDENCE,
+                ffmpeg=None, ffprobe=None):
+    """Find a stable black-bar crop by sampling frames across the title
+
+    Runs cropdetect on a few frames at `samples` points between 5% and 95% of
+    the duration and takes the most common rectangle; confidence is the share
+    of samples that agree. Returns {"crop": "w:h:x:y" or None, "confidence",
+    "samples"}; crop is None when confidence is below min_confidence or the
+    rectangle would remove less than 1% of the frame.
+    """
+    info = info or probe_video(input_path, ffprobe)
+    duration = info.get("duration") or 0
+    points = [duration * (0.05 + 0.9 * i / max(1, samples - 1)) for i in range(samples)] \
+        if duration > 10 else [0.0]
+
+    found = []
+    for start in points:
+        cmd = [ffmpeg or get_ffmpeg_path(), "-hide_banner", "-nostats", "-ss", f"{start:.2f}",
+               "-i", input_path, "-an", "-sn", "-frames:v", str(CROP_FRAMES),
+               "-vf", "cropdetect=limit=24:round=2:reset=0", "-f", "null", "-"]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8",
+                                    errors="replace", timeout=60, **popen_options())
+        except (FileNotFoundError, OSError, subprocess.TimeoutExpired):
+            continue
+        matches = CROP_RE.findall(result.stderr)
+        if matches:
+            found.append(tuple(int(v) for v in matches[-1]))
+    if not found:
+        return {"crop": None, "confidence": 0.0, "samples": 0}
+
+    rect = max(set(found), key=found.count)
+    confidence = round(found.count(rect) / len(found), 2)
+    width, height = info.get("width"), info.get("height")
+    crop = ":".join(str(v) for v in rect)
+    if confidence < min_confidence:
+        crop = None
+    elif width and height and rect[0] * rect[1] >= 0.99 * width * height:
+        crop = None
+    return {"crop": crop, "confidence": confidence, "samples": len(found)}
+
+
+# ============ MEMORY ============
+
+# Peak-memory model per encoder: fixed overhead plus bytes per encoded pixel,
+# scaled up with the thread count and (CPU encoders) slower presets
+MEMORY_MODEL = {
+    "libsvtav1": (300e6, 350),
+    "libaom-av1": (200e6, 150),
+    "librav1e": (200e6, 200),
+}
+GPU_MEMORY = 500e6
+
+# Share of the memory limit concurrent encodes may commit by default
+MEMORY_HEADROOM = 0.85
+
+def estimate_memory(encoder, frame_size=None, preset=6, threads=0, history=None):
+    """Projected peak RSS of one encode in bytes
+
+    With an EncodeHistory the model is scaled by how far observed peaks of
+    the same encoder ran above it (see EncodeHistory.memory_factor).
+    """
+    if encoder in GPU_ENCODERS:
+        return int(GPU_MEMORY)
+    threads = parallel_settings(encoder, threads=threads)["threads"]
+    width, height = frame_size or (1920, 1080)
+    base, per_pixel = MEMORY_MODEL.get(encoder, MEMORY_MODEL["libsvtav1"])
+    estimate = base + per_pixel * width * height * (1 + threads / 8) * 1.15 ** max(0, 6 - int(preset))
+    if history is not None:
+        estimate *= history.memory_factor(encoder)
+    return int(estimate)
+
+def memory_limit():
+    """Return (bytes, source) for the memory this process may use, or (None, None)
+
+    The cgroup limit (v2 or v1) when one is set and below physical RAM,
+    otherwise physical RAM.
+    """
+    physical = None
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, encoding="ascii") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and (physical is None or int(value) < physical):
+            return int(value), "cgroup limit"
+    if physical:
+        return physical, "physical memory"
+    return None, None
+
+
+# ============ PROGRESS PARSING ============
+
+def parse_timestamp(value):
+    """Convert an FFmpeg HH:MM:SS.ms timestamp to seconds"""
+    try:
+        hours, minutes, seconds = value.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+def parse_progress(line):
+    """Parse an FFmpeg stats line into a dict, or None if it isn't one"""
+    fields = dict(PROGRESS_RE.findall(line))
+    if "frame" not in fields and "time" not in fields:
+        return None
+
+    progress = {}
+    try:
+        if "frame" in fields:
+            progress["frame"] = int(fields["frame"])
+        if "fps" in fields:
+            progress["fps"] = float(fields["fps"])
+        if "speed" in fields and fields["speed"].endswith("x"):
+            progress["speed"] = float(fields["speed"][:-1])
+    except ValueError:
+        pass
+    if "time" in fields:
+        seconds = parse_timestamp(fields["time"])
+        if seconds is not None:
+            progress["time"] = round(seconds, 2)
+    if "size" in fields:
+        progress["size"] = fields["size"]
+    if "bitrate" in fields:
+        progress["bitrate"] = fields["bitrate"]
+    return progress
+
+def parse_size(value):
+    """Convert an FFmpeg size field ("512kB", "3MiB", "N/A") to bytes, or None"""
+    match = re.match(r"([\d.]+)\s*([kKMG]?)i?B$", value or "")
+    if not match:
+        return None
+    return int(float(match.group(1)) * 1024 ** " KMG".index(match.group(2).upper() or " "))
+
+def add_estimates(progress, duration, elapsed):
+    """Add percent and ETA (seconds) to a progress dict when the duration is known"""
+    if duration and "time" in progress:
+        done = min(progress["time"], duration)
+        progress["percent"] = round(done / duration * 100, 1)
+        if done > 0:
+            progress["eta"] = round(elapsed * (duration - done) / done, 1)
+    return progress
+
+def line_level(line):
+    """Classify a non-stats FFmpeg line as "error", "warning" or None"""
+    lowered = line.lower()
+    if "error" in lowered:
+        return "error"
+    if "warning" in lowered:
+        return "warning"
+    return None
+
+
+# ============ COMMAND BUILDING ============
+
+# Tiles are only split while each stays at least this wide / tall; rav1e
+# gets its parallelism almost entirely from tiles, so it splits further
+MIN_TILE_SIZE = (640, 720)
+RAV1E_MIN_TILE_SIZE = (320, 360)
+
+def output_frame_size(info, resolution=None, crop=None):
+    """(width, height) of the encoded picture after crop and scale, or None if unknown"""
+    if crop:
+        width, height = (int(v) for v in crop.split(":")[:2])
+    elif info and info.get("width") and info.get("height"):
+        width, height = info["width"], info["height"]
+    else:
+        width = height = None
+    if resolution and resolution.lower() in RESOLUTIONS:
+        target_w, target_h = (int(v) for v in RESOLUTIONS[resolution.lower()].split(":"))
+        if crop and width:
+            # Cropped pictures are scaled to the target width, keeping their aspect
+            return target_w, round(target_w * height / width / 2) * 2
+        return target_w, target_h
+    return (width, height) if width else None
+
+def parallel_settings(encoder, frame_size=None, threads=0):
+    """Thread budget and tile layout for an encode, or None for GPU encoders
+
+    Returns {"threads", "tile_cols", "tile_rows"} with tile counts as log2.
+    Tiles split the picture while each stays at least MIN_TILE_SIZE (or
+    RAV1E_MIN_TILE_SIZE), and never outnumber the threads; threads=0
+    budgets every CPU this process may run on.
+    """
+    if encoder in GPU_ENCODERS:
+        return None
+    if threads <= 0:
+        if hasattr(os, "sched_getaffinity"):
+            threads = len(os.sched_getaffinity(0))
+        else:
+            threads = os.cpu_count() or 1
+    cols = rows = 0
+    if frame_size:
+        width, height = frame_size
+        min_width, min_height = RAV1E_MIN_TILE_SIZE if encoder == "librav1e" else MIN_TILE_SIZE
+        while width >> (cols + 1) >= min_width:
+            cols += 1
+        while height >> (rows + 1) >= min_height:
+            rows += 1
+        while 1 << (cols + rows) > threads:
+            if rows:
+                rows -= 1
+            else:
+                cols -= 1
+    return {"threads": threads, "tile_cols": cols, "tile_rows": rows}
+
+def describe_parallelism(encoder, frame_size=None, threads=0):
+    """One-line summary of how an encode will be parallelized (for logs and the GUI)"""
+    settings = parallel_settings(encoder, frame_size, threads)
+    if settings is None:
+        return "hardware encoder"
+    if encoder == "libaom-av1":
+        return (f"{1 << settings['tile_cols']}x{1 << settings['tile_rows']} tiles, row-mt, "
+                f"{settings['threads']} threads")
+    if encoder == "librav1e":
+        tiles = 1 << (settings["tile_cols"] + settings["tile_rows"])
+        return f"{tiles} tile{'s' if tiles > 1 else ''}, {settings['threads']} threads"
+    return f"{threads} threads" if threads > 0 else f"{settings['threads']} threads (all cores)"
+
+def resolve_audio(audio_codec, audio_bitrate, output_path, has_audio=True):
+    """Pick the effective audio codec/bitrate for an output
+
+    Returns (codec, bitrate, note) where note explains any override, or None.
+    """
+    if not has_audio:
+        note = None if audio_codec == "none" else "Input has no audio stream — skipping audio options."
+        return "none", audio_bitrate, note
+    # Safety for WebM container: copied audio is usually AAC, which WebM can't hold
+    if audio_codec == "copy" and output_path.lower().endswith(".webm"):
+        return "libopus", "128k", "'Copy' audio into WebM is unsafe. Auto-switching to Opus (128k)."
+    return audio_codec, audio_bitrate, None
+
+def build_command(input_path, output_path, crf, preset=6,
+                  encoder="libsvtav1", audio_codec="libopus", audio_bitrate="128k",
+                  resolution=None, tune=0, grain=0, threads=0, decimate=False, crop=None,
+                  frame_size=None, ffmpeg=None):
+    """Build the FFmpeg command line for a single encode (threads=0 means auto)
+
+    decimate drops duplicate/near-duplicate frames (mpdecimate) and writes
+    variable-frame-rate output so the remaining frames keep their timestamps.
+    crop ("w:h:x:y") is applied first; a cropped picture is then scaled to
+    the target width keeping its aspect ratio. frame_size, the encoded
+    (width, height), sizes the libaom/rav1e tile layout (see parallel_settings).
+    """
+    cmd = [ffmpeg or get_ffmpeg_path(), "-y", "-i", input_path]
+
+    if encoder == "libsvtav1":
+        svt_params = f"tune={tune}"
+        if grain > 0:
+            svt_params += f":film-grain={grain}:film-grain-denoise=1"
+        # SVT-AV1 does NOT accept bare -threads; pass thread count via svtav1-params
+        if threads > 0:
+            svt_params += f":logical-processors={threads}"
+        cmd.extend(["-c:v", encoder, "-crf", str(crf), "-preset", str(preset), "-svtav1-params", svt_params])
+    elif encoder in GPU_ENCODERS:
+        # GPU encoders use different quality parameters (clamped to 0-51)
+        gpu_crf = min(51, crf)
+        cmd.extend(["-c:v", encoder])
+        if encoder == "av1_nvenc":
+            cmd.extend(["-cq", str(gpu_crf), "-preset", nvenc_preset(preset)])
+        elif encoder == "av1_amf":
+            cmd.extend(["-rc", "cqp", "-qp_i", str(gpu_crf), "-qp_p", str(gpu_crf)])
+        elif encoder == "av1_qsv":
+            cmd.extend(["-global_quality", str(max(1, gpu_crf))])
+    elif encoder == "librav1e":
+        # rav1e uses -speed (not -cpu-used) and doesn't accept -threads; its
+        # thread pool is sized via rav1e-params and it picks the tile layout itself
+        par = parallel_settings(encoder, frame_size, threads)
+        cmd.extend(["-c:v", encoder, "-qp", str(crf), "-speed", str(preset),
+                    "-tiles", str(1 << (par["tile_cols"] + par["tile_rows"])),
+                    "-rav1e-params", f"threads={par['threads']}"])
+    else:
+        # libaom-av1: uses -cpu-used and -threads; without tiles and row-mt it
+        # keeps only a couple of cores busy
+        par = parallel_settings(encoder, frame_size, threads)
+        cmd.extend(["-c:v", encoder, "-crf", str(crf), "-cpu-used", str(preset),
+                    "-threads", str(par["threads"]), "-row-mt", "1",
+                    "-tile-columns", str(par["tile_cols"]), "-tile-rows", str(par["tile_rows"])])
+
+    # Video filters: black-bar crop, duplicate-frame decimation, then resolution scaling
+    filters = []
+    if crop:
+        filters.append(f"crop={crop}")
+    if decimate:
+        filters.append("mpdecimate")
+    if resolution and resolution.lower() in RESOLUTIONS:
+        size = RESOLUTIONS[resolution.lower()]
+        if crop:
+            size = size.split(":")[0] + ":-2"
+        filters.append(f"scale={size}:flags=lanczos")
+    if filters:
+        cmd.extend(["-vf", ",".join(filters)])
+    if decimate:
+        cmd.extend(["-fps_mode", "vfr"])
+
+    cmd.extend(audio_options(audio_codec, audio_bitrate))
+    cmd.append(output_path)
+    return cmd
+
+def audio_options(audio_codec, audio_bitrate="128k"):
+    """FFmpeg audio arguments for a resolved audio codec (see resolve_audio)"""
+    if audio_codec == "none":
+        return ["-an"]
+    if audio_codec == "copy":
+        return ["-c:a", "copy"]
+    return ["-c:a", audio_codec, "-b:a", audio_bitrate]
+
+
+# ============ STAGING ============
+
+# Partials this process is currently writing (never cleaned as stale)
+_active_parts = set()
+
+# <output name>.<8 hex digit destination hash>.<pid>.part, as named by staging_path(),
+# or <input name>.<hash>.in.<pid>.part for Prefetcher copies
+_PART_NAME = re.compile(r"\.[0-9a-f]{8}(?:\.in)?\.(\d+)\.part$")
+
+def staging_path(output_path, scratch_dir=None):
+    """Temporary .part path an encode writes to before publish()
+
+    Lives in scratch_dir when given (a fast local disk), otherwise next to the
+    output. The name carries a hash of the destination and our PID so
+    same-named files from different folders and processes never collide.
+    """
+    folder = scratch_dir or os.path.dirname(os.path.abspath(output_path))
+    tag = hashlib.sha1(os.path.abspath(output_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(folder, f"{os.path.basename(output_path)}.{tag}.{os.getpid()}.part")
+
+def claim_part(part_path):
+    """Mark part_path as in use so clean_stale_partials() leaves it alone"""
+    _active_parts.add(part_path)
+
+def discard_part(part_path):
+    """Release part_path and delete it if it is still there (failed or cancelled encode)"""
+    _active_parts.discard(part_path)
+    try:
+        os.remove(part_path)
+    except OSError:
+        pass
+
+def stage_command(cmd, part_path):
+    """Redirect a command's output (last argument) to part_path, forcing the muxer"""
+    muxer = MUXERS.get(os.path.splitext(cmd[-1])[1].lower())
+    staged = cmd[:-1]
+    if muxer:
+        staged += ["-f", muxer]
+    return staged + [part_path]
+
+def publish(part_path, output_path):
+    """Move a finished .part file into place atomically
+
+    A rename when both live on one filesystem; otherwise the file is copied
+    next to the destination first and then renamed, so the final name only
+    ever refers to a complete file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    try:
+        os.replace(part_path, output_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Staging name, so a copy cut short is swept like any other partial
+        tmp_path = staging_path(output_path)
+        claim_part(tmp_path)
+        try:
+            shutil.copyfile(part_path, tmp_path)
+            os.replace(tmp_path, output_path)
+        finally:
+            discard_part(tmp_path)
+        os.remove(part_path)
+
+def _pid_alive(pid):
+    """True/False when it can be determined, None where it can't (Windows)"""
+    if IS_WINDOWS:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def clean_stale_partials(folder, min_age=0):
+    """Delete .part files left behind by encodes that are no longer running
+
+    Only names made by staging_path() and Prefetcher are considered. Files modified within min_age seconds are kept even when their process
+    is gone here. Returns the number of files removed.
+    """
+    removed = 0
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return 0
+    for entry in entries:
+        match = _PART_NAME.search(entry.name)
+        if not match or entry.path in _active_parts:
+            continue
+        pid = match.group(1)
+        alive = False if int(pid) == os.getpid() else _pid_alive(int(pid))
+        try:
+            age = time.time() - entry.stat().st_mtime
+            if alive is None:
+                alive = age < STALE_PART_AGE
+            if not alive and age >= min_age:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def clean_output_partials(output_paths):
+    """clean_stale_partials() in every folder the given outputs are published to
+
+    Encodes without a scratch folder stage next to their output, so a crash
+    leaves the .part there. The folder may be shared with other machines
+    whose processes can't be seen, so only files older than STALE_PART_AGE
+    are removed. Returns the number of files removed.
+    """
+    folders = {os.path.dirname(os.path.abspath(path)) for path in output_paths}
+    return sum(clean_stale_partials(folder, min_age=STALE_PART_AGE) for folder in sorted(folders))
+
+
+# ============ SEGMENTS ============
+
+# Target length of a resumable segment; at most this much work is lost
+SEGMENT_SECONDS = 300
+
+def segments_dir(output_path):
+    """Folder next to the output holding a resumable encode's segments and manifest"""
+    return output_path + ".segments"
+
+def discard_segments(output_path):
+    shutil.rmtree(segments_dir(output_path), ignore_errors=True)
+
+def probe_keyframes(input_path, ffprobe=None):
+    """Keyframe timestamps (seconds from the start) of the first video stream
+
+    Reads packet flags only, without decoding. Returns [] when unavailable.
+    """
+    cmd = [ffprobe or get_ffprobe_path(), "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", input_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8",
+                                errors="replace", timeout=600, **popen_options())
+    except (OSError, subprocess.SubprocessError):
+        return []
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if flags.startswith("K"):
+            try:
+                times.append(float(pts))
+            except ValueError:
+                pass
+    times.sort()
+    return [t - times[0] for t in times] if times else []
+
+def plan_segments(keyframes, duration=None, segment_seconds=SEGMENT_SECONDS):
+    """[(start, end)] cut on keyframes about segment_seconds apart; the last end is None
+
+    Without keyframes the cuts fall every segment_seconds (the encode seeks
+    accurately, so they stay correct, only slower to start). A tail shorter
+    than a quarter segment is folded into the one before it.
+    """
+    if not keyframes and duration:
+        keyframes = [segment_seconds * k for k in range(1, int(duration // segment_seconds) + 1)]
+    bounds = [0.0]
+    for t in keyframes:
+        if t - bounds[-1] >= segment_seconds and (not duration or duration - t >= segment_seconds / 4):
+            bounds.append(t)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+def _split_command(cmd):
+    """(video-only command, audio arguments) of a build_command/stage_command command"""
+    body = cmd[:-1]
+    if len(body) > 2 and body[-2] == "-f":
+        body = body[:-2]
+    audio = max(i for i, arg in enumerate(body) if arg in ("-an", "-c:a"))
+    return body[:audio] + ["-an"], body[audio:]
+
+def _load_manifest(folder, identity):
+    try:
+        with open(os.path.join(folder, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("identity") == identity else None
+
+def _save_manifest(folder, manifest):
+    path = os.path.join(folder, "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def run_segmented(cmd, input_path, output_path, duration=None, segment_seconds=SEGMENT_SECONDS,
+                  source_path=None, ffprobe=None, profiler=None, on_note=None, on_progress=None,
+                  **run_options):
+    """Run an encode command as resumable keyframe-aligned segments
+
+    cmd is a command from build_command (optionally staged). Video is
+    encoded segment by segment into segments_dir(output_path); every
+    finished segment is recorded in its manifest.json, so after a crash or
+    cancel the next run with the same input and settings only encodes the
+    missing segments. The segments are then joined without re-encoding and
+    muxed with the audio into cmd's output. Progress time, frame counts and
+    size (video only) run on across segments. The caller removes the folder
+    with discard_segments() once the output is published. With a Profiler,
+    every segment and the final join are recorded as spans. When input_path
+    is a scratch copy (see Prefetcher), source_path names the original file
+    so a resume from another copy still matches the manifest.
+    run_options go to run_ffmpeg. Returns run_ffmpeg's dict (times, I/O and
+    frames summed over this run's segments) plus segments and reused.
+    """
+    video_cmd, audio_args = _split_command(cmd)
+    folder = segments_dir(output_path)
+    source_path = source_path or input_path
+    stat = os.stat(source_path)
+    identity = {
+        "input": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "settings": hashlib.sha256(json.dumps(video_cmd[video_cmd.index("-i") + 2:]).encode()).hexdigest()[:16],
+        "segment_seconds": segment_seconds,
+    }
+    manifest = _load_manifest(folder, identity)
+    if manifest is None:
+        if os.path.isdir(folder) and on_note is not None:
+            on_note("Discarding segments from an earlier encode with other settings")
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        with profile_span(profiler, "keyframe scan"):
+            keyframes = probe_keyframes(input_path, ffprobe)
+        spans = plan_segments(keyframes, duration, segment_seconds)
+        manifest = {"identity": identity,
+                    "segments": [{"start": start, "end": end, "done": False, "frames": None}
+                                 for start, end in spans]}
+        _save_manifest(folder, manifest)
+
+    segments = manifest["segments"]
+    for index, segment in enumerate(segments):
+        segment["path"] = os.path.join(folder, f"seg_{index:04d}.mkv")
+        if segment["done"] and not os.path.exists(segment["path"]):
+            segment["done"] = False
+    reused = sum(1 for segment in segments if segment["done"])
+    reused_seconds = sum((segment["end"] or duration or 0) - segment["start"]
+                         for segment in segments if segment["done"])
+    if on_note is not None:
+        if reused:
+            on_note(f"Resuming: {reused} of {len(segments)} segments already encoded")
+        else:
+            on_note(f"Encoding in {len(segments)} resumable segment(s) of about "
+                    f"{format_duration(segment_seconds)}")
+
+    start_time = time.monotonic()
+    totals = {"exit_code": 0, "wall_time": 0.0, "cpu_time": 0.0, "user_time": 0.0,
+              "sys_time": 0.0, "frames": None, "peak_rss": None, "io": None, "stalled": False,
+              "preempted": 0, "segments": len(segments), "reused": reused}
+
+    def accumulate(run):
+        totals["exit_code"] = run["exit_code"]
+        for key in ("cpu_time", "user_time", "sys_time"):
+            totals[key] = round(totals[key] + run[key], 2)
+        totals["stalled"] = run["stalled"]
+        if run["peak_rss"] is not None:
+            totals["peak_rss"] = max(totals["peak_rss"] or 0, run["peak_rss"])
+        if run["io"] is not None:
+            totals["io"] = {key: (totals["io"] or {}).get(key, 0) + value
+                            for key, value in run["io"].items()}
+        totals["wall_time"] = round(time.monotonic() - start_time, 2)
+
+    for index, segment in enumerate(segments):
+        if segment["done"]:
+            continue
+
+        # Earlier segments are all done (reused or encoded by this run) by now
+        frame_offset = sum(seg["frames"] or 0 for seg in segments[:index])
+        size_offset = sum(os.path.getsize(seg["path"]) for seg in segments[:index])
+
+        def segment_progress(progress, line, offset=segment["start"], frame_offset=frame_offset,
+                             size_offset=size_offset):
+            if on_progress is None:
+                return
+            # Cumulative over the whole video, like an unsegmented encode reports them
+            if "time" in progress:
+                progress["time"] = round(offset + progress["time"], 2)
+            if "frame" in progress:
+                progress["frame"] += frame_offset
+            size = parse_size(progress.get("size"))
+            if size is not None:
+                progress["size"] = f"{(size_offset + size) // 1024}kB"
+            add_estimates(progress, duration, time.monotonic() - start_time)
+            if "eta" in progress and progress["time"] > reused_seconds:
+                # Only this run's share of the work took the elapsed time
+                progress["eta"] = round((time.monotonic() - start_time) * (duration - progress["time"])
+                                        / (progress["time"] - reused_seconds), 1)
+            on_progress(progress, line)
+
+        part = segment["path"] + ".part"
+        seg_cmd = list(video_cmd)
+        seg_cmd[seg_cmd.index("-i"):seg_cmd.index("-i")] = ["-ss", f"{segment['start']:.3f}"]
+        if segment["end"] is not None:
+            seg_cmd += ["-t", f"{segment['end'] - segment['start']:.3f}"]
+        with profile_span(profiler, "segment", index=index, start=segment["start"]):
+            run = run_ffmpeg(seg_cmd + ["-f", "matroska", part], on_progress=segment_progress,
+                             **run_options)
+        accumulate(run)
+        if run["exit_code"] != 0 or run["stalled"]:
+            return totals
+        os.replace(part, segment["path"])
+        segment["done"] = True
+        segment["frames"] = run["frames"]
+        _save_manifest(folder, {"identity": identity,
+                                "segments": [{k: v for k, v in seg.items() if k != "path"}
+                                             for seg in segments]})
+
+    list_path = os.path.join(folder, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for segment in segments:
+            f.write("file '" + segment["path"].replace("'", "'\\''") + "'\n")
+    concat = [video_cmd[0], "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_args == ["-an"]:
+        concat += ["-map", "0:v", "-c:v", "copy", "-an"]
+    else:
+        concat += ["-i", input_path, "-map", "0:v", "-map", "1:a:0?", "-c:v", "copy"] + audio_args
+    with profile_span(profiler, "mux"):
+        run = run_ffmpeg(concat + cmd[len(cmd) - (3 if cmd[-3] == "-f" else 1):],
+                         **{k: v for k, v in run_options.items() if k != "stall_timeout"})
+    accumulate(run)
+    if all(segment["frames"] is not None for segment in segments):
+        totals["frames"] = sum(segment["frames"] for segment in segments)
+    return totals
+
+
+# ============ PREFETCH ============
+
+class Prefetcher:
+    """Copy upcoming batch inputs to a local scratch folder ahead of their encode
+
+    A background thread copies the next `depth` not-yet-started inputs in
+    queue order, keeping all local copies within `budget` bytes (default:
+    half the free space of scratch_dir). acquire(path) returns the local copy,
+    waiting for an in-flight copy of that file, or the original path when it
+    wasn't prefetched; release(path) deletes the copy once the encode is done.
+    With a Profiler, every copy is recorded as a span.
+    """
+
+    CHUNK = 8 * 1024 * 1024
+
+    def __init__(self, paths, scratch_dir, depth=1, budget=None, profiler=None):
+        self.paths = list(paths)
+        self.profiler = profiler
+        self.scratch_dir = scratch_dir
+        self.depth = max(1, depth)
+        self.budget = budget or shutil.disk_usage(scratch_dir).free // 2
+        self.stats = {"prefetched": 0, "bytes": 0, "direct": 0}
+        self._cond = threading.Condition()
+        self._state = {}  # path -> "copying" | "ready" | "in_use" | "direct"
+        self._local = {}
+        self._sizes = {}
+        self._used = 0
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop copying and delete every local copy still around"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        for path in list(self._local):
+            self.release(path)
+
+    def _ahead(self):
+        return sum(1 for state in self._state.values() if state in ("copying", "ready"))
+
+    def _loop(self):
+        for path in self.paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            with self._cond:
+                if size > self.budget:
+                    continue
+                while not self._stopped and path not in self._state and (
+                        self._ahead() >= self.depth or self._used + size > self.budget):
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                if path in self._state:
+                    # Its encode already started from the original
+                    continue
+                self._state[path] = "copying"
+                self._sizes[path] = size
+                self._used += size
+
+            local = self._local_path(path)
+            claim_part(local)
+            with profile_span(self.profiler, "scratch copy", input=path, bytes=size):
+                copied = self._copy(path, local)
+            with self._cond:
+                if copied:
+                    self._state[path] = "ready"
+                    self._local[path] = local
+                    self.stats["prefetched"] += 1
+                    self.stats["bytes"] += size
+                else:
+                    self._state[path] = "direct"
+                    self._used -= self._sizes.pop(path)
+                    discard_part(local)
+                self._cond.notify_all()
+
+    def _local_path(self, path):
+        tag = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.scratch_dir,
+                            f"{os.path.basename(path)}.{tag}.in.{os.getpid()}.part")
+
+    def _copy(self, src, dst):
+        try:
+            with open(src, "rb") as fin, open(dst, "wb") as fout:
+                while not self._stopped:
+                    chunk = fin.read(self.CHUNK)
+                    if not chunk:
+                        return True
+                    fout.write(chunk)
+        except OSError:
+            pass
+        return False
+
+    def acquire(self, path):
+        """Path the encode of `path` should read from"""
+        with self._cond:
+            while self._state.get(path) == "copying" and not self._stopped:
+                self._cond.wait()
+            if self._state.get(path) == "ready":
+                self._state[path] = "in_use"
+                self._cond.notify_all()
+                return self._local[path]
+            self._state.setdefault(path, "direct")
+            self.stats["direct"] += 1
+            self._cond.notify_all()
+            return path
+
+    def release(self, path):
+        """Evict the local copy of `path`, freeing its share of the budget"""
+        with self._cond:
+            local = self._local.pop(path, None)
+            if local is None:
+                return
+            self._used -= self._sizes.pop(path)
+            self._cond.notify_all()
+        discard_part(local)
+
+
+# ============ RUNNER ============
+
+def popen_options(env=True, session=False):
+    """Subprocess options shared by every FFmpeg launch
+
+    Sets a UTF-8 environment for unicode filename support and hides the
+    console window on Windows. With session the child gets its own process
+    group, so kill_process() can take down everything it spawns.
+    """
+    options = {}
+    if env:
+        child_env = os.environ.copy()
+        child_env['PYTHONIOENCODING'] = 'utf-8'
+        child_env['PYTHONUTF8'] = '1'
+        options['env'] = child_env
+    if IS_WINDOWS:
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        options['startupinfo'] = startupinfo
+        options['creationflags'] = subprocess.CREATE_NO_WINDOW
+    if session:
+        if IS_WINDOWS:
+            options['creationflags'] |= subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            options['start_new_session'] = True
+    return options
+
+# FFmpeg processes started by run_ffmpeg that are still running
+_live_processes = set()
+
+# Priority lane of every running process, and the running ones that
+# preempt lower lanes -> (priority, preempt action)
+_priorities = {}
+_preemptors = {}
+
+def terminate_all():
+    """Kill every running FFmpeg process group (e.g. on Ctrl+C)
+
+    FFmpeg runs in its own session, so a terminal interrupt no longer
+    reaches it directly.
+    """
+    for process in list(_live_processes):
+        kill_process(process)
+
+def admit_process(process, priority=0, preempt="pause"):
+    """Register a just started FFmpeg process for windows, preemption and terminate_all()
+
+    The process is suspended while an encode window is closed or a
+    higher-priority preemptor runs. With priority > 0 and a preempt action
+    it becomes a preemptor itself: every lower-priority process, running
+    or started later, is suspended until release_process(process). Returns
+    how many running processes it suspended.
+    """
+    _live_processes.add(process)
+    _priorities[process] = priority
+    if _suspend_mode is not None:
+        # Started while an encode window is closed
+        suspend_process(process, *_suspend_mode)
+    preempted = 0
+    # Under the lock, so a preemptor cannot finish between this check and the suspend
+    with _suspend_lock:
+        # Lower lanes yield to higher ones for as long as those run
+        for other, (other_priority, action) in list(_preemptors.items()):
+            if other_priority > priority:
+                suspend_process(process, action, reason=other)
+        if priority > 0 and preempt:
+            _preemptors[process] = (priority, preempt)
+            for other in list(_live_processes):
+                if _priorities.get(other, 0) < priority and suspend_process(other, preempt, reason=process):
+                    preempted += 1
+    return preempted
+
+def release_process(process):
+    """Unregister a finished process; everything it held suspended as a preemptor resumes"""
+    with _suspend_lock:
+        _preemptors.pop(process, None)
+        # Includes the processes that started after it and yielded to it
+        for other in [p for p, entry in _suspended.items() if process in entry["reasons"]]:
+            resume_process(other, reason=process)
+        _suspended.pop(process, None)
+    _live_processes.discard(process)
+    _priorities.pop(process, None)
+
+# Retries of a stalled/failed encode wait RETRY_BACKOFF seconds, doubling each time
+RETRY_BACKOFF = 30
+
+# Slowest-to-fastest preset range per CPU encoder (-preset / -cpu-used / -speed)
+PRESET_MAX = {"libsvtav1": 13, "libaom-av1": 8, "librav1e": 10}
+
+# Early abort: projections before this share of the encode (percent) are too noisy
+SIZE_CHECK_AFTER = 10.0
+
+# ...and this many stats lines in a row must agree before an encode is aborted
+SIZE_CHECK_LINES = 5
+
+# What happens to an encode whose output won't pay off, and the CRF step of "retry"
+OVERSIZE_ACTIONS = ["keep", "retry"]
+OVERSIZE_CRF_STEP = 6
+
+class SizeGuard:
+    """Flag an encode whose projected output exceeds max_ratio of its input
+
+    The final size is projected from the bytes written so far and the share
+    of duration encoded. check(progress) adds projected_size to the progress
+    dict and returns True once, on the stats line where the projection has
+    stayed above the limit for SIZE_CHECK_LINES lines past SIZE_CHECK_AFTER
+    percent; the caller then kills the encode.
+    """
+
+    def __init__(self, input_size, duration, max_ratio):
+        self.input_size = input_size
+        self.duration = duration
+        self.max_ratio = max_ratio
+        self.projected = None
+        self.percent = None
+        self.tripped = False
+        self._over = 0
+
+    def check(self, progress):
+        size = parse_size(progress.get("size"))
+        if self.tripped or not size or not progress.get("time") or not self.duration:
+            return False
+        percent = min(progress["time"], self.duration) / self.duration * 100
+        self.projected, self.percent = int(size * 100 / percent), round(percent, 1)
+        progress["projected_size"] = self.projected
+        if percent < SIZE_CHECK_AFTER:
+            return False
+        self._over = self._over + 1 if self.projected > self.input_size * self.max_ratio else 0
+        self.tripped = self._over >= SIZE_CHECK_LINES
+        return self.tripped
+
+    def to_dict(self):
+        return {"input_size": self.input_size, "projected_size": self.projected,
+                "ratio": round(self.projected / max(1, self.input_size), 2),
+                "max_ratio": self.max_ratio, "percent": self.percent}
+
+    def describe(self):
+        return (f"projected output {format_size(self.projected)} is "
+                f"{self.projected / max(1, self.input_size):.0%} of the input "
+                f"(limit {self.max_ratio:.0%}, {self.percent:g}% encoded)")
+
+def kill_process(process):
+    """Kill an FFmpeg process together with everything it spawned
+
+    run_ffmpeg starts FFmpeg in its own process group (session) so hardware
+    helpers and filter subprocesses go down with it.
+    """
+    try:
+        if IS_WINDOWS:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                           capture_output=True, **popen_options(env=False))
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+# /proc/<pid>/io is sampled at most this often while FFmpeg runs (and once as it exits)
+IO_SAMPLE_SECONDS = 2.0
+
+def read_proc_io(pid):
+    """I/O of a running (or exited, not yet reaped) process, or None where /proc is unavailable
+
+    read/write count every byte passed through read()/write() (inputs served
+    from the page cache included), disk_read/disk_write what reached storage.
+    """
+    try:
+        with open(f"/proc/{pid}/io", encoding="ascii") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(fields["rchar"]), "write": int(fields["wchar"]),
+                "disk_read": int(fields["read_bytes"]), "disk_write": int(fields["write_bytes"])}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def read_proc_cpu(pid):
+    """(user, sys) CPU seconds of a not yet reaped process from /proc/<pid>/stat, or None"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        # utime, stime, then those of its reaped children
+        user, system, child_user, child_system = (int(v) for v in fields[11:15])
+        return (user + child_user) / ticks, (system + child_system) / ticks
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def read_proc_peak_rss(pid):
+    """Peak resident set size (bytes) of a running process from /proc/<pid>/status, or None"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def format_resources(usage):
+    """One line describing the cpu_time, user/sys_time, peak_rss and io of a run or result dict"""
+    parts = []
+    if usage.get("cpu_time") is not None:
+        cpu = f"CPU {format_duration(usage['cpu_time'])}"
+        if usage.get("user_time") is not None:
+            cpu += (f" (user {format_duration(usage['user_time'])}, "
+                    f"sys {format_duration(usage['sys_time'])})")
+        parts.append(cpu)
+    if usage.get("peak_rss"):
+        parts.append(f"peak RSS {format_size(usage['peak_rss'])}")
+    if usage.get("io"):
+        parts.append(f"read {format_size(usage['io']['read'])}, "
+                     f"wrote {format_size(usage['io']['write'])}")
+    return ", ".join(parts)
+
+def total_resources(results):
+    """Sum the resource usage of result dicts (EncodeResult.to_dict) for a batch report
+
+    peak_rss is the largest single job's. cpu_per_output_hour is CPU-hours
+    spent per hour of successfully encoded output, the figure to price a
+    node type by; None until something succeeded.
+    """
+    totals = {"cpu_time": 0.0, "user_time": 0.0, "sys_time": 0.0, "peak_rss": None, "io": None,
+              "output_seconds": 0.0, "cpu_per_output_hour": None}
+    for r in results:
+        for key in ("cpu_time", "user_time", "sys_time"):
+            totals[key] = round(totals[key] + (r.get(key) or 0), 2)
+        if r.get("peak_rss"):
+            totals["peak_rss"] = max(totals["peak_rss"] or 0, r["peak_rss"])
+        if r.get("io"):
+            totals["io"] = {key: (totals["io"] or {}).get(key, 0) + value
+                            for key, value in r["io"].items()}
+        if r.get("status") == "ok" and r.get("duration"):
+            totals["output_seconds"] = round(totals["output_seconds"] + r["duration"], 2)
+    if totals["output_seconds"]:
+        totals["cpu_per_output_hour"] = round(totals["cpu_time"] / totals["output_seconds"], 3)
+    return totals
+
+def fallback_settings(encoder, preset):
+    """(encoder, preset) to retry a failed encode with
+
+    GPU encoders fall back to SVT-AV1 at the same preset (a wedged driver
+    tends to stay wedged); CPU encoders move two presets faster.
+    """
+    if encoder in GPU_ENCODERS:
+        return "libsvtav1", int(preset)
+    return encoder, min(PRESET_MAX.get(encoder, 13), int(preset) + 2)
+
+def run_ffmpeg(cmd, duration=None, cpus=None, on_process=None, on_progress=None, on_line=None,
+               stall_timeout=None, priority=0, preempt="pause"):
+    """Run an FFmpeg command to completion, streaming its stderr
+
+    on_process(process) is called right after launch (for cancellation),
+    on_progress(progress, line) for every stats line (with percent/ETA when
+    duration is known) and on_line(line) for every other non-empty line.
+    When cpus is given the process is pinned to that core set. With
+    stall_timeout (seconds), a watchdog kills the process group once FFmpeg
+    made no progress (no new frame/size/time, or no output at all before the
+    first stats line) for that long. While a process with priority > 0 runs,
+    every lower-priority FFmpeg process of this app (already running or
+    started later) is suspended with preempt ("pause" or "throttle", see
+    suspend_process; None disables preemption) and resumes afterwards.
+    Returns a dict with exit_code, wall_time, cpu_time, user_time and
+    sys_time (seconds; from the child's own rusage where wait4 exists),
+    frames (the last reported frame count, None if FFmpeg never reported
+    one), peak_rss (bytes, where the platform reports it), io (see
+    read_proc_io; sampled during the run, None without /proc), stalled and
+    preempted (how many lower-priority encodes were suspended for this one).
+    """
+    start_time = time.monotonic()
+    frames = None
+    start_cpu = os.times()
+    last_activity = [start_time]
+    stalled = threading.Event()
+    finished = threading.Event()
+
+    # Affinity is per thread on Linux: pinning the calling thread makes the
+    # ffmpeg child (and every encoder thread it spawns) inherit the core set.
+    # The thread gets its own mask back so its next job starts unpinned.
+    previous = None
+    if cpus and hasattr(os, "sched_setaffinity"):
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, encoding="utf-8", errors="replace",
+                                   **popen_options(session=True))
+    finally:
+        if previous is not None:
+            os.sched_setaffinity(0, previous)
+    preempted = admit_process(process, priority, preempt)
+    if on_process is not None:
+        on_process(process)
+
+    def watchdog():
+        while not finished.wait(min(5.0, stall_timeout / 4)):
+            if process in _suspended:
+                # Paused or throttled (encode window, preemption), not stalled
+                last_activity[0] = time.monotonic()
+            elif time.monotonic() - last_activity[0] > stall_timeout:
+                stalled.set()
+                kill_process(process)
+                return
+
+    if stall_timeout:
+        threading.Thread(target=watchdog, daemon=True).start()
+
+    position = None
+    io = None
+    sampled = start_time
+    try:
+        for line in process.stderr:
+            if time.monotonic() - sampled >= IO_SAMPLE_SECONDS:
+                sampled = time.monotonic()
+                io = read_proc_io(process.pid) or io
+            line = line.strip()
+            if not line:
+                continue
+            progress = parse_progress(line)
+            if progress is not None:
+                frames = progress.get("frame", frames)
+                current = (progress.get("frame"), progress.get("size"), progress.get("time"))
+                if current != position:
+                    position = current
+                    last_activity[0] = time.monotonic()
+                if on_progress is not None:
+                    on_progress(add_estimates(progress, duration, time.monotonic() - start_time), line)
+            else:
+                if position is None:
+                    last_activity[0] = time.monotonic()
+                if on_line is not None:
+                    on_line(line)
+
+        # stderr closes as FFmpeg exits: its I/O counters are final now
+        io = read_proc_io(process.pid) or io
+        peak_rss = user_time = sys_time = None
+        try:
+            # Reap the child ourselves to get its resource usage
+            _, status, usage = os.wait4(process.pid, 0)
+        except (AttributeError, ChildProcessError):
+            # No wait4 (Windows), or a cancel already reaped it via Popen
+            process.wait()
+        else:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            user_time, sys_time = usage.ru_utime, usage.ru_stime
+    finally:
+        finished.set()
+        release_process(process)
+
+    if user_time is None:
+        # Every child reaped meanwhile counts here, so this overstates concurrent runs
+        end_cpu = os.times()
+        user_time = end_cpu.children_user - start_cpu.children_user
+        sys_time = end_cpu.children_system - start_cpu.children_system
+    return {
+        "exit_code": process.returncode,
+        "wall_time": round(time.monotonic() - start_time, 2),
+        "cpu_time": round(user_time + sys_time, 2),
+        "user_time": round(user_time, 2),
+        "sys_time": round(sys_time, 2),
+        "frames": frames,
+        "peak_rss": peak_rss,
+        "io": io,
+        "stalled": stalled.is_set(),
+        "preempted": preempted,
+    }
+
+
+class EncodeResult:
+    """Outcome of a single encode"""
+
+    def __init__(self, input_path, output_path, exit_code, command=None, duration=None,
+                 wall_time=0.0, cpu_time=0.0, size=None, error=None, frames=None,
+                 dropped_frames=None, peak_rss=None, attempts=None, oversize=None,
+                 user_time=None, sys_time=None, io=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.exit_code = exit_code
+        self.command = command
+        self.duration = duration
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.size = size
+        self.error = error
+        self.frames = frames
+        self.dropped_frames = dropped_frames
+        self.peak_rss = peak_rss
+        self.attempts = attempts or []
+        self.oversize = oversize
+        self.user_time = user_time
+        self.sys_time = sys_time
+        self.io = io
+
+    @property
+    def ok(self):
+        return self.exit_code == 0 and self.error is None
+
+    @property
+    def status(self):
+        if self.oversize:
+            return "oversize"
+        return "ok" if self.ok else "failed"
+
+    def to_dict(self):
+        result = {
+            "input": self.input_path,
+            "output": self.output_path,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "size": self.size,
+            "duration": self.duration,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+        }
+        if self.frames is not None:
+            result["frames"] = self.frames
+        if self.dropped_frames is not None:
+            result["dropped_frames"] = self.dropped_frames
+        if self.user_time is not None:
+            result["user_time"] = self.user_time
+            result["sys_time"] = self.sys_time
+        if self.peak_rss is not None:
+            result["peak_rss"] = self.peak_rss
+        if self.io is not None:
+            result["io"] = self.io
+        if len(self.attempts) > 1:
+            result["attempts"] = self.attempts
+        if self.oversize:
+            result["oversize"] = self.oversize
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+def encode(input_path, output_path, quality=50, preset=6, encoder="libsvtav1",
+           audio_codec="libopus", audio_bitrate="128k", resolution=None, tune=0, grain=0,
+           threads=0, cpus=None, duration=None, scratch_dir=None, crf=None, decimate=False,
+           crop=None, crop_confidence=CROP_CONFIDENCE, stall_timeout=None, retries=0,
+           backoff=RETRY_BACKOFF, fallback=False, segment_seconds=None, max_ratio=None,
+           oversize="keep", priority=0, preempt="pause", cancel=None, source_path=None, profiler=None,
+           ffmpeg=None,
+           ffprobe=None, on_note=None, on_command=None, on_process=None, on_progress=None,
+           on_line=None, on_retry=None):
+    """Encode one file to AV1 and return an EncodeResult
+
+    on_note(message) reports settings the engine overrode (e.g. audio),
+    on_command(cmd, duration) is called once the command is resolved, before
+    FFmpeg starts; the remaining callbacks are passed to run_ffmpeg. When cpus
+    is given the encode is pinned to that core set and the thread count is
+    capped to its size. A duration already known from planning skips the probe.
+    FFmpeg writes to a .part file (in scratch_dir when given) that is only
+    published to output_path once the encode succeeded. crf, when given,
+    is used as-is instead of being derived from quality. With decimate,
+    duplicate frames are dropped and the result reports how many. crop is
+    "w:h:x:y" or "auto" to run detect_crop() with crop_confidence.
+    A run that stalls for stall_timeout seconds or exits with an FFmpeg error
+    is retried up to retries times, waiting backoff seconds (doubling) in
+    between; with fallback each retry uses fallback_settings(). Before each
+    retry on_retry(attempt, delay, encoder, preset) is called with the failed
+    attempt's record and the settings of the next one. Every attempt is
+    listed in result.attempts. With segment_seconds the video is encoded as
+    resumable segments (see run_segmented); a rerun after a crash or cancel
+    only encodes what is missing.
+    With max_ratio, an encode whose projected output (see SizeGuard) exceeds
+    max_ratio times the input size is aborted: with oversize="keep" nothing
+    is written and the result's status is "oversize" (the original stays the
+    copy to keep); "retry" first runs once more OVERSIZE_CRF_STEP CRF higher.
+    Segmented encodes are checked on their video size so far (reused
+    segments included). priority and preempt go to
+    run_ffmpeg (single encodes in the GUI preempt a running batch).
+    cancel is a threading.Event the caller sets alongside killing FFmpeg:
+    once set, no further attempt starts and a retry wait ends at once.
+    source_path is the original file when input_path is a prefetched copy.
+    With a Profiler, probing, crop detection, every FFmpeg run (with its
+    -benchmark figures), retry waits and publishing are recorded as spans.
+    """
+    if crf is None:
+        crf = quality_to_crf(quality)
+    if cpus:
+        threads = len(cpus) if threads <= 0 else min(threads, len(cpus))
+
+    with profile_span(profiler, "probe"):
+        has_audio = audio_codec == "none" or probe_has_audio(input_path, ffprobe)
+    audio_codec, audio_bitrate, note = resolve_audio(audio_codec, audio_bitrate, output_path, has_audio)
+    if note and on_note is not None:
+        on_note(note)
+
+    info = None
+    if decimate or crop == "auto" or encoder in ("libaom-av1", "librav1e"):
+        with profile_span(profiler, "probe"):
+            info = probe_video(input_path, ffprobe)
+        duration = duration or info["duration"]
+    if crop == "auto":
+        with profile_span(profiler, "crop detection"):
+            detected = detect_crop(input_path, info, min_confidence=crop_confidence,
+                                   ffmpeg=ffmpeg, ffprobe=ffprobe)
+        crop = detected["crop"]
+        if on_note is not None:
+            if crop:
+                on_note(f"Cropping black bars to {crop} ({detected['confidence']:.0%} of samples agree)")
+            elif detected["confidence"] >= crop_confidence:
+                on_note("No black bars detected")
+            elif detected["samples"]:
+                on_note(f"No stable crop found ({detected['confidence']:.0%} of samples agree, "
+                        f"{crop_confidence:.0%} required); encoding the full frame")
+
+    frame_size = output_frame_size(info, resolution, crop)
+    part_path = staging_path(output_path, scratch_dir)
+
+    def command(encoder, preset):
+        cmd = build_command(input_path, output_path, crf, preset=preset, encoder=encoder,
+                            audio_codec=audio_codec, audio_bitrate=audio_bitrate,
+                            resolution=resolution, tune=tune, grain=grain, threads=threads,
+                            decimate=decimate, crop=crop, frame_size=frame_size, ffmpeg=ffmpeg)
+        if profiler is not None:
+            cmd.insert(1, "-benchmark")
+        return stage_command(cmd, part_path)
+
+    cmd = command(encoder, preset)
+    source_frames = None
+    if decimate and info["duration"] and info["fps"]:
+        source_frames = round(info["duration"] * info["fps"])
+    if duration is None:
+        with profile_span(profiler, "probe"):
+            duration = probe_duration(input_path, ffprobe)
+    if on_command is not None:
+        on_command(cmd, duration)
+
+    guard = None
+    if max_ratio and duration:
+        guard = SizeGuard(os.path.getsize(input_path), duration, max_ratio)
+    processes = []
+
+    def track(process):
+        processes.append(process)
+        if on_process is not None:
+            on_process(process)
+
+    def guarded_progress(progress, line):
+        if guard is not None and guard.check(progress):
+            kill_process(processes[-1])
+        if on_progress is not None:
+            on_progress(progress, line)
+
+    benchmark = {}
+
+    def handle_line(line):
+        if profiler is not None and line.startswith("bench:"):
+            # Summed over the runs of a segmented encode
+            for key, value in parse_benchmark(line).items():
+                benchmark[key] = max(benchmark.get(key, 0), value) if key == "maxrss" \
+                    else round(benchmark.get(key, 0) + value, 3)
+        elif on_line is not None:
+            on_line(line)
+
+    claim_part(part_path)
+    try:
+        attempts = []
+        while True:
+            try:
+                with profile_span(profiler, "ffmpeg", attempt=len(attempts) + 1, encoder=encoder,
+                                  preset=int(preset), crf=int(crf)) as span:
+                    benchmark.clear()
+                    if segment_seconds:
+                        run = run_segmented(cmd, input_path, output_path, duration=duration,
+                                            segment_seconds=segment_seconds,
+                                            source_path=source_path, ffprobe=ffprobe,
+                                            profiler=profiler, on_note=on_note,
+                                            on_progress=guarded_progress, cpus=cpus,
+                                            on_process=track, on_line=handle_line,
+                                            stall_timeout=stall_timeout, priority=priority,
+                                            preempt=preempt)
+                    else:
+                        run = run_ffmpeg(cmd, duration=duration, cpus=cpus, on_process=track,
+                                         on_progress=guarded_progress, on_line=handle_line,
+                                         stall_timeout=stall_timeout, priority=priority,
+                                         preempt=preempt)
+                    span.update(benchmark, exit_code=run["exit_code"], frames=run["frames"])
+            except (FileNotFoundError, OSError) as e:
+                return EncodeResult(input_path, output_path, None, command=cmd, duration=duration,
+                                    error=f"Could not start FFmpeg: {e}", attempts=attempts)
+            attempts.append({"attempt": len(attempts) + 1, "encoder": encoder, "preset": int(preset),
+                             "crf": int(crf), "exit_code": run["exit_code"],
+                             "wall_time": run["wall_time"], "stalled": run["stalled"]})
+            if guard is not None and guard.tripped:
+                attempts[-1]["oversize"] = guard.to_dict()
+                if oversize != "retry" or int(crf) >= 63 or any(
+                        "oversize" in attempt for attempt in attempts[:-1]):
+                    break
+                crf = min(63, int(crf) + OVERSIZE_CRF_STEP)
+                if on_note is not None:
+                    on_note(f"Aborted: {guard.describe()}; retrying at CRF {crf}")
+                if cancel is not None and cancel.is_set():
+                    break
+                guard = SizeGuard(guard.input_size, duration, max_ratio)
+                cmd = command(encoder, preset)
+                continue
+            if cancel is not None and cancel.is_set():
+                # taskkill leaves exit code 1 on Windows, so the code alone can't tell
+                break
+            # A negative exit code means FFmpeg was killed from outside (cancelled)
+            failed = run["stalled"] or (run["exit_code"] or 0) > 0
+            if not failed or len(attempts) > retries:
+                break
+            if fallback:
+                encoder, preset = fallback_settings(encoder, preset)
+            delay = backoff * 2 ** (len(attempts) - 1)
+            if on_retry is not None:
+                on_retry(attempts[-1], delay, encoder, preset)
+            with profile_span(profiler, "retry backoff"):
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+            if cancel is not None and cancel.is_set():
+                break
+            cmd = command(encoder, preset)
+
+        result = EncodeResult(input_path, output_path, run["exit_code"], command=cmd,
+                              duration=duration, wall_time=run["wall_time"],
+                              cpu_time=run["cpu_time"], frames=run["frames"],
+                              peak_rss=run["peak_rss"], attempts=attempts,
+                              user_time=run["user_time"], sys_time=run["sys_time"], io=run["io"])
+        if guard is not None and guard.tripped:
+            result.oversize = guard.to_dict()
+            result.error = f"Aborted: {guard.describe()}; kept the original"
+        if run["stalled"]:
+            result.error = f"FFmpeg stalled (no progress for {stall_timeout:g}s)"
+        if cancel is not None and cancel.is_set() and not result.ok:
+            result.error = "Cancelled"
+        if source_frames and run["frames"] is not None:
+            result.dropped_frames = max(0, source_frames - run["frames"])
+        if result.ok:
+            try:
+                with profile_span(profiler, "publish"):
+                    publish(part_path, output_path)
+                result.size = os.path.getsize(output_path)
+            except OSError as e:
+                result.error = f"Could not publish output: {e}"
+            else:
+                if segment_seconds:
+                    discard_segments(output_path)
+        elif segment_seconds and result.oversize:
+            # The original is the copy to keep: nothing left to resume
+            discard_segments(output_path)
+        elif segment_seconds and on_note is not None and os.path.isdir(segments_dir(output_path)) \
+                and any(name.endswith(".mkv") for name in os.listdir(segments_dir(output_path))):
+            on_note("Finished segments are kept; encoding this file again resumes it")
+        return result
+    finally:
+        discard_part(part_path)
+
+
+# ============ ENCODE WINDOWS ============
+
+# Where the desktop app keeps its recurring schedule (also read by the CLI)
+SCHEDULE_FILE = os.environ.get("AV1_SCHEDULE_FILE") or os.path.join(
+    os.path.expanduser("~"), ".av1_encoder_pro", "schedule.json")
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# What happens to running encodes when a window closes
+CLOSE_ACTIONS = ["pause", "throttle"]
+
+# Processes currently paused/throttled -> {action, original affinity, reasons}
+_suspended = {}
+_suspend_lock = threading.RLock()
+
+# (action, cpus) applied to FFmpeg processes started while a window is closed
+_suspend_mode = None
+
+def _parse_days(token):
+    days = set()
+    for part in token.lower().split(","):
+        if part in ("daily", "*"):
+            days.update(range(7))
+            continue
+        first, _, last = part.partition("-")
+        try:
+            start = WEEKDAYS.index(first[:3])
+            end = WEEKDAYS.index(last[:3]) if last else start
+        except ValueError:
+            raise ValueError(f"unknown day {part!r} (use mon..sun, ranges like mon-fri, or daily)")
+        days.update((start + i) % 7 for i in range((end - start) % 7 + 1))
+    return days
+
+def _parse_clock(text):
+    hours, _, minutes = text.partition(":")
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(f"invalid time {text!r}")
+    return value
+
+def parse_windows(spec):
+    """Parse "mon-fri 22:00-07:00; sat-sun" into [(days, start_min, end_min)]
+
+    Windows are separated by ";". Each has days (mon..sun, ranges such as
+    fri-mon, comma lists, or daily) and/or a HH:MM-HH:MM span; a missing
+    span means all day, missing days mean every day. A span that ends
+    before it starts runs past midnight into the next day. Raises ValueError
+    on anything else.
+    """
+    windows = []
+    for part in spec.split(";"):
+        tokens = part.split()
+        if not tokens:
+            continue
+        if len(tokens) > 2:
+            raise ValueError(f"expected '[days] [HH:MM-HH:MM]', got {part.strip()!r}")
+        days, start, end = set(range(7)), 0, 24 * 60
+        for token in tokens:
+            if ":" in token:
+                try:
+                    start, end = (_parse_clock(t) for t in token.split("-"))
+                except ValueError:
+                    raise ValueError(f"invalid time span {token!r} (use HH:MM-HH:MM)")
+                if start == end:
+                    raise ValueError(f"empty time span {token!r}")
+            else:
+                days = _parse_days(token)
+        windows.append((frozenset(days), start, end))
+    if not windows:
+        raise ValueError("no encode windows given")
+    return windows
+
+def _window_intervals(windows, now):
+    """Concrete (start, end) datetimes from yesterday to a week ahead, merged"""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    intervals = []
+    for offset in range(-1, 8):
+        day = midnight + datetime.timedelta(days=offset)
+        for days, start, end in windows:
+            if day.weekday() in days:
+                if end <= start:
+                    end += 24 * 60
+                intervals.append((day + datetime.timedelta(minutes=start),
+                                  day + datetime.timedelta(minutes=end)))
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def window_state(windows, now=None):
+    """(open, next_change) of the encode windows at now (local wall-clock time)"""
+    now = now or datetime.datetime.now()
+    for start, end in _window_intervals(windows, now):
+        if end > now:
+            return (True, end) if start <= now else (False, start)
+    return False, None
+
+def load_schedule(path=None):
+    """Saved schedule ({"enabled", "windows", "on_close"}), {} when there is none"""
+    try:
+        with open(path or SCHEDULE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_schedule(schedule, path=None):
+    path = path or SCHEDULE_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(schedule, f, indent=2)
+
+def _set_affinity(pid, cpus):
+    # sched_setaffinity on a pid only moves its main thread; move every encoder thread
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            os.sched_setaffinity(int(tid), cpus)
+        except OSError:
+            pass
+
+def suspend_process(process, action="pause", cpus=None, reason="window"):
+    """Pause (SIGSTOP) or throttle (pin onto cpus) an FFmpeg process group
+
+    Suspensions are counted per reason (an encode window, a preempting
+    process, ...); the process only continues once every reason was lifted
+    with resume_process(). Returns False where the platform cannot do it
+    (pausing needs POSIX signals, throttling Linux thread affinity).
+    """
+    with _suspend_lock:
+        if process in _suspended:
+            _suspended[process]["reasons"].add(reason)
+            return True
+        try:
+            if action == "throttle":
+                if not hasattr(os, "sched_setaffinity") or not os.path.isdir("/proc"):
+                    return False
+                original = os.sched_getaffinity(process.pid)
+                _set_affinity(process.pid, cpus or {max(original)})
+            else:
+                if IS_WINDOWS:
+                    return False
+                original = None
+                os.killpg(process.pid, signal.SIGSTOP)
+        except OSError:
+            return False
+        _suspended[process] = {"action": action, "original": original, "reasons": {reason}}
+        return True
+
+def resume_process(process, reason="window"):
+    """Lift one suspend_process() reason; the process continues when none is left"""
+    with _suspend_lock:
+        entry = _suspended.get(process)
+        if entry is None:
+            return
+        entry["reasons"].discard(reason)
+        if entry["reasons"]:
+            return
+        del _suspended[process]
+        try:
+            if entry["action"] == "throttle":
+                _set_affinity(process.pid, entry["original"])
+            else:
+                os.killpg(process.pid, signal.SIGCONT)
+        except OSError:
+            pass
+
+
+class EncodeWindows:
+    """Keep encodes inside recurring time windows (see parse_windows)
+
+    A background thread follows the wall clock, so it neither drifts nor
+    misses a transition after the machine slept. While the windows are
+    closed, every running FFmpeg process is paused (on_close="pause") or
+    throttled onto throttle_cpus ("throttle", default: the last core) and
+    wait_open() blocks new encodes; everything resumes when a window opens.
+    on_change(is_open, next_change, affected) is called on start and on
+    every transition, affected being the number of encodes the window
+    paused/resumed (encodes only held by a preemptor are not counted).
+    """
+
+    def __init__(self, spec, on_close="pause", throttle_cpus=None, on_change=None):
+        self.windows = parse_windows(spec)
+        self.spec = spec
+        self.on_close = on_close
+        self.throttle_cpus = throttle_cpus
+        self.on_change = on_change
+        self.next_change = None
+        self._open = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_open(self):
+        return self._open.is_set()
+
+    def start(self):
+        self._update(initial=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop following the schedule and resume anything still suspended"""
+        global _suspend_mode
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        _suspend_mode = None
+        for process in list(_suspended):
+            resume_process(process)
+        self._open.set()
+
+    def wait_open(self, cancelled=None):
+        """Block until a window is open; False if cancelled() turned true first"""
+        while not self._open.wait(1.0):
+            if cancelled is not None and cancelled():
+                return False
+        return True
+
+    def _run(self):
+        while True:
+            remaining = (self.next_change - datetime.datetime.now()).total_seconds() \
+                if self.next_change else 60
+            # Re-read the clock at least once a minute (suspend/resume, DST, clock changes)
+            if self._stop.wait(min(60, max(1, remaining))):
+                return
+            self._update()
+
+    def _update(self, initial=False):
+        global _suspend_mode
+        is_open, self.next_change = window_state(self.windows)
+        if not initial and is_open == self.is_open:
+            return
+        # Only count encodes the window itself suspends or releases, not those
+        # held by a preemptor alone
+        affected = 0
+        with _suspend_lock:
+            if is_open:
+                _suspend_mode = None
+                for process, entry in list(_suspended.items()):
+                    if "window" in entry["reasons"]:
+                        resume_process(process)
+                        affected += 1
+                self._open.set()
+            else:
+                self._open.clear()
+                _suspend_mode = (self.on_close, self.throttle_cpus)
+                for process in list(_live_processes):
+                    if "window" in _suspended.get(process, {}).get("reasons", ()):
+                        continue
+                    affected += suspend_process(process, self.on_close, self.throttle_cpus)
+        if self.on_change is not None:
+            self.on_change(is_open, self.next_change, affected)
+
+
+# ============ PROFILING ============
+
+# Where the desktop app writes its trace files
+TRACE_DIR = os.path.join(os.path.expanduser("~"), ".av1_encoder_pro", "traces")
+
+# "bench: utime=1.234s stime=0.100s rtime=2.345s" / "bench: maxrss=123456KiB" (ffmpeg -benchmark)
+BENCH_RE = re.compile(r"(utime|stime|rtime|maxrss)=([\d.]+)(s|kB|KiB)?")
+
+def parse_benchmark(line):
+    """Fields of an FFmpeg -benchmark line (seconds, maxrss in bytes), or {} for other lines"""
+    if not line.startswith("bench:"):
+        return {}
+    return {key: int(float(value) * 1024) if key == "maxrss" else float(value)
+            for key, value, _ in BENCH_RE.findall(line)}
+
+class Profiler:
+    """Record timed spans of a run's stages for a Chrome/Perfetto trace
+
+    span(name, **args) is a context manager timing one stage on the calling
+    thread; it yields its args dict so details found along the way can be
+    attached. A span costs two clock reads and a list append, so profiling
+    can stay on for production batches. write_trace(path) exports Chrome's
+    trace event JSON (chrome://tracing, ui.perfetto.dev) and summary()
+    totals the spans per stage.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.perf_counter(), **args)
+
+    def add(self, name, start, end, **args):
+        """Record a span from two time.perf_counter() readings"""
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                                 "ts": round((start - self._start) * 1e6),
+                                 "dur": round((end - start) * 1e6), "args": args})
+
+    def write_trace(self, path):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident,
+                    "args": {"name": name}} for ident, name in threads.items()]
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """[{stage, count, total, mean, max}] in seconds, most total time first"""
+        stages = {}
+        with self._lock:
+            for event in self._events:
+                stages.setdefault(event["name"], []).append(event["dur"] / 1e6)
+        rows = [{"stage": name, "count": len(durations), "total": round(sum(durations), 3),
+                 "mean": round(sum(durations) / len(durations), 3), "max": round(max(durations), 3)}
+                for name, durations in stages.items()]
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def format_summary(self):
+        """summary() as aligned text lines"""
+        lines = [f"{'stage':<16} {'count':>5} {'total':>9} {'mean':>8} {'max':>8}"]
+        for row in self.summary():
+            lines.append(f"{row['stage']:<16} {row['count']:>5} {row['total']:>8.2f}s "
+                         f"{row['mean']:>7.2f}s {row['max']:>7.2f}s")
+        return lines
+
+def profile_span(profiler, name, **args):
+    """profiler.span(name, **args), or a no-op when profiler is None"""
+    if profiler is None:
+        return contextlib.nullcontext(args)
+    return profiler.span(name, **args)
+
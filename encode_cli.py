@@ -5,93 +5,970 @@ For headless Docker usage without GUI
 
 Usage:
     python encode_cli.py -i input.mp4 -o output.webm -q 50 -p 6
+    python encode_cli.py -i input.mp4 -o output.webm --json
+    python encode_cli.py --batch-dir /videos --out-dir /output -j 2
+    python encode_cli.py coordinator --batch-dir /videos --out-dir /output
+    python encode_cli.py worker --coordinator http://host:8765
     python encode_cli.py --help
 """
-import subprocess
 import argparse
+import asyncio
+import json
 import os
+import sqlite3
 import sys
+import threading
+import time
 
-def get_ffmpeg_path():
-    """Find FFmpeg binary"""
-    return "ffmpeg"
+import av1_async
+import av1_cluster as cluster
+import av1_engine as engine
+
+# Serializes event lines written from concurrent batch workers
+_output_lock = threading.Lock()
+
+# Set on Ctrl+C so encodes waiting to retry give up instead of starting again
+_cancelled = threading.Event()
+
+def emit_event(event, **fields):
+    """Write a single NDJSON event line to stdout"""
+    record = {"event": event, "ts": round(time.time(), 3)}
+    record.update(fields)
+    with _output_lock:
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+def parse_cpu_list(text):
+    """Parse a kernel cpulist string such as "0-3,8-11" into a list of CPU ids"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpu_list(cpus):
+    """Format CPU ids back into compact cpulist form for logging"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def _read_sys(path):
+    with open(path, encoding="ascii") as f:
+        return f.read()
+
+def detect_cpu_topology():
+    """Return the CPUs this process may run on, grouped by NUMA node
+    
+    Each node's CPUs are ordered so SMT siblings sit next to each other,
+    which keeps contiguous slices made of whole physical cores.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        allowed = os.sched_getaffinity(0)
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+    
+    nodes = []
+    node_root = "/sys/devices/system/node"
+    try:
+        names = sorted((n for n in os.listdir(node_root) if n.startswith("node") and n[4:].isdigit()),
+                       key=lambda n: int(n[4:]))
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            cpus = [c for c in parse_cpu_list(_read_sys(os.path.join(node_root, name, "cpulist")))
+                    if c in allowed]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+    
+    # Fall back to a single node when /sys is unavailable (Windows, macOS, containers)
+    if sum(len(n) for n in nodes) != len(allowed):
+        nodes = [sorted(allowed)]
+    
+    def core_key(cpu):
+        try:
+            siblings = parse_cpu_list(_read_sys(
+                f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list"))
+            return (min(siblings), cpu)
+        except (OSError, ValueError):
+            return (cpu, cpu)
+    
+    return [sorted(cpus, key=core_key) for cpus in nodes]
+
+def assign_core_sets(nodes, count):
+    """Split the CPUs of nodes into up to count disjoint core sets
+    
+    With fewer jobs than nodes each job gets whole nodes; otherwise jobs are
+    spread over nodes in proportion to their size and never straddle one.
+    """
+    total = sum(len(n) for n in nodes)
+    count = max(1, min(count, total))
+    
+    if count <= len(nodes):
+        sets = [[] for _ in range(count)]
+        for i, node in enumerate(nodes):
+            sets[i % count].extend(node)
+        return sets
+    
+    per_node = [max(1, round(count * len(n) / total)) for n in nodes]
+    while sum(per_node) > count:
+        i = max(range(len(nodes)), key=lambda k: per_node[k])
+        per_node[i] -= 1
+    while sum(per_node) < count:
+        i = max(range(len(nodes)), key=lambda k: len(nodes[k]) / per_node[k])
+        per_node[i] += 1
+    
+    sets = []
+    for node, jobs in zip(nodes, per_node):
+        jobs = min(jobs, len(node))
+        base, extra = divmod(len(node), jobs)
+        start = 0
+        for j in range(jobs):
+            size = base + (1 if j < extra else 0)
+            sets.append(node[start:start + size])
+            start += size
+    return sets
 
 def encode_video(input_path, output_path, quality=50, preset=6, 
                  encoder="libsvtav1", audio_codec="libopus", audio_bitrate="128k",
-                 resolution=None, tune=0, grain=0):
-    """Encode video to AV1 using FFmpeg"""
-    
-    # Calculate CRF from quality percentage
-    crf = int(63 - (quality * 0.63))
-    
-    # Build command
-    ffmpeg = get_ffmpeg_path()
-    cmd = [ffmpeg, "-y", "-i", input_path]
-    
-    # Video encoding options
-    is_gpu = encoder in ["av1_nvenc", "av1_amf", "av1_qsv"]
-    
-    if encoder == "libsvtav1":
-        svt_params = f"tune={tune}"
-        if grain > 0:
-            svt_params += f":film-grain={grain}:film-grain-denoise=1"
-        cmd.extend(["-c:v", encoder, "-crf", str(crf), "-preset", str(preset), "-svtav1-params", svt_params])
-    elif is_gpu:
-        gpu_crf = min(51, crf)
-        cmd.extend(["-c:v", encoder])
-        if encoder == "av1_nvenc":
-            cmd.extend(["-cq", str(gpu_crf), "-preset", "p" + str(min(7, max(1, 8 - int(preset))))])
-        elif encoder == "av1_amf":
-            cmd.extend(["-rc", "cqp", "-qp_i", str(gpu_crf), "-qp_p", str(gpu_crf)])
-        elif encoder == "av1_qsv":
-            cmd.extend(["-global_quality", str(max(1, gpu_crf))])
+                 resolution=None, tune=0, grain=0, threads=0, json_output=False,
+                 progress_interval=1.0, job=None, cpus=None, duration=None, scratch_dir=None,
+                 on_progress=None, history=None, info=None, workers=1, source=None,
+                 auto=None, decimate=False, crop=None, crop_confidence=engine.CROP_CONFIDENCE,
+                 stall_timeout=None, retries=0, fallback=False, segment_seconds=None,
+                 max_ratio=None, oversize="keep", profiler=None):
+    """Encode video to AV1 using FFmpeg and return a result dict
+    
+    With json_output=True, progress is reported as NDJSON events on stdout
+    (start, progress, warning, error, result) instead of free-form text.
+    Progress events are throttled to one per progress_interval seconds.
+    When job is given it tags every event/line so concurrent encodes in a
+    batch can be told apart. When cpus is given the encode is pinned to that
+    core set and the encoder thread count is capped to its size.
+    on_progress, if given, is called with every parsed stats line (unthrottled).
+    FFmpeg writes to a .part file (in scratch_dir when given) that only
+    replaces output_path once the encode succeeded.
+    With history (an engine.EncodeHistory), the encode's time and size are
+    predicted up front and the outcome is recorded; info is the probed source
+    (probed here when not given) and workers the batch concurrency. source,
+    if given, is a local copy of input_path that FFmpeg reads instead.
+    With auto ({"crf_range", "preset_range"}), a short content analysis picks
+    CRF and preset within those bounds and film grain up to grain. decimate
+    drops duplicate frames (variable-frame-rate output) and reports how many.
+    crop is "w:h:x:y" or "auto" (detected, applied above crop_confidence).
+    An encode without progress for stall_timeout seconds is killed; stalled
+    or failed encodes are retried up to retries times (with fallback, on
+    SVT-AV1 instead of a GPU encoder or at a faster preset).
+    With segment_seconds the encode is resumable: segments already finished
+    by an interrupted run of the same command are reused.
+    With max_ratio, an encode projected to end up larger than that share of
+    the input is aborted and the original kept (oversize="keep"), or first
+    retried at a higher CRF (oversize="retry").
+    With profiler (an engine.Profiler), every stage is recorded as a span.
+    """
+    tag = f"[{job}] " if job else ""
+    last_emit = [0.0]
+    crf = engine.quality_to_crf(quality)
+    if cpus:
+        job_threads = len(cpus) if threads <= 0 else min(threads, len(cpus))
     else:
-        cmd.extend(["-c:v", encoder, "-crf", str(crf), "-cpu-used", str(preset)])
-    
-    # Resolution scaling
-    if resolution:
-        res_map = {
-            "4k": "3840:2160",
-            "1080p": "1920:1080",
-            "720p": "1280:720",
-            "480p": "854:480"
-        }
-        if resolution.lower() in res_map:
-            cmd.extend(["-vf", f"scale={res_map[resolution.lower()]}:flags=lanczos"])
-    
-    # Audio options
-    if audio_codec == "none":
-        cmd.append("-an")
-    elif audio_codec == "copy":
-        cmd.extend(["-c:a", "copy"])
+        job_threads = threads
+    analysis = None
+    prediction = None
+    
+    def report(event, **fields):
+        if job:
+            fields["job"] = job
+        emit_event(event, **fields)
+    
+    def handle_note(message):
+        if json_output:
+            report("warning", message=message)
+        else:
+            print(f"{tag}[INFO] {message}")
+    
+    def handle_command(cmd, duration):
+        if json_output:
+            report("start", input=input_path, output=output_path, encoder=encoder,
+                   crf=crf, preset=preset, threads=threads, duration=duration,
+                   cpus=format_cpu_list(cpus) if cpus else None, estimate=prediction,
+                   command=cmd)
+        else:
+            print(f"{tag}[INFO] Input: {input_path}")
+            print(f"{tag}[INFO] Output: {output_path}")
+            print(f"{tag}[INFO] Encoder: {encoder}, CRF: {crf}, Preset: {preset}")
+            if cpus:
+                print(f"{tag}[INFO] Pinned to CPUs {format_cpu_list(cpus)}")
+            if prediction:
+                size = f", ~{engine.format_size(prediction['size'])}" if prediction["size"] else ""
+                print(f"{tag}[INFO] Estimate: ~{engine.format_duration(prediction['wall_time'])}"
+                      f"{size} (from {prediction['samples']} past encodes)")
+            print(f"{tag}[CMD] {' '.join(cmd)}")
+            print()
+    
+    def handle_progress(progress, line):
+        if on_progress is not None:
+            on_progress(progress)
+        if not json_output:
+            print(f"{tag}[PROGRESS] {line}")
+            return
+        now = time.monotonic()
+        if now - last_emit[0] >= progress_interval:
+            last_emit[0] = now
+            report("progress", **progress)
+    
+    def handle_line(line):
+        level = engine.line_level(line)
+        if level is None:
+            return
+        if json_output:
+            report(level, message=line)
+        elif level == "error":
+            print(f"{tag}[ERROR] {line}")
+    
+    def handle_retry(attempt, delay, next_encoder, next_preset):
+        if attempt["stalled"]:
+            reason = f"stalled (no progress for {stall_timeout:g}s)"
+        else:
+            reason = f"failed with code {attempt['exit_code']}"
+        if json_output:
+            report("retry", attempt=attempt["attempt"], reason=reason, delay=delay,
+                   encoder=next_encoder, preset=next_preset)
+        else:
+            print(f"\n{tag}[RETRY] Attempt {attempt['attempt']} {reason}; retrying in "
+                  f"{engine.format_duration(delay)} with {next_encoder} preset {next_preset} "
+                  f"(attempt {attempt['attempt'] + 1} of {retries + 1})")
+    
+    if auto:
+        with engine.profile_span(profiler, "analysis"):
+            analysis = engine.analyze_content(source or input_path, duration)
+        if analysis is None:
+            handle_note("Content analysis failed; using the configured CRF and preset")
+        else:
+            chosen = engine.choose_settings(analysis, auto["crf_range"], auto["preset_range"],
+                                            max_grain=grain, encoder=encoder)
+            crf, preset, grain = chosen["crf"], chosen["preset"], chosen["grain"]
+            analysis.update(chosen)
+            if json_output:
+                report("analysis", **analysis)
+            else:
+                print(f"{tag}[ANALYSIS] SI {analysis['si']}, TI {analysis['ti']}, "
+                      f"noise {analysis['noise']}, {analysis['cuts_per_min']} cuts/min "
+                      f"({analysis['time']:.1f}s) -> CRF {crf}, preset {preset}, grain {grain}")
+    
+    if history is not None:
+        if info is None:
+            with engine.profile_span(profiler, "probe"):
+                info = engine.probe_video(input_path)
+        prediction = history.predict(info, encoder, preset, crf, job_threads, resolution, workers)
+    
+    result = engine.encode(source or input_path, output_path, crf=crf, preset=preset,
+                           encoder=encoder, audio_codec=audio_codec,
+                           audio_bitrate=audio_bitrate, resolution=resolution, tune=tune,
+                           grain=grain, threads=threads, cpus=cpus, duration=duration,
+                           scratch_dir=scratch_dir, decimate=decimate, crop=crop,
+                           crop_confidence=crop_confidence, stall_timeout=stall_timeout,
+                           retries=retries, fallback=fallback, segment_seconds=segment_seconds,
+                           max_ratio=max_ratio, oversize=oversize, cancel=_cancelled,
+                           source_path=input_path,
+                           profiler=profiler, on_note=handle_note,
+                           on_command=handle_command, on_progress=handle_progress,
+                           on_line=handle_line, on_retry=handle_retry)
+    result.input_path = input_path
+    if result.attempts:
+        # Record what actually produced the output after a fallback or oversize retry
+        last = result.attempts[-1]
+        encoder, preset, crf = last["encoder"], last["preset"], last["crf"]
+    
+    if history is not None:
+        try:
+            with engine.profile_span(profiler, "history"):
+                history.record(result, info, encoder, preset, crf, job_threads, resolution, workers)
+        except sqlite3.Error as e:
+            handle_note(f"Could not record encode history: {e}")
+    
+    summary = result.to_dict()
+    if analysis:
+        summary["analysis"] = analysis
+    
+    if json_output:
+        report("result", **summary)
+    elif result.ok:
+        if result.dropped_frames is not None:
+            source_frames = result.frames + result.dropped_frames
+            print(f"{tag}[INFO] Dropped {result.dropped_frames} of {source_frames} frames as "
+                  f"duplicates ({100 * result.dropped_frames / max(1, source_frames):.0f}%)")
+        print(f"\n{tag}[DONE] Encoding complete!")
+        resources = engine.format_resources(summary)
+        if resources:
+            print(f"{tag}[RESOURCES] {resources}")
+    elif result.oversize:
+        print(f"\n{tag}[OVERSIZE] {result.error}")
+    elif result.error:
+        print(f"\n{tag}[ERROR] {result.error}")
     else:
-        cmd.extend(["-c:a", audio_codec, "-b:a", audio_bitrate])
+        print(f"\n{tag}[ERROR] Encoding failed with code {result.exit_code}")
+    
+    return summary
+
+def parse_range(text):
+    """argparse type for "LOW-HIGH" integer ranges"""
+    try:
+        low, high = (int(v) for v in text.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LOW-HIGH, got {text!r}")
+    return min(low, high), max(low, high)
+
+def parse_crop(text):
+    """argparse type for --crop: "auto" or a W:H:X:Y rectangle"""
+    if text == "auto" or (text.count(":") == 3 and all(v.isdigit() for v in text.split(":"))):
+        return text
+    raise argparse.ArgumentTypeError(f"expected auto or W:H:X:Y, got {text!r}")
+
+def plan_batch(batch_dir, out_dir, output_format="webm", overwrite=False):
+    """Map every video under batch_dir to an output path mirroring its subfolder
     
-    cmd.append(output_path)
+    Returns (jobs, skipped) where skipped lists inputs whose output already exists.
+    """
+    jobs = []
+    skipped = []
+    for input_path, size in engine.discover_videos(batch_dir):
+        rel_dir = os.path.relpath(os.path.dirname(input_path), batch_dir)
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        output_path = os.path.normpath(os.path.join(out_dir, rel_dir, f"{name}_av1.{output_format}"))
+        if not overwrite and os.path.exists(output_path):
+            skipped.append({"input": input_path, "output": output_path, "status": "skipped"})
+        else:
+            jobs.append({"input": input_path, "output": output_path, "size": size})
+    return jobs, skipped
+
+
+class JobScheduler:
+    """Run jobs concurrently on a bounded number of worker slots
     
-    print(f"[INFO] Input: {input_path}")
-    print(f"[INFO] Output: {output_path}")
-    print(f"[INFO] Encoder: {encoder}, CRF: {crf}, Preset: {preset}")
-    print(f"[CMD] {' '.join(cmd)}")
-    print()
+    run_job(job) is called on a worker thread for every job and must return a
+    result dict; exceptions are turned into a failed result. When core_sets
+    is given, each running job is handed a free set as job["cpus"] so
+    concurrent encodes never share cores. With a memory_budget, a job is
+    only started while the projected peaks (job["memory"]) of everything
+    running fit the budget; the first queued job that fits goes next, and a
+    job always starts when nothing else runs. on_hold(job, committed) is
+    called once for each job that had to wait for memory. With windows (an
+    engine.EncodeWindows), jobs only start while an encode window is open.
+    """
+    
+    def __init__(self, run_job, workers=1, core_sets=None, memory_budget=None, on_hold=None,
+                 windows=None):
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        if core_sets:
+            self.workers = min(self.workers, len(core_sets))
+        self._free_cores = list(core_sets or [])
+        self.memory_budget = memory_budget
+        self.on_hold = on_hold
+        self.windows = windows
+        self.memory_committed = 0
+        self._cond = threading.Condition()
+        self._running = 0
+        self.pending = 0
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def set_workers(self, workers):
+        """Change the concurrency limit; running jobs are never interrupted"""
+        with self._cond:
+            self.workers = max(1, workers)
+            self._cond.notify_all()
+    
+    def _fits(self, job):
+        if not self.memory_budget or self._running == 0:
+            return True
+        return self.memory_committed + job.get("memory", 0) <= self.memory_budget
+    
+    def run(self, jobs):
+        """Run all jobs and return their results in submission order"""
+        results = [None] * len(jobs)
+        threads = []
+        queue = list(enumerate(jobs))
+        held = set()
+        self.pending = len(jobs)
+        while queue:
+            if self.windows is not None:
+                self.windows.wait_open()
+            with self._cond:
+                while True:
+                    if self._running < self.workers:
+                        position = next((i for i, (_, job) in enumerate(queue) if self._fits(job)), None)
+                        if position is not None:
+                            break
+                        index, job = queue[0]
+                        if index not in held:
+                            held.add(index)
+                            if self.on_hold is not None:
+                                self.on_hold(job, self.memory_committed)
+                    self._cond.wait()
+                index, job = queue.pop(position)
+                self._running += 1
+                self.pending -= 1
+                self.memory_committed += job.get("memory", 0)
+                if self._free_cores:
+                    job["cpus"] = self._free_cores.pop(0)
+            thread = threading.Thread(target=self._worker, args=(index, job, results), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def _worker(self, index, job, results):
+        try:
+            results[index] = self.run_job(job)
+        except Exception as e:
+            results[index] = {"input": job.get("input"), "output": job.get("output"),
+                              "status": "failed", "error": str(e)}
+        finally:
+            with self._cond:
+                self._running -= 1
+                self.memory_committed -= job.get("memory", 0)
+                if job.get("cpus"):
+                    self._free_cores.append(job["cpus"])
+                self._cond.notify_all()
+
+
+def read_cpu_times():
+    """Return (busy, total) jiffies from /proc/stat, or None where unavailable"""
+    try:
+        with open("/proc/stat", encoding="ascii") as f:
+            fields = [int(v) for v in f.readline().split()[1:9]]
+    except (OSError, ValueError):
+        return None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    total = sum(fields)
+    return total - idle, total
+
+
+class FrameCounter:
+    """Frames encoded so far by a batch: running jobs' latest counts plus finished jobs' totals
+    
+    Encode workers call update(key, frame) from their progress callbacks and
+    finish(key) when a job ends, so total() never drops when a job completes
+    (or an attempt restarts at frame 0) between two samples.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}
+        self._completed = 0
+    
+    def update(self, key, frame):
+        with self._lock:
+            previous = self._running.get(key, 0)
+            if frame < previous:
+                # A retry starts over: the earlier attempt's frames were still encoded
+                self._completed += previous
+            self._running[key] = frame
+    
+    def finish(self, key):
+        with self._lock:
+            self._completed += self._running.pop(key, 0)
+    
+    def total(self):
+        with self._lock:
+            return self._completed + sum(self._running.values())
+
+
+class ConcurrencyController:
+    """Hill-climb the number of concurrent encodes to maximize aggregate fps
+    
+    Every interval seconds the frames the batch encoded since the previous
+    sample (jobs that finished in between included) are turned into an
+    aggregate frames/sec figure and
+    compared with the figure measured at the previous concurrency level.
+    A step that gains more than `hysteresis` (relative) is repeated, a step
+    that loses more than that is reverted, anything in between holds. While
+    holding, spare CPU triggers an upward probe. frames is the batch's
+    FrameCounter, updated by the encode workers.
+    """
+    
+    def __init__(self, scheduler, frames, max_workers, min_workers=1, interval=30.0,
+                 hysteresis=0.05, cpu_busy=0.9, json_output=False):
+        self.scheduler = scheduler
+        self.frames = frames
+        self.max_workers = max(min_workers, max_workers)
+        self.min_workers = max(1, min_workers)
+        self.interval = interval
+        self.hysteresis = hysteresis
+        self.cpu_busy = cpu_busy
+        self.json_output = json_output
+        self.decisions = []
+        self._direction = 0
+        self._last_fps = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+    
+    def _loop(self):
+        prev_frames = self.frames.total()
+        prev_cpu = read_cpu_times()
+        prev_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            frames = self.frames.total()
+            cpu = read_cpu_times()
+            fps = max(0.0, (frames - prev_frames) / (now - prev_time))
+            util = None
+            if cpu and prev_cpu and cpu[1] > prev_cpu[1]:
+                util = (cpu[0] - prev_cpu[0]) / (cpu[1] - prev_cpu[1])
+            prev_frames, prev_cpu, prev_time = frames, cpu, now
+            
+            # Only judge a level while every slot is busy; otherwise the
+            # queue is draining and fewer jobs naturally means fewer fps
+            if self.scheduler.pending == 0 or self.scheduler.running < self.scheduler.workers:
+                continue
+            self.adjust(fps, util)
+    
+    def adjust(self, fps, util):
+        """Apply one hill-climbing step given the latest measurement"""
+        current = self.scheduler.workers
+        spare_cpu = util is None or util < self.cpu_busy
+        
+        if self._last_fps is None:
+            step, reason = (1, "probing for headroom") if spare_cpu else (0, "CPU saturated")
+        else:
+            gain = (fps - self._last_fps) / max(self._last_fps, 1e-6)
+            if self._direction and gain > self.hysteresis:
+                step, reason = self._direction, f"{gain:+.0%} throughput, continuing"
+            elif self._direction and gain < -self.hysteresis:
+                step, reason = -self._direction, f"{gain:+.0%} throughput, reverting"
+            elif not self._direction and gain < -self.hysteresis and current > self.min_workers:
+                step, reason = -1, f"{gain:+.0%} throughput, backing off"
+            elif not self._direction and spare_cpu:
+                step, reason = 1, "spare CPU, probing for headroom"
+            else:
+                step, reason = 0, "holding"
+        
+        target = max(self.min_workers, min(self.max_workers, current + step))
+        # After a revert, hold at the restored level instead of oscillating
+        self._direction = 0 if (self._direction and step == -self._direction) else target - current
+        self._last_fps = fps
+        
+        decision = {"previous": current, "workers": target, "fps": round(fps, 1),
+                    "cpu": round(util * 100) if util is not None else None, "reason": reason}
+        self.decisions.append(decision)
+        if self.json_output:
+            emit_event("concurrency", **decision)
+        elif target != current:
+            cpu_text = f", CPU {decision['cpu']}%" if util is not None else ""
+            print(f"[ADAPTIVE] workers {current} -> {target}: {fps:.1f} fps{cpu_text} ({reason})")
+        if target != current:
+            self.scheduler.set_workers(target)
+
+
+def run_batch(batch_dir, out_dir, workers=1, output_format="webm", overwrite=False,
+              json_output=False, report_path=None, pin=True, adaptive=False,
+              adaptive_interval=30.0, order="lpt", prefetch=0, prefetch_budget=None,
+              memory_budget=None, windows=None, **encode_opts):
+    """Encode every video under batch_dir into out_dir and return the report dict
+    
+    With more than one worker and pin=True, each concurrent encode is pinned
+    to its own NUMA-local core set (Linux only). With adaptive=True, workers
+    is an upper bound and a ConcurrencyController tunes the live job count;
+    pinning is skipped then, since fixed core sets would cap each job at
+    1/workers of the machine while fewer jobs are running. order picks the
+    dispatch order from probed cost estimates (see engine.ORDER_STRATEGIES).
+    With prefetch > 0, that many upcoming inputs are copied to the scratch
+    folder ahead of their encode (within prefetch_budget bytes). With a
+    history in encode_opts, per-job and whole-batch time and output size are
+    predicted before the first encode starts. Concurrent encodes are admitted
+    only while their projected peak memory fits memory_budget (bytes; None
+    uses a share of the cgroup limit or physical RAM, 0 disables the check).
+    With windows (a started engine.EncodeWindows), jobs only start inside
+    the encode windows and running ones are suspended outside them.
+    A profiler in encode_opts also records the batch's own stages.
+    """
+    start_time = time.monotonic()
+    profiler = encode_opts.get("profiler")
+    with engine.profile_span(profiler, "scan"):
+        jobs, skipped = plan_batch(batch_dir, out_dir, output_format, overwrite)
+    total = len(jobs)
+    removed = engine.clean_output_partials(job["output"] for job in jobs)
+    if removed and not json_output:
+        print(f"[INFO] Removed {removed} stale partial file(s) from the output folders")
+    
+    history = encode_opts.get("history")
+    memory_source = "--mem-budget"
+    if memory_budget is None:
+        limit, memory_source = engine.memory_limit()
+        memory_budget = int(limit * engine.MEMORY_HEADROOM) if limit else 0
+    if workers <= 1:
+        memory_budget = 0
+    
+    if total and (history is not None or memory_budget or (order != "fifo" and total > 1)):
+        # One event loop drives all the ffprobe processes
+        with engine.profile_span(profiler, "probe", files=total):
+            infos = asyncio.run(av1_async.probe_videos([job["input"] for job in jobs]))
+        for job in jobs:
+            job["info"] = infos[job["input"]]
+            job["duration"] = job["info"]["duration"]
+    
+    if order != "fifo" and total > 1:
+        for job in jobs:
+            job["cost"] = engine.estimate_cost(job["info"], job["size"],
+                                               preset=encode_opts.get("preset", 6),
+                                               encoder=encode_opts.get("encoder", "libsvtav1"),
+                                               resolution=encode_opts.get("resolution"))
+        jobs = engine.order_by_cost(jobs, lambda job: job["cost"], order)
+    
+    core_sets = None
+    if pin and workers > 1 and not adaptive and hasattr(os, "sched_setaffinity"):
+        nodes = detect_cpu_topology()
+        core_sets = assign_core_sets(nodes, workers)
+        if len(core_sets) < workers and not json_output:
+            print(f"[WARNING] Only {len(core_sets)} CPU(s) available for pinning; "
+                  f"running {len(core_sets)} worker(s) (use --no-pin to oversubscribe)")
+        workers = len(core_sets)
+    
+    threads = encode_opts.get("threads", 0)
+    if core_sets:
+        threads = len(core_sets[0]) if threads <= 0 else min(threads, len(core_sets[0]))
+    
+    if memory_budget:
+        auto = encode_opts.get("auto")
+        # Slower presets need more memory; --auto may pick the slowest in range
+        preset = auto["preset_range"][0] if auto else encode_opts.get("preset", 6)
+        crop = encode_opts.get("crop")
+        for job in jobs:
+            frame_size = engine.output_frame_size(job["info"], encode_opts.get("resolution"),
+                                                  crop if crop != "auto" else None)
+            job["memory"] = engine.estimate_memory(encode_opts.get("encoder", "libsvtav1"),
+                                                   frame_size, preset, threads, history)
+    
+    estimate = None
+    if history is not None and total:
+        for job in jobs:
+            job["estimate"] = history.predict(job["info"], encode_opts.get("encoder", "libsvtav1"),
+                                              encode_opts.get("preset", 6),
+                                              engine.quality_to_crf(encode_opts.get("quality", 50)),
+                                              threads, encode_opts.get("resolution"), workers)
+        predicted = [job["estimate"] for job in jobs if job["estimate"]]
+        if predicted:
+            estimate = {
+                "wall_time": round(engine.plan_makespan([p["wall_time"] for p in predicted], workers), 1),
+                "size": sum(p["size"] or 0 for p in predicted),
+                "predicted_jobs": len(predicted),
+                "samples": len(history.rows()),
+            }
+    
+    if json_output:
+        emit_event("batch_start", batch_dir=batch_dir, out_dir=out_dir, jobs=total,
+                   skipped=len(skipped), workers=workers, order=order,
+                   core_sets=[format_cpu_list(c) for c in core_sets] if core_sets else None,
+                   memory_budget=memory_budget or None, estimate=estimate)
+    else:
+        print(f"[INFO] Batch: {total} files to encode, {len(skipped)} skipped (output exists)")
+        print(f"[INFO] Workers: {'adaptive, up to ' if adaptive else ''}{workers}")
+        if order != "fifo" and total > 1:
+            print(f"[INFO] Order: {'longest' if order == 'lpt' else 'shortest'} estimated encode first")
+        if core_sets:
+            print(f"[INFO] CPU placement: {len(nodes)} NUMA node(s), core sets "
+                  + " | ".join(format_cpu_list(c) for c in core_sets))
+        if memory_budget and jobs:
+            print(f"[INFO] Memory budget: {engine.format_size(memory_budget)} ({memory_source}); "
+                  f"largest job needs ~{engine.format_size(max(job['memory'] for job in jobs))}")
+        if estimate:
+            print(f"[ESTIMATE] ~{engine.format_duration(estimate['wall_time'])} with {workers} "
+                  f"worker(s), ~{engine.format_size(estimate['size'])} output "
+                  f"({estimate['predicted_jobs']}/{total} files predicted from "
+                  f"{estimate['samples']} past encodes)")
+    
+    prefetcher = None
+    if prefetch and total > 1:
+        prefetcher = engine.Prefetcher([job["input"] for job in jobs], encode_opts["scratch_dir"],
+                                       depth=prefetch, budget=prefetch_budget, profiler=profiler)
+        if not json_output:
+            print(f"[INFO] Prefetch: next {prefetch} input(s) to {encode_opts['scratch_dir']} "
+                  f"(budget {engine.format_size(prefetcher.budget)})")
+        prefetcher.start()
+    
+    # Frames encoded by the batch, sampled by the adaptive controller
+    frames = FrameCounter()
+    
+    def run_job(job):
+        label = f"{job['index']}/{total}"
+        if not json_output:
+            print(f"[BATCH {label}] {job['input']}")
+        os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+        
+        def on_progress(progress):
+            if "frame" in progress:
+                frames.update(job["index"], progress["frame"])
+        
+        with engine.profile_span(profiler, "prefetch wait"):
+            source = prefetcher.acquire(job["input"]) if prefetcher else None
+        try:
+            with engine.profile_span(profiler, "job", input=job["input"]):
+                return encode_video(job["input"], job["output"], json_output=json_output,
+                                    job=label, cpus=job.get("cpus"), duration=job.get("duration"),
+                                    on_progress=on_progress, info=job.get("info"),
+                                    workers=scheduler.workers, source=source, **encode_opts)
+        finally:
+            frames.finish(job["index"])
+            if prefetcher:
+                prefetcher.release(job["input"])
+    
+    def on_hold(job, committed):
+        if json_output:
+            emit_event("memory_hold", job=f"{job['index']}/{total}", input=job["input"],
+                       memory=job["memory"], committed=committed, budget=memory_budget)
+        else:
+            print(f"[MEMORY] Holding {os.path.basename(job['input'])} "
+                  f"(~{engine.format_size(job['memory'])}) until memory frees up: "
+                  f"{engine.format_size(committed)} of {engine.format_size(memory_budget)} committed")
+    
+    for index, job in enumerate(jobs, start=1):
+        job["index"] = index
+    
+    controller = None
+    if adaptive:
+        scheduler = JobScheduler(run_job, min(2, workers), memory_budget=memory_budget,
+                                 on_hold=on_hold, windows=windows)
+        controller = ConcurrencyController(scheduler, frames, max_workers=workers,
+                                           interval=adaptive_interval, json_output=json_output)
+        controller.start()
+    else:
+        scheduler = JobScheduler(run_job, workers, core_sets, memory_budget=memory_budget,
+                                 on_hold=on_hold, windows=windows)
+    try:
+        results = scheduler.run(jobs)
+    finally:
+        if controller:
+            controller.stop()
+        if prefetcher:
+            prefetcher.stop()
     
-    # Run FFmpeg (stdout inherited, stderr piped for progress)
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, universal_newlines=True)
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    oversize = [r for r in results if r["status"] == "oversize"]
+    failed = total - succeeded - len(oversize)
+    report = {
+        "batch_dir": batch_dir,
+        "out_dir": out_dir,
+        "succeeded": succeeded,
+        "failed": failed,
+        "skipped": len(skipped),
+        "wall_time": round(time.monotonic() - start_time, 2),
+        "input_bytes": sum(os.path.getsize(r["input"]) for r in results if os.path.exists(r["input"])),
+        "output_bytes": sum(r.get("size") or 0 for r in results),
+        "dropped_frames": sum(r.get("dropped_frames") or 0 for r in results)
+                          if encode_opts.get("decimate") else None,
+        "retried": sum(1 for r in results if r.get("attempts")),
+        "oversize": len(oversize),
+        "resources": engine.total_resources(results),
+        "concurrency": controller.decisions if controller else None,
+        "prefetch": prefetcher.stats if prefetcher else None,
+        "estimate": estimate,
+        "memory_budget": memory_budget or None,
+        "jobs": results + skipped,
+    }
     
-    for line in process.stderr:
-        if "frame=" in line or "size=" in line or "time=" in line:
-            print(f"[PROGRESS] {line.strip()}")
-        elif "error" in line.lower():
-            print(f"[ERROR] {line.strip()}")
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
     
-    process.wait()
+    if json_output:
+        emit_event("batch_result", **{k: v for k, v in report.items()
+                                      if k not in ("jobs", "concurrency")})
+    else:
+        print()
+        print("=== Batch report ===")
+        for r in results:
+            if r["status"] == "oversize":
+                print(f"[OVERSIZE] {r['input']} (projected {engine.format_size(r['oversize']['projected_size'])}, "
+                      f"{r['oversize']['ratio']:.0%} of the input; kept the original)")
+            elif r["status"] != "ok":
+                print(f"[FAILED] {r['input']}")
+            elif r.get("attempts"):
+                last = r["attempts"][-1]
+                print(f"[RETRIED] {r['input']} (ok on attempt {last['attempt']}, "
+                      f"{last['encoder']} preset {last['preset']})")
+        if report["dropped_frames"] is not None:
+            print(f"[INFO] Dropped {report['dropped_frames']} duplicate frames in total")
+        resources = report["resources"]
+        if resources["cpu_time"]:
+            line = engine.format_resources(resources)
+            if resources["cpu_per_output_hour"] is not None:
+                line += f"; {resources['cpu_per_output_hour']:.2f} CPU-hours per output hour"
+            print(f"[RESOURCES] {line}")
+        if prefetcher:
+            stats = prefetcher.stats
+            print(f"[INFO] Prefetched {stats['prefetched']} input(s) "
+                  f"({engine.format_size(stats['bytes'])}), {stats['direct']} read in place")
+        kept = f", {len(oversize)} kept as original" if oversize else ""
+        print(f"[BATCH COMPLETED] {succeeded} succeeded, {failed} failed{kept}, "
+              f"{len(skipped)} skipped in {report['wall_time']:.0f}s")
+    return report
+
+# encode_video options a coordinator sends along with every job
+CLUSTER_SETTINGS = ("quality", "preset", "encoder", "audio_codec", "audio_bitrate", "resolution",
+                    "tune", "grain", "auto", "decimate", "crop", "crop_confidence",
+                    "stall_timeout", "retries", "fallback", "progress_interval", "max_ratio",
+                    "oversize")
+
+def cluster_reporter(json_output, prefix):
+    """on_event callback for the coordinator ("job") and worker ("worker") agents"""
+    def report(event, **fields):
+        if json_output:
+            emit_event(f"{prefix}_{event}", **fields)
+            return
+        name = os.path.basename(fields.get("input") or "")
+        worker = fields.get("worker")
+        if event == "leased":
+            print(f"[CLUSTER] {name} -> {worker} (attempt {fields['attempt']})")
+        elif event == "expired":
+            print(f"[CLUSTER] Lease on {name} expired: {worker} stopped sending heartbeats")
+        elif event == "requeued":
+            print(f"[CLUSTER] Requeued {name} ({fields['error']})")
+        elif event == "done":
+            print(f"[DONE] {name} from {worker} ({engine.format_size(fields['size'])}"
+                  f"{', ' + engine.format_duration(fields['wall_time']) if fields.get('wall_time') else ''})")
+        elif event == "oversize":
+            print(f"[OVERSIZE] {name} from {worker} (projected "
+                  f"{engine.format_size(fields['oversize']['projected_size'])}, "
+                  f"{fields['oversize']['ratio']:.0%} of the input; kept the original)")
+        elif event == "failed":
+            print(f"[FAILED] {name} after {fields['attempt']} attempt(s): {fields['error']}")
+        elif event == "job":
+            print(f"[WORKER] {worker}: encoding {name}")
+        elif event == "lease_lost":
+            print(f"[WARNING] {worker}: lease on {name} was reassigned; dropped the encode")
+        elif event == "error":
+            print(f"[ERROR] {worker}: {name + ': ' if name else ''}{fields['error']}")
+        elif event == "unreachable":
+            print(f"[ERROR] {worker}: coordinator unreachable ({fields['error']}); giving up")
+        elif event == "finished":
+            kept = f"{fields['kept']} kept as original, " if fields.get("kept") else ""
+            print(f"[WORKER] {worker}: batch finished ({fields['completed']} encoded, "
+                  f"{kept}{fields['failed']} failed here)")
+    return report
+
+def run_coordinator(batch_dir, out_dir, output_format="webm", overwrite=False, json_output=False,
+                    report_path=None, host=cluster.DEFAULT_HOST, port=8765,
+                    lease_seconds=cluster.LEASE_SECONDS,
+                    token=None, scratch_dir=None, settings=None):
+    """Serve a batch to worker agents (encode_cli.py worker) and return the report
     
-    if process.returncode == 0:
-        print("\n[DONE] Encoding complete!")
-        return True
+    Outputs land in out_dir mirroring batch_dir, exactly as with run_batch;
+    workers download each source, encode it with settings and upload the result.
+    """
+    start_time = time.monotonic()
+    jobs, skipped = plan_batch(batch_dir, out_dir, output_format, overwrite)
+    removed = engine.clean_output_partials(job["output"] for job in jobs)
+    if removed and not json_output:
+        print(f"[INFO] Removed {removed} stale partial file(s) from the output folders")
+    coordinator = cluster.Coordinator(jobs, settings or {}, host=host, port=port,
+                                      lease_seconds=lease_seconds, token=token,
+                                      scratch_dir=scratch_dir,
+                                      on_event=cluster_reporter(json_output, "job"))
+    if json_output:
+        emit_event("batch_start", batch_dir=batch_dir, out_dir=out_dir, jobs=len(jobs),
+                   skipped=len(skipped), coordinator=coordinator.url)
     else:
-        print(f"\n[ERROR] Encoding failed with code {process.returncode}")
-        return False
+        print(f"[CLUSTER] Coordinator on {coordinator.url}: {len(jobs)} job(s), "
+              f"{len(skipped)} skipped (output exists)")
+        print(f"[CLUSTER] Start workers with: encode_cli.py worker --coordinator http://<this-host>:{port}")
+    results = coordinator.run() if jobs else []
+    
+    report = {
+        "batch_dir": batch_dir,
+        "out_dir": out_dir,
+        "succeeded": sum(1 for job in results if job["status"] == "done"),
+        "failed": sum(1 for job in results if job["status"] == "failed"),
+        "skipped": len(skipped),
+        "oversize": sum(1 for job in results if job["status"] == "oversize"),
+        "wall_time": round(time.monotonic() - start_time, 2),
+        "jobs": [{"input": job["input"], "output": job["output"],
+                  "status": {"done": "ok", "oversize": "oversize"}.get(job["status"], "failed"),
+                  "worker": job["worker"], "attempts": job["attempts"],
+                  "size": job.get("size") if job["status"] == "done" else None,
+                  "error": job.get("error"), "oversize": job.get("oversize"),
+                  **(job.get("result") or {})}
+                 for job in results] + skipped,
+    }
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if json_output:
+        emit_event("batch_result", **{k: v for k, v in report.items() if k != "jobs"})
+    else:
+        kept = f", {report['oversize']} kept as original" if report["oversize"] else ""
+        print(f"[BATCH COMPLETED] {report['succeeded']} succeeded, {report['failed']} failed{kept}, "
+              f"{len(skipped)} skipped in {report['wall_time']:.0f}s")
+    return report
+
+def run_worker(coordinator_url, name=None, token=None, json_output=False, threads=0,
+               scratch_dir=None, history=None):
+    """Encode jobs leased from a coordinator until its batch is done
+    
+    Returns the number of jobs this worker completed.
+    """
+    def encode(source, output, settings, on_progress):
+        settings = {k: v for k, v in settings.items() if k in CLUSTER_SETTINGS}
+        return encode_video(source, output, json_output=json_output, job=agent.name,
+                            threads=threads, history=history, on_progress=on_progress,
+                            **settings)
+    
+    agent = cluster.WorkerAgent(coordinator_url, encode, name=name, scratch_dir=scratch_dir,
+                                token=token, on_event=cluster_reporter(json_output, "worker"))
+    if not json_output:
+        print(f"[WORKER] {agent.name}: pulling jobs from {coordinator_url}")
+    return agent.run()
+
+def report_profile(profiler, trace_path, json_output=False):
+    """Write the Chrome trace and print (or emit) the per-stage summary"""
+    profiler.write_trace(trace_path)
+    if json_output:
+        emit_event("profile", trace=trace_path, stages=profiler.summary())
+        return
+    print()
+    print(f"[PROFILE] Trace written to {trace_path} (open in ui.perfetto.dev or chrome://tracing)")
+    for line in profiler.format_summary():
+        print(f"[PROFILE] {line}")
+
+def window_reporter(json_output, on_close):
+    """on_change callback for engine.EncodeWindows that logs every transition"""
+    def report(is_open, next_change, affected):
+        until = next_change.strftime("%a %d %b %H:%M") if next_change else "further notice"
+        if json_output:
+            emit_event("window", open=is_open, until=next_change.isoformat() if next_change else None,
+                       affected=affected)
+        elif is_open:
+            resumed = f"; resumed {affected} encode(s)" if affected else ""
+            print(f"[WINDOW] Encode window open until {until}{resumed}")
+        else:
+            action = "paused" if on_close == "pause" else "throttled"
+            suspended = f"; {affected} running encode(s) {action}" if affected else ""
+            print(f"[WINDOW] Outside the encode windows until {until}{suspended}")
+    return report
 
 def main():
     parser = argparse.ArgumentParser(
@@ -110,57 +987,290 @@ Examples:
 
   Film with grain:
     python encode_cli.py -i movie.mp4 -o movie_av1.mp4 -q 60 -g 15
+
+  Machine-readable progress (one JSON event per line):
+    python encode_cli.py -i video.mp4 -o video_av1.webm --json
+
+  Batch encode a folder tree, two encodes at a time:
+    python encode_cli.py --batch-dir /videos --out-dir /output -j 2
         """
     )
     
-    parser.add_argument("-i", "--input", required=True, help="Input video file path")
-    parser.add_argument("-o", "--output", required=True, help="Output video file path")
+    parser.add_argument("mode", nargs="?", default="encode", choices=["encode", "coordinator", "worker"],
+                        help="encode (default); coordinator serves --batch-dir to worker agents; "
+                             "worker encodes jobs from --coordinator")
+    parser.add_argument("-i", "--input", help="Input video file path")
+    parser.add_argument("-o", "--output", help="Output video file path")
     parser.add_argument("-q", "--quality", type=int, default=50, 
                         help="Quality 0-100 (default: 50, maps to CRF)")
     parser.add_argument("-p", "--preset", type=int, default=6, choices=range(0, 14),
                         help="Speed preset 0-13 (default: 6, lower=slower/better)")
     parser.add_argument("-e", "--encoder", default="libsvtav1",
-                        choices=["libsvtav1", "libaom-av1", "librav1e", "av1_nvenc", "av1_amf", "av1_qsv"],
+                        choices=engine.ENCODERS,
                         help="AV1 encoder to use (default: libsvtav1)")
     parser.add_argument("-a", "--audio", default="libopus",
-                        choices=["libopus", "aac", "copy", "none"],
+                        choices=engine.AUDIO_CODECS,
                         help="Audio codec (default: libopus)")
     parser.add_argument("-b", "--bitrate", default="128k",
                         help="Audio bitrate (default: 128k)")
     parser.add_argument("-r", "--resolution", default=None,
-                        choices=["4k", "1080p", "720p", "480p"],
+                        choices=list(engine.RESOLUTIONS),
                         help="Output resolution (default: original)")
     parser.add_argument("-t", "--tune", type=int, default=0, choices=[0, 1, 2],
                         help="Tune: 0=VQ, 1=PSNR, 2=SSIM (default: 0)")
     parser.add_argument("-g", "--grain", type=int, default=0,
                         help="Film grain 0-50 (default: 0, SVT-AV1 only)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Encoder threads, 0=auto (default: 0; per job in pinned batch mode)")
+    parser.add_argument("--json", action="store_true",
+                        help="Emit machine-readable NDJSON events on stdout")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="Minimum seconds between JSON progress events (default: 1.0)")
+    parser.add_argument("--decimate", action="store_true",
+                        help="Drop duplicate/near-duplicate frames and write variable-frame-rate "
+                             "output (screen recordings, slideshows, animation)")
+    parser.add_argument("--crop", type=parse_crop, metavar="auto|W:H:X:Y",
+                        help="Crop black bars before scaling: auto detects them per file, "
+                             "W:H:X:Y forces a rectangle (default: no crop)")
+    parser.add_argument("--crop-confidence", type=float, default=engine.CROP_CONFIDENCE,
+                        help="Share of sampled frames that must agree on the detected crop "
+                             "(default: %(default)s)")
+    parser.add_argument("--auto", action="store_true",
+                        help="Analyze each title (a few sampled seconds) and pick CRF, preset and "
+                             "film grain per file; -g becomes the grain ceiling")
+    parser.add_argument("--crf-range", type=parse_range, metavar="LOW-HIGH",
+                        help="CRF bounds for --auto (default: the -q CRF +/- 6)")
+    parser.add_argument("--preset-range", type=parse_range, metavar="SLOW-FAST",
+                        help="Preset bounds for --auto (default: -p +/- 2)")
+    parser.add_argument("--stall-timeout", type=float, default=0, metavar="SEC",
+                        help="Kill an encode that made no progress for this long (default: off)")
+    parser.add_argument("--retries", type=int, default=0, metavar="N",
+                        help="Retry a stalled or failed encode up to N times, waiting "
+                             f"{engine.RETRY_BACKOFF}s, then twice as long each time")
+    parser.add_argument("--fallback", action="store_true",
+                        help="Retry GPU encodes with libsvtav1 and CPU encodes two presets faster")
+    parser.add_argument("--resumable", type=float, nargs="?", const=engine.SEGMENT_SECONDS,
+                        metavar="SEC",
+                        help="Encode in keyframe-aligned segments of about SEC seconds (default: "
+                             f"{engine.SEGMENT_SECONDS}) kept next to the output, so a rerun after "
+                             "a crash or cancel only encodes the missing ones")
+    parser.add_argument("--max-ratio", type=float, metavar="R",
+                        help="Abort an encode once its output is projected to exceed R times the "
+                             "input size, e.g. 0.9 (default: off)")
+    parser.add_argument("--oversize", default="keep", choices=engine.OVERSIZE_ACTIONS,
+                        help="After such an abort keep the original, or retry once "
+                             f"{engine.OVERSIZE_CRF_STEP} CRF higher (default: keep)")
+    parser.add_argument("--windows", metavar="SPEC",
+                        help="Only encode inside recurring windows, e.g. \"mon-fri 22:00-07:00; "
+                             "sat-sun\"; 'saved' uses the desktop app's schedule")
+    parser.add_argument("--on-close", default="pause", choices=engine.CLOSE_ACTIONS,
+                        help="What running encodes do when a window closes: pause (SIGSTOP) "
+                             "or throttle onto one core (default: pause)")
+    parser.add_argument("--profile", metavar="TRACE",
+                        help="Time every stage (probing, copies, encode, mux, publish) and write "
+                             "a Chrome/Perfetto trace JSON to TRACE, plus a summary table")
+    parser.add_argument("--history", default=engine.HISTORY_DB, metavar="DB",
+                        help="SQLite file finished encodes are recorded in and time/size "
+                             "estimates are learned from (default: %(default)s)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Don't record this run or estimate from past encodes")
+    parser.add_argument("--scratch-dir", default=os.environ.get("AV1_SCRATCH_DIR"),
+                        help="Fast local folder for in-progress .part files; finished outputs "
+                             "are moved into place (default: $AV1_SCRATCH_DIR, else next to "
+                             "the output)")
+    
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--batch-dir", help="Encode every video under this folder (recursive)")
+    batch.add_argument("--out-dir", help="Output folder; the input folder structure is mirrored")
+    batch.add_argument("-j", "--workers", type=int, default=1,
+                       help="Number of concurrent encodes (default: 1)")
+    batch.add_argument("-f", "--format", default="webm", choices=["webm", "mp4", "mkv"],
+                       help="Output container for batch mode (default: webm)")
+    batch.add_argument("--overwrite", action="store_true",
+                       help="Re-encode files whose output already exists (default: skip)")
+    batch.add_argument("--report", help="Write the final batch report as JSON to this file")
+    batch.add_argument("--no-pin", action="store_true",
+                       help="Don't pin concurrent encodes to disjoint NUMA-local core sets")
+    batch.add_argument("--order", default="lpt", choices=engine.ORDER_STRATEGIES,
+                       help="Dispatch order from probed duration/resolution/preset: lpt=longest "
+                            "first (finishes the batch soonest), spt=shortest first, fifo=scan order "
+                            "(default: lpt)")
+    batch.add_argument("--adaptive", action="store_true",
+                       help="Tune the number of concurrent encodes from measured throughput "
+                            "(-j becomes the upper bound; defaults to the CPU count)")
+    batch.add_argument("--adaptive-interval", type=float, default=30.0,
+                       help="Seconds between adaptive concurrency decisions (default: 30)")
+    batch.add_argument("--mem-budget", type=float, default=None, metavar="GB",
+                       help="Only start another encode while the projected peak memory of all "
+                            "running encodes fits this budget (default: 85%% of the cgroup limit "
+                            "or physical RAM; 0 disables)")
+    batch.add_argument("--prefetch", type=int, default=0, metavar="N",
+                       help="Copy the next N inputs to --scratch-dir while the current ones "
+                            "encode (default: 0 = read in place)")
+    batch.add_argument("--prefetch-budget", type=float, default=None, metavar="GB",
+                       help="Disk space prefetched inputs may use (default: half the free "
+                            "space of --scratch-dir)")
+    
+    cluster_group = parser.add_argument_group("distributed mode")
+    cluster_group.add_argument("--coordinator", metavar="URL",
+                               help="Coordinator to pull jobs from (worker mode)")
+    cluster_group.add_argument("--name", help="Worker name shown by the coordinator (default: host-pid)")
+    cluster_group.add_argument("--host", default=cluster.DEFAULT_HOST,
+                               help="Address the coordinator listens on; anything but loopback "
+                                    f"requires --token (default: {cluster.DEFAULT_HOST})")
+    cluster_group.add_argument("--port", type=int, default=8765,
+                               help="Port the coordinator listens on (default: 8765)")
+    cluster_group.add_argument("--lease", type=float, default=cluster.LEASE_SECONDS, metavar="SEC",
+                               help="Reassign a job when its worker sent no heartbeat for this long "
+                                    f"(default: {cluster.LEASE_SECONDS})")
+    cluster_group.add_argument("--token", default=os.environ.get("AV1_CLUSTER_TOKEN"),
+                               help="Shared secret between coordinator and workers "
+                                    "(also AV1_CLUSTER_TOKEN)")
     
     args = parser.parse_args()
     
+    encode_opts = {
+        "quality": args.quality,
+        "preset": args.preset,
+        "encoder": args.encoder,
+        "audio_codec": args.audio,
+        "audio_bitrate": args.bitrate,
+        "resolution": args.resolution,
+        "tune": args.tune,
+        "grain": args.grain,
+        "threads": args.threads,
+        "progress_interval": args.progress_interval,
+        "scratch_dir": args.scratch_dir,
+        "history": None,
+        "auto": None,
+        "decimate": args.decimate,
+        "crop": args.crop,
+        "crop_confidence": args.crop_confidence,
+        "stall_timeout": args.stall_timeout or None,
+        "retries": args.retries,
+        "fallback": args.fallback,
+        "segment_seconds": args.resumable,
+        "max_ratio": args.max_ratio,
+        "oversize": args.oversize,
+        "profiler": engine.Profiler() if args.profile else None,
+    }
+    
+    if args.auto:
+        crf = engine.quality_to_crf(args.quality)
+        encode_opts["auto"] = {
+            "crf_range": args.crf_range or (max(0, crf - 6), min(63, crf + 6)),
+            "preset_range": args.preset_range or (max(0, args.preset - 2), min(13, args.preset + 2)),
+        }
+    
+    if not args.no_history:
+        try:
+            encode_opts["history"] = engine.EncodeHistory(args.history)
+        except (OSError, sqlite3.Error) as e:
+            if not args.json:
+                print(f"[WARNING] Encode history unavailable ({e}); continuing without it")
+    
+    windows = None
+    if args.windows:
+        spec = args.windows
+        if spec == "saved":
+            spec = engine.load_schedule().get("windows")
+            if not spec:
+                parser.error(f"--windows saved: no schedule in {engine.SCHEDULE_FILE}")
+        try:
+            windows = engine.EncodeWindows(spec, on_close=args.on_close,
+                                           on_change=window_reporter(args.json, args.on_close))
+        except ValueError as e:
+            parser.error(f"--windows: {e}")
+        windows.start()
+    
+    if args.scratch_dir:
+        os.makedirs(args.scratch_dir, exist_ok=True)
+        removed = engine.clean_stale_partials(args.scratch_dir)
+        if removed and not args.json:
+            print(f"[INFO] Removed {removed} stale partial file(s) from {args.scratch_dir}")
+    
+    if args.mode == "worker":
+        if not args.coordinator:
+            parser.error("worker mode requires --coordinator URL")
+        run_worker(args.coordinator, name=args.name, token=args.token, json_output=args.json,
+                   threads=args.threads, scratch_dir=args.scratch_dir,
+                   history=encode_opts["history"])
+        sys.exit(0)
+    
+    if args.mode == "coordinator":
+        if not args.batch_dir or not args.out_dir:
+            parser.error("coordinator mode requires --batch-dir and --out-dir")
+        if not args.token and not cluster.is_loopback(args.host):
+            parser.error(f"--host {args.host} exposes the batch to the network; set --token "
+                         "(or AV1_CLUSTER_TOKEN) on the coordinator and every worker")
+        if args.resumable:
+            # Each lease downloads the source to a fresh folder: there is nothing to resume
+            parser.error("--resumable is not supported in coordinator mode")
+        settings = {k: v for k, v in encode_opts.items() if k in CLUSTER_SETTINGS}
+        report = run_coordinator(args.batch_dir, args.out_dir, output_format=args.format,
+                                 overwrite=args.overwrite, json_output=args.json,
+                                 report_path=args.report, host=args.host, port=args.port,
+                                 lease_seconds=args.lease, token=args.token,
+                                 scratch_dir=args.scratch_dir, settings=settings)
+        sys.exit(0 if report["failed"] == 0 else 1)
+    
+    if args.batch_dir:
+        if not args.out_dir:
+            parser.error("--batch-dir requires --out-dir")
+        if not os.path.isdir(args.batch_dir):
+            print(f"[ERROR] Batch folder not found: {args.batch_dir}")
+            sys.exit(1)
+        if args.prefetch and not args.scratch_dir:
+            parser.error("--prefetch requires --scratch-dir")
+        workers = args.workers
+        if args.adaptive and workers == 1:
+            workers = os.cpu_count() or 1
+        report = run_batch(args.batch_dir, args.out_dir, workers=workers,
+                           output_format=args.format, overwrite=args.overwrite,
+                           json_output=args.json, report_path=args.report,
+                           pin=not args.no_pin, adaptive=args.adaptive,
+                           adaptive_interval=args.adaptive_interval, order=args.order,
+                           prefetch=args.prefetch,
+                           memory_budget=None if args.mem_budget is None else int(args.mem_budget * 1024**3),
+                           prefetch_budget=int(args.prefetch_budget * 1024**3) if args.prefetch_budget else None,
+                           windows=windows, **encode_opts)
+        if args.profile:
+            report_profile(encode_opts["profiler"], args.profile, args.json)
+        sys.exit(0 if report["failed"] == 0 else 1)
+    
+    if not args.input or not args.output:
+        parser.error("-i/--input and -o/--output are required (or use --batch-dir)")
+    
     # Validate input file
     if not os.path.exists(args.input):
-        print(f"[ERROR] Input file not found: {args.input}")
+        if args.json:
+            emit_event("result", status="failed", exit_code=None, output=args.output,
+                       error=f"Input file not found: {args.input}")
+        else:
+            print(f"[ERROR] Input file not found: {args.input}")
         sys.exit(1)
     
     # Ensure output directory exists
     output_dir = os.path.dirname(args.output)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    removed = engine.clean_output_partials([args.output])
+    if removed and not args.json:
+        print(f"[INFO] Removed {removed} stale partial file(s) next to {args.output}")
     
-    success = encode_video(
-        args.input,
-        args.output,
-        quality=args.quality,
-        preset=args.preset,
-        encoder=args.encoder,
-        audio_codec=args.audio,
-        audio_bitrate=args.bitrate,
-        resolution=args.resolution,
-        tune=args.tune,
-        grain=args.grain
-    )
+    if windows is not None:
+        windows.wait_open()
+    result = encode_video(args.input, args.output, json_output=args.json, **encode_opts)
+    if args.profile:
+        report_profile(encode_opts["profiler"], args.profile, args.json)
     
-    sys.exit(0 if success else 1)
+    sys.exit(0 if result["status"] == "ok" else 1)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        # FFmpeg runs in its own session and does not see the terminal's Ctrl+C
+        _cancelled.set()
+        engine.terminate_all()
+        sys.exit(130)
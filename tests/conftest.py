@@ -0,0 +1,85 @@
+import os
+import stat
+import sys
+import textwrap
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stands in for FFmpeg: prints FAKE_STEPS stats lines FAKE_SLEEP seconds apart
+# and writes a small output. FAKE_FAIL=<word> fails every run whose command
+# line contains that word (e.g. an encoder name); FAKE_HANG=<word> makes such
+# runs hang without progress after the first stats line. With -benchmark it
+# reports fixed figures at the end.
+FAKE_FFMPEG = """
+import os, sys, time
+args = sys.argv[1:]
+if "-version" in args:
+    print("ffmpeg version fake")
+    sys.exit(0)
+steps = int(os.environ.get("FAKE_STEPS", "3"))
+for i in range(1, steps + 1):
+    sys.stderr.write(f"frame= {i * 25} fps= 25 q=30.0 size= {i * 100}kB "
+                     f"time=00:00:{i:02d}.00 bitrate= 800kbits/s speed=1.0x\\r")
+    sys.stderr.flush()
+    time.sleep(float(os.environ.get("FAKE_SLEEP", "0.05")))
+    hang = os.environ.get("FAKE_HANG")
+    if hang and hang in args:
+        time.sleep(600)
+fail = os.environ.get("FAKE_FAIL")
+if fail and fail in args:
+    sys.stderr.write("\\nError: fake failure\\n")
+    sys.exit(1)
+out = args[-1]
+if out not in ("-", "/dev/null") and not out.startswith("pipe:"):
+    with open(out, "wb") as f:
+        f.write(b"x" * 1000)
+sys.stderr.write("\\n")
+if "-benchmark" in args:
+    sys.stderr.write("bench: utime=0.500s stime=0.100s rtime=1.000s\\nbench: maxrss=2048KiB\\n")
+"""
+
+# Stands in for ffprobe: every input is a 10 s 1920x1080 25 fps video without
+# audio, with a keyframe every 2 s
+FAKE_FFPROBE = """
+import json, sys
+args = " ".join(sys.argv)
+if "-of json" in args:
+    print(json.dumps({"streams": [{"width": 1920, "height": 1080, "avg_frame_rate": "25/1"}],
+                      "format": {"duration": "10.0"}}))
+elif "format=duration" in args:
+    print("10.0")
+elif "packet=pts_time,flags" in args:
+    for i in range(250):
+        print(f"{i / 25:.6f},{'K_' if i % 50 == 0 else '__'}")
+"""
+
+
+def _write_tool(folder, name, source):
+    path = os.path.join(folder, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"#!{sys.executable}\n" + textwrap.dedent(source))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put fake ffmpeg/ffprobe executables first on PATH; returns their folder"""
+    if sys.platform == "win32":
+        pytest.skip("the fake tools are POSIX scripts")
+    folder = tmp_path / "bin"
+    folder.mkdir()
+    _write_tool(str(folder), "ffmpeg", FAKE_FFMPEG)
+    _write_tool(str(folder), "ffprobe", FAKE_FFPROBE)
+    monkeypatch.setenv("PATH", f"{folder}{os.pathsep}{os.environ['PATH']}")
+    return folder
+
+
+@pytest.fixture
+def video(tmp_path):
+    """A stand-in input file (the fake tools never read it)"""
+    path = tmp_path / "input.mp4"
+    path.write_bytes(b"\0" * 100000)
+    return str(path)
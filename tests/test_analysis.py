@@ -0,0 +1,60 @@
+import subprocess
+
+import pytest
+
+import av1_engine as engine
+
+EASY = {"si": 10.0, "ti": 0.5, "noise": 0.5, "cuts_per_min": 0.0}
+HARD = {"si": 90.0, "ti": 40.0, "noise": 8.0, "cuts_per_min": 60.0}
+
+
+def test_easy_content_gets_the_highest_crf_and_fastest_preset():
+    chosen = engine.choose_settings(EASY, (24, 36), (4, 8), max_grain=10)
+    assert chosen == {"crf": 36, "preset": 8, "grain": 0, "complexity": 0.0}
+
+
+def test_hard_content_gets_the_lowest_crf_and_slowest_preset():
+    # Ranges may be given either way round
+    chosen = engine.choose_settings(HARD, (36, 24), (8, 4), max_grain=10)
+    assert chosen == {"crf": 24, "preset": 4, "grain": 10, "complexity": 1.0}
+
+
+def test_settings_move_with_complexity():
+    middle = dict(EASY, si=42.5, ti=13.0, cuts_per_min=16.0)
+    chosen = engine.choose_settings(middle, (24, 36), (4, 8))
+    assert chosen["complexity"] == pytest.approx(0.5)
+    assert chosen["crf"] == 30 and chosen["preset"] == 6
+
+
+def test_grain_follows_the_noise_floor_on_svtav1_only():
+    noisy = dict(EASY, noise=3.5)
+    assert engine.choose_settings(noisy, (24, 36), (4, 8), max_grain=10)["grain"] == 5
+    assert engine.choose_settings(noisy, (24, 36), (4, 8), max_grain=0)["grain"] == 0
+    assert engine.choose_settings(noisy, (24, 36), (4, 8), max_grain=10,
+                                  encoder="libaom-av1")["grain"] == 0
+
+
+def test_analyze_content_measures_siti_noise_and_cuts(monkeypatch):
+    # One short window: TI of the first frame has nothing to compare with and is skipped
+    lines = []
+    for i in range(11):
+        lines += [f"frame:{i}", f"lavfi.siti.si={30 + i}", f"lavfi.siti.ti={99 if i == 0 else i}"]
+    lines.append("lavfi.scd.time=0.4")
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout="\n".join(lines), stderr="")
+
+    monkeypatch.setattr(engine.subprocess, "run", run)
+    analysis = engine.analyze_content("in.mkv", duration=6.0, ffmpeg="ffmpeg")
+    assert len(calls) == 1
+    assert analysis["si"] == 35.0 and analysis["ti"] == 5.5
+    assert analysis["noise"] == 2.0
+    assert analysis["cuts_per_min"] == 10.0 and analysis["frames"] == 11
+
+
+def test_analyze_content_without_siti(monkeypatch):
+    monkeypatch.setattr(engine.subprocess, "run",
+                        lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 1, stdout="", stderr=""))
+    assert engine.analyze_content("in.mkv", duration=600.0, ffmpeg="ffmpeg") is None
@@ -0,0 +1,32 @@
+import queue
+
+import av1_async
+
+
+def test_tk_callback_queues_results_for_the_caller_thread():
+    supervisor = av1_async.Supervisor()
+    results = queue.Queue()
+    calls = []
+
+    async def answer():
+        return 42
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    try:
+        for coro in (answer(), fail()):
+            future = supervisor.submit(coro, av1_async.tk_callback(results, calls.append))
+            try:
+                future.result(timeout=5)
+            except RuntimeError:
+                pass
+        queued = [results.get(timeout=5) for _ in range(2)]
+    finally:
+        supervisor.close()
+
+    # Nothing ran on the loop thread; the caller drains and calls back itself
+    assert calls == []
+    for callback, result in queued:
+        callback(result)
+    assert sorted(calls, key=str) == [42, None]
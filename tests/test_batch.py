@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import encode_cli
+
+
+def test_frame_counter_keeps_finished_and_restarted_jobs():
+    frames = encode_cli.FrameCounter()
+    frames.update(1, 100)
+    frames.update(2, 50)
+    assert frames.total() == 150
+    frames.update(1, 300)
+    frames.finish(1)
+    # The finished job's frames still count
+    assert frames.total() == 350
+    # A retry of job 2 starts again at frame 10
+    frames.update(2, 10)
+    assert frames.total() == 360
+    frames.finish(2)
+    frames.finish(3)
+    assert frames.total() == 360
+
+
+class BusyScheduler:
+    workers = running = pending = 1
+
+
+def test_controller_counts_jobs_finishing_between_samples():
+    frames = encode_cli.FrameCounter()
+    controller = encode_cli.ConcurrencyController(BusyScheduler(), frames, max_workers=4,
+                                                  interval=0.5)
+    measured = []
+    controller.adjust = lambda fps, util: measured.append(fps)
+    controller.start()
+    try:
+        frames.update("a", 100)
+        frames.finish("a")
+        frames.update("b", 100)
+        deadline = time.monotonic() + 5
+        while not measured and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        controller.stop()
+    # 200 frames in about half a second: without the finished job it would be at most 200 fps
+    assert 250 < measured[0] <= 400
+
+
+def test_memory_budget_holds_a_job_and_starts_the_next_that_fits():
+    started = []
+    release = {name: threading.Event() for name in "abc"}
+    held = []
+
+    def run_job(job):
+        started.append(job["name"])
+        release[job["name"]].wait(5)
+        return {"input": job["name"], "status": "ok"}
+
+    jobs = [{"name": "a", "memory": 8}, {"name": "b", "memory": 5}, {"name": "c", "memory": 2}]
+    scheduler = encode_cli.JobScheduler(run_job, workers=3, memory_budget=10,
+                                        on_hold=lambda job, committed: held.append((job["name"], committed)))
+    results = []
+    runner = threading.Thread(target=lambda: results.extend(scheduler.run(jobs)), daemon=True)
+    runner.start()
+    try:
+        _wait_for(lambda: started == ["a", "c"])
+        # b needs 5 on top of the 10 committed by a and c, so it waits
+        assert held == [("b", 10)]
+        time.sleep(0.1)
+        assert started == ["a", "c"]
+        release["a"].set()
+        _wait_for(lambda: started == ["a", "c", "b"])
+    finally:
+        for event in release.values():
+            event.set()
+        runner.join(5)
+    assert [r["input"] for r in results] == ["a", "b", "c"]
+
+
+def test_oversized_job_runs_alone():
+    started = []
+    scheduler = encode_cli.JobScheduler(lambda job: started.append(job["name"]) or {"status": "ok"},
+                                        workers=2, memory_budget=10)
+    scheduler.run([{"name": "huge", "memory": 50}])
+    assert started == ["huge"]
+
+
+@pytest.mark.parametrize("existing", [False, True])
+def test_empty_or_fully_skipped_batch_with_workers(fake_ffmpeg, tmp_path, existing):
+    batch = tmp_path / "batch"
+    out = tmp_path / "out"
+    batch.mkdir()
+    out.mkdir()
+    if existing:
+        (batch / "a.mp4").write_bytes(b"\0" * 1000)
+        (out / "a_av1.webm").write_bytes(b"x")
+    report = encode_cli.run_batch(str(batch), str(out), workers=2, pin=False,
+                                  memory_budget=1024 ** 3)
+    assert report["succeeded"] == report["failed"] == 0
+    assert report["skipped"] == (1 if existing else 0)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
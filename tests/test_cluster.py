@@ -0,0 +1,158 @@
+import http.server
+import json
+import os
+import threading
+import urllib.request
+
+import pytest
+
+import av1_cluster as cluster
+
+
+@pytest.fixture
+def batch(tmp_path):
+    jobs = []
+    for name in ("ghost", "good", "bad"):
+        source = tmp_path / "in" / f"{name}.mp4"
+        source.parent.mkdir(exist_ok=True)
+        source.write_bytes(name.encode() * 100)
+        jobs.append({"input": str(source), "output": str(tmp_path / "out" / f"{name}.webm")})
+    return jobs
+
+
+def fake_encode(source, output, settings, on_progress):
+    on_progress({"percent": 50.0})
+    if os.path.basename(source).startswith("bad"):
+        return {"status": "failed", "error": "boom"}
+    with open(source, "rb") as src, open(output, "wb") as dst:
+        dst.write(src.read()[:settings["keep"]])
+    return {"status": "ok", "wall_time": 0.1, "cpu_time": 0.2}
+
+
+def test_two_workers_expiry_requeue_and_max_attempts(batch, monkeypatch):
+    monkeypatch.setattr(cluster, "DONE_GRACE", 0.5)
+    events = []
+    coordinator = cluster.Coordinator(batch, {"keep": 10}, port=0, lease_seconds=2,
+                                      token="secret",
+                                      on_event=lambda event, **fields: events.append((event, fields)))
+    server = threading.Thread(target=coordinator.run, daemon=True)
+    server.start()
+
+    # A worker that takes the first job and dies without a heartbeat
+    request = urllib.request.Request(coordinator.url + "/lease", method="POST",
+                                     data=json.dumps({"worker": "crashed"}).encode(),
+                                     headers={"X-AV1-Token": "secret"})
+    with urllib.request.urlopen(request) as response:
+        assert json.load(response)["job"]["name"] == "ghost.mp4"
+
+    agents = [cluster.WorkerAgent(coordinator.url, fake_encode, name=f"worker{i}", token="secret",
+                                  poll=0.1, wait=5)
+              for i in range(2)]
+    threads = [threading.Thread(target=agent.run, daemon=True) for agent in agents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    server.join(10)
+    assert not server.is_alive() and not any(thread.is_alive() for thread in threads)
+
+    jobs = {os.path.basename(job["input"]): job for job in coordinator.jobs}
+    # The crashed worker's lease expired and another worker finished the job
+    assert ("expired", {"input": batch[0]["input"], "attempt": 1, "worker": "crashed"}) in events
+    assert jobs["ghost.mp4"]["status"] == "done" and jobs["ghost.mp4"]["attempts"] == 2
+    assert jobs["ghost.mp4"]["worker"] != "crashed"
+    assert open(batch[0]["output"], "rb").read() == b"ghostghost"
+    assert jobs["good.mp4"]["status"] == "done" and jobs["good.mp4"]["result"]["cpu_time"] == 0.2
+    # A job that keeps failing is given up after MAX_ATTEMPTS leases
+    assert jobs["bad.mp4"]["status"] == "failed"
+    assert jobs["bad.mp4"]["attempts"] == cluster.MAX_ATTEMPTS
+    assert [event for event, fields in events if fields["input"] == batch[2]["input"]].count(
+        "requeued") == cluster.MAX_ATTEMPTS - 1
+    assert not os.path.exists(batch[2]["output"])
+    assert sum(agent.completed for agent in agents) == 2
+
+
+def test_wrong_token_is_refused(batch):
+    coordinator = cluster.Coordinator(batch, {}, port=0, token="secret")
+    threading.Thread(target=coordinator.server.serve_forever, daemon=True).start()
+    try:
+        errors = []
+        agent = cluster.WorkerAgent(coordinator.url, fake_encode, token="guess", poll=0.1,
+                                    on_event=lambda event, **fields: errors.append(event))
+        assert agent.run() == 0 and errors == ["error"]
+        assert all(job["status"] == "queued" for job in coordinator.jobs)
+    finally:
+        coordinator.server.shutdown()
+        coordinator.server.server_close()
+
+
+def test_network_bind_requires_token(batch):
+    with pytest.raises(ValueError):
+        cluster.Coordinator(batch, {}, host="0.0.0.0", port=0)
+    assert cluster.is_loopback("127.0.0.1") and cluster.is_loopback("::1")
+    assert cluster.is_loopback("localhost") and not cluster.is_loopback("192.168.1.10")
+
+
+def test_oversize_job_is_kept_and_not_requeued(batch, monkeypatch):
+    monkeypatch.setattr(cluster, "DONE_GRACE", 0.5)
+    verdict = {"projected_size": 900, "ratio": 1.2}
+
+    def encode(source, output, settings, on_progress):
+        return {"status": "oversize", "oversize": verdict}
+
+    coordinator = cluster.Coordinator(batch[:1], {}, port=0)
+    server = threading.Thread(target=coordinator.run, daemon=True)
+    server.start()
+    agent = cluster.WorkerAgent(coordinator.url, encode, poll=0.1, wait=5)
+    agent.run()
+    server.join(10)
+    job = coordinator.jobs[0]
+    assert job["status"] == "oversize" and job["attempts"] == 1 and job["oversize"] == verdict
+    assert agent.kept == 1 and agent.completed == agent.failed == 0
+    assert not os.path.exists(batch[0]["output"])
+
+
+def test_truncated_download_fails_the_lease():
+    calls = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            calls.append((self.path, body))
+            if self.path == "/lease" and len(calls) == 1:
+                self._json({"job": {"id": "1", "name": "a.mp4", "output_ext": ".webm",
+                                    "settings": {}},
+                            "lease": "L", "lease_seconds": 60})
+            else:
+                self._json({"job": None, "done": True})
+
+        def do_GET(self):
+            # Promises 100 bytes and hangs up after 10
+            self.send_response(200)
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            self.wfile.write(b"x" * 10)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    encoded = []
+    try:
+        agent = cluster.WorkerAgent(f"http://127.0.0.1:{server.server_address[1]}",
+                                    lambda *args: encoded.append(args), poll=0.1, wait=5)
+        agent.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert encoded == [] and agent.failed == 1
+    assert calls[1][0] == "/jobs/1/fail" and calls[1][1]["lease"] == "L"
+    assert "10 of 100 bytes" in calls[1][1]["error"]
@@ -0,0 +1,57 @@
+import pytest
+
+import av1_engine as engine
+
+
+def test_svtav1_command():
+    cmd = engine.build_command("in.mp4", "out.webm", 30, preset=6, grain=8, threads=4,
+                               resolution="720p", ffmpeg="ffmpeg")
+    assert cmd[:4] == ["ffmpeg", "-y", "-i", "in.mp4"]
+    params = cmd[cmd.index("-svtav1-params") + 1]
+    assert params == "tune=0:film-grain=8:film-grain-denoise=1:logical-processors=4"
+    assert cmd[cmd.index("-crf") + 1] == "30" and cmd[cmd.index("-preset") + 1] == "6"
+    assert "-threads" not in cmd
+    assert cmd[cmd.index("-vf") + 1] == "scale=1280:720:flags=lanczos"
+    assert cmd[-5:] == ["-c:a", "libopus", "-b:a", "128k", "out.webm"]
+
+
+def test_crop_decimate_and_audio_options():
+    cmd = engine.build_command("in.mp4", "out.mkv", 30, crop="1920:800:0:140", decimate=True,
+                               resolution="720p", audio_codec="none")
+    assert cmd[cmd.index("-vf") + 1] == "crop=1920:800:0:140,mpdecimate,scale=1280:-2:flags=lanczos"
+    assert cmd[cmd.index("-fps_mode") + 1] == "vfr"
+    assert cmd[-2:] == ["-an", "out.mkv"]
+
+
+@pytest.mark.parametrize("encoder", ["libsvtav1", "libaom-av1", "librav1e"])
+@pytest.mark.parametrize("audio", [("libopus", ["-c:a", "libopus", "-b:a", "96k"]),
+                                   ("copy", ["-c:a", "copy"]), ("none", ["-an"])])
+def test_split_command(encoder, audio):
+    codec, audio_args = audio
+    cmd = engine.build_command("in.mp4", "out.webm", 30, encoder=encoder, audio_codec=codec,
+                               audio_bitrate="96k", frame_size=(1920, 1080))
+    staged = engine.stage_command(cmd, "out.webm.part")
+    video, audio_part = engine._split_command(staged)
+    assert video == cmd[:-1 - len(audio_args)] + ["-an"]
+    assert audio_part == audio_args
+
+
+def test_parse_progress():
+    line = ("frame= 1200 fps= 48 q=30.0 size=   51200kB time=00:01:05.50 "
+            "bitrate= 838.9kbits/s speed=1.92x")
+    assert engine.parse_progress(line) == {"frame": 1200, "fps": 48.0, "speed": 1.92,
+                                           "time": 65.5, "size": "51200kB",
+                                           "bitrate": "838.9kbits/s"}
+    # Audio-only stats carry no frame count; N/A fields are left out
+    assert engine.parse_progress("size=N/A time=01:00:00.00 bitrate=N/A speed=N/A") == \
+        {"time": 3600.0, "size": "N/A", "bitrate": "N/A"}
+    assert engine.parse_progress("Stream #0:0: Video: h264") is None
+    # -benchmark output is not a stats line
+    assert engine.parse_progress("bench: utime=1.250s stime=0.100s rtime=2.000s") is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("512kB", 512 * 1024), ("3MiB", 3 * 1024 ** 2), ("1.5GB", int(1.5 * 1024 ** 3)),
+    ("100B", 100), ("N/A", None), ("", None), (None, None)])
+def test_parse_size(value, expected):
+    assert engine.parse_size(value) == expected
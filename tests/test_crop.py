@@ -0,0 +1,56 @@
+import subprocess
+
+import av1_engine as engine
+
+INFO = {"duration": 100.0, "width": 1920, "height": 1080, "fps": 25.0}
+
+
+def _cropdetect(monkeypatch, rects):
+    """Make every sampled point report the next rectangle (None: no output)"""
+    answers = iter(rects)
+    starts = []
+
+    def run(cmd, **kwargs):
+        starts.append(float(cmd[cmd.index("-ss") + 1]))
+        rect = next(answers)
+        stderr = f"[Parsed_cropdetect_0 @ 0x1] x1:0 crop={rect}\n" if rect else ""
+        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr=stderr)
+
+    monkeypatch.setattr(engine.subprocess, "run", run)
+    return starts
+
+
+def test_stable_crop_is_applied(monkeypatch):
+    starts = _cropdetect(monkeypatch, ["1920:800:0:140"] * 9 + ["1920:1080:0:0"])
+    detected = engine.detect_crop("in.mkv", INFO, ffmpeg="ffmpeg")
+    assert detected == {"crop": "1920:800:0:140", "confidence": 0.9, "samples": 10}
+    # Samples spread from 5% to 95% of the title
+    assert starts[0] == 5.0 and starts[-1] == 95.0
+
+
+def test_unstable_crop_is_rejected(monkeypatch):
+    _cropdetect(monkeypatch, ["1920:800:0:140"] * 7 + ["1920:1080:0:0"] * 3)
+    detected = engine.detect_crop("in.mkv", INFO, ffmpeg="ffmpeg")
+    assert detected["crop"] is None and detected["confidence"] == 0.7
+    _cropdetect(monkeypatch, ["1920:800:0:140"] * 7 + ["1920:1080:0:0"] * 3)
+    assert engine.detect_crop("in.mkv", INFO, min_confidence=0.7,
+                              ffmpeg="ffmpeg")["crop"] == "1920:800:0:140"
+
+
+def test_crop_removing_under_one_percent_is_ignored(monkeypatch):
+    # 1920x1072 keeps 99.3% of the frame: not worth a crop
+    _cropdetect(monkeypatch, ["1920:1072:0:4"] * 10)
+    detected = engine.detect_crop("in.mkv", INFO, ffmpeg="ffmpeg")
+    assert detected["crop"] is None and detected["confidence"] == 1.0
+
+
+def test_no_cropdetect_output(monkeypatch):
+    _cropdetect(monkeypatch, [None] * 10)
+    assert engine.detect_crop("in.mkv", INFO, ffmpeg="ffmpeg") == \
+        {"crop": None, "confidence": 0.0, "samples": 0}
+
+
+def test_short_title_is_sampled_once(monkeypatch):
+    starts = _cropdetect(monkeypatch, ["1920:800:0:140"])
+    detected = engine.detect_crop("in.mkv", dict(INFO, duration=8.0), ffmpeg="ffmpeg")
+    assert starts == [0.0] and detected["crop"] == "1920:800:0:140"
@@ -0,0 +1,77 @@
+import errno
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import av1_engine as engine
+
+
+@pytest.mark.parametrize("segment_seconds", [None, 2])
+def test_size_guard_keeps_the_original(fake_ffmpeg, video, tmp_path, monkeypatch, segment_seconds):
+    monkeypatch.setenv("FAKE_STEPS", "8")
+    output = str(tmp_path / "out.webm")
+    result = engine.encode(video, output, crf=30, audio_codec="none", max_ratio=0.9,
+                           segment_seconds=segment_seconds)
+    assert result.status == "oversize"
+    assert result.oversize["projected_size"] > 0.9 * os.path.getsize(video)
+    assert not os.path.exists(output)
+    assert not os.path.exists(engine.segments_dir(output))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_stale_partials_next_to_outputs_are_removed(tmp_path):
+    output = tmp_path / "out" / "title.webm"
+    output.parent.mkdir()
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    stale = tmp_path / "out" / f"title.webm.0123abcd.{dead.pid}.part"
+    fresh = tmp_path / "out" / f"other.webm.0123abcd.{dead.pid}.part"
+    running = tmp_path / "out" / f"title.webm.4567cdef.{os.getppid()}.part"
+    # Not staging_path() names, whatever the number in them
+    unrelated = [tmp_path / "out" / "movie.2024.part", tmp_path / "out" / f"title.webm.{dead.pid}.part"]
+    old = time.time() - engine.STALE_PART_AGE - 60
+    for part in [stale, fresh, running] + unrelated:
+        part.write_bytes(b"x")
+        if part is not fresh:
+            os.utime(part, (old, old))
+
+    assert engine.clean_output_partials([str(output)]) == 1
+    # Recent files may belong to another machine sharing the folder
+    assert sorted(os.listdir(output.parent)) == sorted([fresh.name, running.name]
+                                                       + [part.name for part in unrelated])
+    # A scratch folder is ours alone: the dead process's files go regardless of age
+    prefetched = tmp_path / "out" / f"title.mkv.89abcdef.in.{dead.pid}.part"
+    prefetched.write_bytes(b"x")
+    assert engine.clean_stale_partials(str(output.parent)) == 2
+    assert fresh.name not in os.listdir(output.parent)
+    assert prefetched.name not in os.listdir(output.parent)
+
+
+def test_interrupted_cross_device_publish_leaves_a_staging_name(tmp_path, monkeypatch):
+    part = tmp_path / "scratch.part"
+    part.write_bytes(b"x" * 10)
+    output = str(tmp_path / "out" / "title.webm")
+    real_replace = os.replace
+    copies = []
+
+    def replace(src, dst):
+        if src == str(part):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        real_replace(src, dst)
+
+    def copyfile(src, dst):
+        copies.append(dst)
+        with open(dst, "wb") as f:
+            f.write(b"x")
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(engine.os, "replace", replace)
+    monkeypatch.setattr(engine.shutil, "copyfile", copyfile)
+    with pytest.raises(OSError):
+        engine.publish(str(part), output)
+    assert copies == [engine.staging_path(output)]
+    assert os.listdir(os.path.dirname(output)) == []
+    assert part.exists()
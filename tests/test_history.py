@@ -0,0 +1,52 @@
+import pytest
+
+import av1_engine as engine
+
+HD = {"duration": 60.0, "width": 1920, "height": 1080, "fps": 30.0}
+
+
+def _record(history, wall_time, size, info=HD, preset=6, crf=30, threads=0, encoder="libsvtav1"):
+    result = engine.EncodeResult("in.mkv", "out.webm", 0, wall_time=wall_time, size=size)
+    history.record(result, info, encoder, preset, crf, threads)
+
+
+@pytest.fixture
+def history(tmp_path):
+    return engine.EncodeHistory(str(tmp_path / "history.db"))
+
+
+def test_predict_needs_history(history):
+    assert history.predict(HD, "libsvtav1", 6, 30) is None
+    _record(history, 120, 6_000_000)
+    assert history.predict(HD, "libaom-av1", 6, 30) is None
+    assert history.predict({"duration": None}, "libsvtav1", 6, 30) is None
+
+
+def test_predict_scales_with_duration_preset_and_crf(history):
+    for _ in range(3):
+        _record(history, 120, 6_000_000)
+    twice = dict(HD, duration=120.0)
+    prediction = history.predict(twice, "libsvtav1", 6, 30)
+    assert prediction["wall_time"] == pytest.approx(240)
+    assert prediction["size"] == pytest.approx(12_000_000, rel=1e-3)
+    assert prediction["samples"] == 3
+    # Two slower presets, and CRF_DOUBLING steps up halves the size
+    assert history.predict(HD, "libsvtav1", 4, 30)["wall_time"] == \
+        pytest.approx(120 * engine.PRESET_SPEEDUP ** 2)
+    assert history.predict(HD, "libsvtav1", 6, 30 + engine.CRF_DOUBLING)["size"] == \
+        pytest.approx(3_000_000, rel=1e-3)
+
+
+def test_predict_prefers_matching_threads(history):
+    for _ in range(engine.MIN_SAMPLES):
+        _record(history, 120, 6_000_000)
+        _record(history, 60, 6_000_000, threads=8)
+    assert history.predict(HD, "libsvtav1", 6, 30, threads=8)["wall_time"] == pytest.approx(60)
+    assert history.predict(HD, "libsvtav1", 6, 30)["wall_time"] == pytest.approx(120)
+
+
+def test_failed_encodes_are_not_recorded(history):
+    history.record(engine.EncodeResult("in.mkv", "out.webm", 1, wall_time=5), HD, "libsvtav1", 6, 30)
+    _record(history, 120, 6_000_000)
+    # Persisted for the next run
+    assert len(engine.EncodeHistory(history.path).rows()) == 1
@@ -0,0 +1,37 @@
+import pytest
+
+import av1_engine as engine
+
+HD = {"duration": 60.0, "width": 1920, "height": 1080, "fps": 30.0}
+
+
+def test_estimate_cost_scales_with_frames_pixels_and_preset():
+    assert engine.estimate_cost(HD) == pytest.approx(60.0)
+    assert engine.estimate_cost(dict(HD, fps=60.0)) == pytest.approx(120.0)
+    assert engine.estimate_cost(dict(HD, width=3840, height=2160)) == pytest.approx(240.0)
+    # Downscaling to 720p encodes fewer pixels
+    assert engine.estimate_cost(HD, resolution="720p") == pytest.approx(60.0 * 1280 * 720 / (1920 * 1080))
+    # Each slower preset step costs PRESET_SPEEDUP more
+    assert engine.estimate_cost(HD, preset=4) == pytest.approx(60.0 * engine.PRESET_SPEEDUP ** 2)
+    assert engine.estimate_cost(HD, preset=8) < engine.estimate_cost(HD)
+    assert engine.estimate_cost(HD, encoder="av1_nvenc") < engine.estimate_cost(HD, preset=12)
+
+
+def test_estimate_cost_falls_back_to_file_size():
+    assert engine.estimate_cost(None, size=5e6) == pytest.approx(5.0)
+    assert engine.estimate_cost({"duration": None}, size=2e6) == pytest.approx(2.0)
+    assert engine.estimate_cost(None) == 0
+
+
+def test_order_by_cost():
+    costs = {"a": 3, "b": 10, "c": 1, "d": 10}
+    assert engine.order_by_cost("abcd", costs.get, "lpt") == ["b", "d", "a", "c"]
+    assert engine.order_by_cost("abcd", costs.get, "spt") == ["c", "a", "b", "d"]
+    assert engine.order_by_cost("abcd", costs.get, "fifo") == ["a", "b", "c", "d"]
+
+
+def test_longest_first_shortens_the_makespan():
+    durations = [1, 1, 1, 1, 4]
+    lpt = engine.order_by_cost(durations, float, "lpt")
+    assert engine.plan_makespan(lpt, workers=2) == 4
+    assert engine.plan_makespan(durations, workers=2) == 6
@@ -0,0 +1,34 @@
+import av1_engine as engine
+
+
+def test_libaom_tiles_follow_frame_size_and_threads():
+    cmd = engine.build_command("in.mp4", "out.mkv", 30, preset=4, encoder="libaom-av1",
+                               threads=8, frame_size=(3840, 2160))
+    assert cmd[cmd.index("-cpu-used") + 1] == "4"
+    assert cmd[cmd.index("-threads") + 1] == "8"
+    assert cmd[cmd.index("-row-mt") + 1] == "1"
+    # 3840x2160 fits 4x2 tiles of at least 640x720, exactly the 8 threads
+    assert cmd[cmd.index("-tile-columns") + 1] == "2"
+    assert cmd[cmd.index("-tile-rows") + 1] == "1"
+
+    small = engine.build_command("in.mp4", "out.mkv", 30, encoder="libaom-av1", threads=2,
+                                 frame_size=(3840, 2160))
+    # Never more tiles than threads
+    assert small[small.index("-tile-columns") + 1] == "1"
+    assert small[small.index("-tile-rows") + 1] == "0"
+
+
+def test_rav1e_tiles_and_threads():
+    cmd = engine.build_command("in.mp4", "out.mkv", 100, preset=6, encoder="librav1e",
+                               threads=4, frame_size=(1920, 1080))
+    assert cmd[cmd.index("-qp") + 1] == "100" and cmd[cmd.index("-speed") + 1] == "6"
+    assert cmd[cmd.index("-tiles") + 1] == "4"
+    assert cmd[cmd.index("-rav1e-params") + 1] == "threads=4"
+    assert "-threads" not in cmd
+
+
+def test_describe_parallelism():
+    assert engine.describe_parallelism("libaom-av1", (3840, 2160), 8) == "4x2 tiles, row-mt, 8 threads"
+    assert engine.describe_parallelism("librav1e", (1920, 1080), 4) == "4 tiles, 4 threads"
+    assert engine.describe_parallelism("libsvtav1", (1920, 1080), 6) == "6 threads"
+    assert engine.describe_parallelism("av1_nvenc") == "hardware encoder"
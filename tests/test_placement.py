@@ -0,0 +1,48 @@
+import os
+import threading
+
+import pytest
+
+import av1_engine as engine
+import encode_cli
+
+
+@pytest.mark.parametrize("nodes, count, expected", [
+    # Fewer jobs than nodes: whole nodes per job
+    ([[0, 1, 2, 3], [4, 5, 6, 7]], 2, [[0, 1, 2, 3], [4, 5, 6, 7]]),
+    ([[0, 1, 2, 3], [4, 5, 6, 7]], 1, [[0, 1, 2, 3, 4, 5, 6, 7]]),
+    # More jobs than nodes: split each node, never straddle two
+    ([[0, 1, 2, 3], [4, 5, 6, 7]], 4, [[0, 1], [2, 3], [4, 5], [6, 7]]),
+    ([[0, 1, 2, 3, 4, 5], [6, 7]], 3, [[0, 1, 2], [3, 4, 5], [6, 7]]),
+    # Never more sets than CPUs
+    ([[0, 1]], 5, [[0], [1]]),
+])
+def test_assign_core_sets(nodes, count, expected):
+    sets = encode_cli.assign_core_sets(nodes, count)
+    assert sets == expected
+    cpus = [cpu for core_set in sets for cpu in core_set]
+    assert len(cpus) == len(set(cpus))
+
+
+def test_cpu_list_round_trip():
+    assert encode_cli.parse_cpu_list("0-3,8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+    assert encode_cli.format_cpu_list([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="Linux only")
+def test_pinning_leaves_the_calling_thread_unpinned(fake_ffmpeg, tmp_path):
+    allowed = os.sched_getaffinity(0)
+    if len(allowed) < 2:
+        pytest.skip("needs two CPUs to tell pinned from unpinned")
+    pinned = {min(allowed)}
+    seen = {}
+
+    def job():
+        engine.run_ffmpeg(["ffmpeg", "-i", "in.mp4", str(tmp_path / "out.webm")], cpus=pinned,
+                          on_process=lambda process: seen.update(child=os.sched_getaffinity(process.pid)))
+        seen["thread"] = os.sched_getaffinity(0)
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    thread.join(30)
+    assert seen == {"child": pinned, "thread": allowed}
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+import av1_engine as engine
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    # Never leave a stopped fake FFmpeg behind when a test fails
+    engine.terminate_all()
+
+
+def _start(cmd, priority, preempt, processes, runs):
+    def target():
+        runs.append(engine.run_ffmpeg(cmd, priority=priority, preempt=preempt,
+                                      on_process=processes.append))
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_batch_started_after_preemptor_resumes(fake_ffmpeg, monkeypatch, tmp_path):
+    monkeypatch.setenv("FAKE_STEPS", "10")
+    monkeypatch.setenv("FAKE_SLEEP", "0.1")
+    interactive, batch, runs = [], [], []
+    first = _start(["ffmpeg", "-i", "a.mp4", str(tmp_path / "a.webm")], 1, "pause", interactive, runs)
+    assert _wait_for(lambda: interactive)
+
+    second = _start(["ffmpeg", "-i", "b.mp4", str(tmp_path / "b.webm")], 0, "pause", batch, runs)
+    assert _wait_for(lambda: batch)
+    assert interactive[0] in engine._suspended[batch[0]]["reasons"]
+
+    first.join(10)
+    # Once the preemptor exits, the late batch encode continues and finishes
+    second.join(10)
+    assert not second.is_alive()
+    assert batch[0] not in engine._suspended
+    assert [run["exit_code"] for run in runs] == [0, 0]
+
+
+def test_preemptor_resumes_running_batch(fake_ffmpeg, monkeypatch, tmp_path):
+    monkeypatch.setenv("FAKE_STEPS", "10")
+    monkeypatch.setenv("FAKE_SLEEP", "0.1")
+    interactive, batch, runs = [], [], []
+    second = _start(["ffmpeg", "-i", "b.mp4", str(tmp_path / "b.webm")], 0, "pause", batch, runs)
+    assert _wait_for(lambda: batch)
+    first = _start(["ffmpeg", "-i", "a.mp4", str(tmp_path / "a.webm")], 1, "pause", interactive, runs)
+    assert _wait_for(lambda: batch[0] in engine._suspended)
+
+    first.join(10)
+    second.join(10)
+    assert not second.is_alive()
+    assert runs[0]["preempted"] == 1
+    assert not engine._suspended
+
+
+def test_async_encode_yields_only_to_higher_priority(fake_ffmpeg, monkeypatch, tmp_path):
+    import asyncio
+
+    import av1_async
+
+    monkeypatch.setenv("FAKE_STEPS", "10")
+    monkeypatch.setenv("FAKE_SLEEP", "0.1")
+    interactive, runs = [], []
+    first = _start(["ffmpeg", "-i", "a.mp4", str(tmp_path / "a.webm")], 1, "pause", interactive, runs)
+    assert _wait_for(lambda: interactive)
+
+    suspended = {}
+
+    def track(process):
+        suspended[process.pid] = process in engine._suspended
+
+    async def both():
+        return await asyncio.gather(
+            av1_async.run_ffmpeg(["ffmpeg", "-i", "b.mp4", str(tmp_path / "b.webm")],
+                                 on_process=track, priority=0),
+            av1_async.run_ffmpeg(["ffmpeg", "-i", "c.mp4", str(tmp_path / "c.webm")],
+                                 on_process=track, priority=1))
+
+    low, high = asyncio.run(asyncio.wait_for(both(), 15))
+    first.join(10)
+    assert sorted(suspended.values()) == [False, True]
+    assert low["exit_code"] == high["exit_code"] == 0
+    assert not engine._suspended
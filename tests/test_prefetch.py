@@ -0,0 +1,72 @@
+import os
+import time
+
+import av1_engine as engine
+
+
+def _sources(tmp_path, sizes):
+    folder = tmp_path / "src"
+    folder.mkdir()
+    paths = []
+    for name, size in sizes.items():
+        path = folder / f"{name}.mkv"
+        path.write_bytes(name.encode() * size)
+        paths.append(str(path))
+    return paths
+
+
+def _ready(prefetcher):
+    with prefetcher._cond:
+        return sorted(os.path.basename(path) for path, state in prefetcher._state.items()
+                      if state == "ready")
+
+
+def _settle(prefetcher, expected, timeout=5):
+    deadline = time.monotonic() + timeout
+    while _ready(prefetcher) != expected:
+        assert time.monotonic() < deadline, f"{_ready(prefetcher)} != {expected}"
+        time.sleep(0.02)
+    # Nothing else may start copying once it has settled
+    time.sleep(0.1)
+    assert _ready(prefetcher) == expected
+
+
+def test_prefetch_depth_and_eviction(tmp_path):
+    paths = _sources(tmp_path, {"a": 1000, "b": 1000, "c": 1000})
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    prefetcher = engine.Prefetcher(paths, str(scratch), depth=2, budget=10 ** 6)
+    prefetcher.start()
+    try:
+        _settle(prefetcher, ["a.mkv", "b.mkv"])
+        local = prefetcher.acquire(paths[0])
+        assert local != paths[0] and open(local, "rb").read() == b"a" * 1000
+        # a is in use now, which frees a slot of the look-ahead for c
+        _settle(prefetcher, ["b.mkv", "c.mkv"])
+        prefetcher.release(paths[0])
+        assert not os.path.exists(local)
+    finally:
+        prefetcher.stop()
+    assert os.listdir(scratch) == []
+    assert prefetcher.stats == {"prefetched": 3, "bytes": 3000, "direct": 0}
+
+
+def test_prefetch_budget_holds_copies_until_a_release(tmp_path):
+    paths = _sources(tmp_path, {"a": 1000, "b": 1000, "c": 1000, "huge": 5000})
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    prefetcher = engine.Prefetcher(paths, str(scratch), depth=4, budget=2500)
+    prefetcher.start()
+    try:
+        _settle(prefetcher, ["a.mkv", "b.mkv"])
+        local = prefetcher.acquire(paths[0])
+        # In use still counts against the budget: c waits
+        _settle(prefetcher, ["b.mkv"])
+        prefetcher.release(paths[0])
+        _settle(prefetcher, ["b.mkv", "c.mkv"])
+        assert not os.path.exists(local)
+        # Larger than the whole budget: read in place
+        assert prefetcher.acquire(paths[3]) == paths[3]
+    finally:
+        prefetcher.stop()
+    assert prefetcher.stats["direct"] == 1 and prefetcher.stats["prefetched"] == 3
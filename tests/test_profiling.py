@@ -0,0 +1,65 @@
+import json
+
+import av1_engine as engine
+import encode_cli
+
+
+def test_parse_benchmark():
+    assert engine.parse_benchmark("bench: utime=1.234s stime=0.100s rtime=2.345s") == {
+        "utime": 1.234, "stime": 0.1, "rtime": 2.345}
+    assert engine.parse_benchmark("bench: maxrss=123456KiB") == {"maxrss": 123456 * 1024}
+    assert engine.parse_benchmark("frame= 25 fps= 25 time=00:00:01.00") == {}
+
+
+def test_summary_totals_spans_per_stage():
+    profiler = engine.Profiler()
+    start = profiler._start
+    profiler.add("probe", start, start + 0.5)
+    profiler.add("ffmpeg", start, start + 2)
+    profiler.add("ffmpeg", start + 2, start + 6)
+    assert profiler.summary() == [
+        {"stage": "ffmpeg", "count": 2, "total": 6.0, "mean": 3.0, "max": 4.0},
+        {"stage": "probe", "count": 1, "total": 0.5, "mean": 0.5, "max": 0.5}]
+    header, ffmpeg, probe = profiler.format_summary()
+    assert header.split() == ["stage", "count", "total", "mean", "max"]
+    assert ffmpeg.split() == ["ffmpeg", "2", "6.00s", "3.00s", "4.00s"]
+    assert probe.split()[0] == "probe"
+
+
+def test_write_trace_exports_chrome_events(tmp_path):
+    profiler = engine.Profiler()
+    with profiler.span("probe", input="a.mp4") as args:
+        args["frames"] = 250
+    path = tmp_path / "traces" / "run.json"
+    profiler.write_trace(str(path))
+    trace = json.loads(path.read_text())
+    span, thread = trace["traceEvents"]
+    assert span["name"] == "probe" and span["ph"] == "X"
+    assert span["args"] == {"input": "a.mp4", "frames": 250}
+    assert span["dur"] >= 0 and span["ts"] >= 0
+    assert thread["ph"] == "M" and thread["tid"] == span["tid"]
+    assert thread["args"] == {"name": "MainThread"}
+
+
+def test_encode_records_ffmpeg_benchmark(fake_ffmpeg, video, tmp_path):
+    profiler = engine.Profiler()
+    result = engine.encode(video, str(tmp_path / "out.webm"), crf=30, audio_codec="none",
+                           profiler=profiler)
+    assert result.ok
+    stages = {row["stage"] for row in profiler.summary()}
+    assert {"probe", "ffmpeg", "publish"} <= stages
+    ffmpeg = next(event for event in profiler._events if event["name"] == "ffmpeg")
+    assert ffmpeg["args"]["utime"] == 0.5 and ffmpeg["args"]["maxrss"] == 2048 * 1024
+    assert ffmpeg["args"]["exit_code"] == 0
+
+
+def test_report_profile(tmp_path, capsys):
+    profiler = engine.Profiler()
+    with profiler.span("scan"):
+        pass
+    path = tmp_path / "trace.json"
+    encode_cli.report_profile(profiler, str(path))
+    out = capsys.readouterr().out
+    assert f"[PROFILE] Trace written to {path}" in out
+    assert "[PROFILE] scan" in out
+    assert path.exists()
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import av1_engine as engine
+import encode_cli
+
+# Burns about 0.4 s of CPU
+BURN = "import time\nend = time.process_time() + 0.4\nwhile time.process_time() < end: pass"
+
+
+def test_total_resources_sums_jobs():
+    results = [
+        {"status": "ok", "duration": 1800, "cpu_time": 3600.0, "user_time": 3500.0,
+         "sys_time": 100.0, "peak_rss": 2 * 1024 ** 3, "io": {"read": 100, "write": 10}},
+        {"status": "failed", "duration": 1800, "cpu_time": 900.0, "user_time": 890.0,
+         "sys_time": 10.0, "peak_rss": 3 * 1024 ** 3, "io": {"read": 50, "write": 5}},
+        {"status": "skipped"},
+    ]
+    totals = engine.total_resources(results)
+    assert totals["cpu_time"] == 4500.0
+    assert (totals["user_time"], totals["sys_time"]) == (4390.0, 110.0)
+    # The largest single job, not a sum
+    assert totals["peak_rss"] == 3 * 1024 ** 3
+    assert totals["io"] == {"read": 150, "write": 15}
+    # Only successful output counts: 4500 CPU-seconds for half an hour of output
+    assert totals["output_seconds"] == 1800
+    assert totals["cpu_per_output_hour"] == 2.5
+
+
+def test_total_resources_without_success():
+    totals = engine.total_resources([{"status": "failed", "duration": 60, "cpu_time": 5.0}])
+    assert totals["cpu_per_output_hour"] is None
+    assert totals["peak_rss"] is None and totals["io"] is None
+
+
+def test_format_resources():
+    line = engine.format_resources({"cpu_time": 90, "user_time": 80, "sys_time": 10,
+                                    "peak_rss": 512 * 1024 ** 2,
+                                    "io": {"read": 1024 ** 3, "write": 1024 ** 2}})
+    assert line.startswith("CPU ") and "(user " in line and ", sys " in line
+    assert "peak RSS" in line and "read " in line and "wrote " in line
+    assert engine.format_resources({}) == ""
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="needs wait4")
+def test_run_ffmpeg_reports_its_own_usage():
+    run = engine.run_ffmpeg([sys.executable, "-c", BURN])
+    assert run["exit_code"] == 0
+    assert run["cpu_time"] >= 0.3
+    assert run["cpu_time"] == pytest.approx(run["user_time"] + run["sys_time"], abs=0.02)
+    assert run["peak_rss"] > 1024 ** 2
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="needs wait4")
+def test_run_ffmpeg_excludes_other_children():
+    # Another child reaped during the run must not be billed to it (os.times would)
+    def reap_burner(process):
+        subprocess.run([sys.executable, "-c", BURN], check=True)
+
+    run = engine.run_ffmpeg([sys.executable, "-c", "import time; time.sleep(0.1)"],
+                            on_process=reap_burner)
+    assert run["exit_code"] == 0
+    assert run["cpu_time"] < 0.3
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="needs wait4")
+def test_run_ffmpeg_exit_code_from_wait4():
+    run = engine.run_ffmpeg([sys.executable, "-c", "import sys; sys.exit(3)"])
+    assert run["exit_code"] == 3
+
+
+def test_batch_report_totals_resources(fake_ffmpeg, tmp_path):
+    batch = tmp_path / "batch"
+    out = tmp_path / "out"
+    batch.mkdir()
+    out.mkdir()
+    for name in ("a.mp4", "b.mp4"):
+        (batch / name).write_bytes(b"\0" * 1000)
+    report = encode_cli.run_batch(str(batch), str(out), workers=1, audio_codec="none")
+    assert report["succeeded"] == 2
+    resources = report["resources"]
+    jobs = report["jobs"]
+    assert resources["cpu_time"] == pytest.approx(sum(j["cpu_time"] for j in jobs), abs=0.02)
+    assert resources["peak_rss"] == max(j["peak_rss"] for j in jobs)
+    # The fake ffprobe reports 10 s per input
+    assert resources["output_seconds"] == 20
+    assert resources["cpu_per_output_hour"] == round(resources["cpu_time"] / 20, 3)
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+import av1_engine as engine
+
+
+def test_failed_gpu_encode_retries_on_svtav1(fake_ffmpeg, video, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FAIL", "av1_nvenc")
+    output = str(tmp_path / "out.webm")
+    retries = []
+    result = engine.encode(video, output, crf=30, preset=5, encoder="av1_nvenc",
+                           audio_codec="none", retries=2, backoff=0, fallback=True,
+                           on_retry=lambda *args: retries.append(args))
+    assert result.ok and os.path.getsize(output) == 1000
+    assert [(a["encoder"], a["exit_code"]) for a in result.attempts] == \
+        [("av1_nvenc", 1), ("libsvtav1", 0)]
+    assert [(r[0]["attempt"], r[2], r[3]) for r in retries] == [(1, "libsvtav1", 5)]
+    assert result.command[result.command.index("-c:v") + 1] == "libsvtav1"
+
+
+def test_retries_give_up(fake_ffmpeg, video, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FAIL", "libsvtav1")
+    output = str(tmp_path / "out.webm")
+    result = engine.encode(video, output, crf=30, preset=8, audio_codec="none", retries=1,
+                           backoff=0, fallback=True)
+    assert result.status == "failed" and result.exit_code == 1
+    assert [a["preset"] for a in result.attempts] == [8, 10]
+    assert not os.path.exists(output)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_cancel_during_retry_backoff(fake_ffmpeg, video, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FAIL", "libsvtav1")
+    cancel = threading.Event()
+    start = time.monotonic()
+    result = engine.encode(video, str(tmp_path / "out.webm"), crf=30, audio_codec="none",
+                           retries=2, backoff=30, cancel=cancel,
+                           on_retry=lambda *args: threading.Timer(0.2, cancel.set).start())
+    assert time.monotonic() - start < 10
+    assert len(result.attempts) == 1
+    assert result.status == "failed" and result.error == "Cancelled"
+
+
+def test_cancelled_encode_with_error_exit_is_not_retried(fake_ffmpeg, video, tmp_path, monkeypatch):
+    # taskkill on Windows leaves exit code 1 instead of a signal
+    monkeypatch.setenv("FAKE_FAIL", "libsvtav1")
+    cancel = threading.Event()
+    result = engine.encode(video, str(tmp_path / "out.webm"), crf=30, audio_codec="none",
+                           retries=2, backoff=0, cancel=cancel,
+                           on_process=lambda process: cancel.set())
+    assert [a["exit_code"] for a in result.attempts] == [1]
+    assert result.error == "Cancelled"
+
+
+def test_stalled_encode_is_killed_and_retried_on_the_fallback(fake_ffmpeg, video, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_HANG", "av1_nvenc")
+    output = str(tmp_path / "out.webm")
+    start = time.monotonic()
+    result = engine.encode(video, output, crf=30, preset=5, encoder="av1_nvenc",
+                           audio_codec="none", stall_timeout=1, retries=1, backoff=0,
+                           fallback=True)
+    assert time.monotonic() - start < 30
+    assert result.ok and os.path.getsize(output) == 1000
+    assert [(a["encoder"], a["stalled"]) for a in result.attempts] == \
+        [("av1_nvenc", True), ("libsvtav1", False)]
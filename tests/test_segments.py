@@ -0,0 +1,62 @@
+import shutil
+
+import av1_engine as engine
+
+
+def test_segmented_progress_is_cumulative_and_resumes(fake_ffmpeg, video, tmp_path, monkeypatch):
+    output = str(tmp_path / "out.webm")
+    frames, notes = [], []
+
+    def encode():
+        frames.clear()
+        return engine.encode(video, output, crf=30, audio_codec="none", segment_seconds=2,
+                             on_note=notes.append,
+                             on_progress=lambda progress, line: frames.append(progress["frame"]))
+
+    # The third of five segments (starting at 4 s) fails: the first two are kept
+    monkeypatch.setenv("FAKE_FAIL", "4.000")
+    result = encode()
+    assert result.status == "failed"
+    assert frames == sorted(frames) and frames[-1] == 225
+    assert "Finished segments are kept; encoding this file again resumes it" in notes
+
+    monkeypatch.delenv("FAKE_FAIL")
+    result = encode()
+    assert result.ok
+    assert "Resuming: 2 of 5 segments already encoded" in notes
+    # Frame counts carry on from the reused segments instead of restarting at 0
+    assert frames[0] == 2 * 75 + 25 and frames == sorted(frames) and frames[-1] == 5 * 75
+    assert result.frames == 5 * 75
+
+
+def test_plan_segments_cuts_on_keyframes():
+    keyframes = [0, 2, 4.5, 6, 9, 10.5, 12]
+    assert engine.plan_segments(keyframes, 13, 4) == [(0.0, 4.5), (4.5, 9), (9, None)]
+
+
+def test_plan_segments_folds_a_short_tail():
+    # 11.5 s leaves 0.5 s after a cut at 11: less than a quarter segment
+    assert engine.plan_segments([0, 4, 8, 11], 11.5, 4) == [(0.0, 4), (4, 8), (8, None)]
+
+
+def test_plan_segments_without_keyframes():
+    assert engine.plan_segments([], 700, 300) == [(0.0, 300), (300, 600), (600, None)]
+    assert engine.plan_segments([], 650, 300) == [(0.0, 300), (300, None)]
+    assert engine.plan_segments([], None, 300) == [(0.0, None)]
+
+
+def test_segmented_resume_from_another_prefetched_copy(fake_ffmpeg, video, tmp_path, monkeypatch):
+    output = str(tmp_path / "out.webm")
+    notes = []
+
+    def encode(copy):
+        # Like a Prefetcher scratch copy: a new path (and mtime) on every run
+        shutil.copy(video, copy)
+        return engine.encode(copy, output, crf=30, audio_codec="none", segment_seconds=2,
+                             source_path=video, on_note=notes.append)
+
+    monkeypatch.setenv("FAKE_FAIL", "4.000")
+    assert encode(str(tmp_path / "copy1.in.1.part")).status == "failed"
+    monkeypatch.delenv("FAKE_FAIL")
+    assert encode(str(tmp_path / "copy2.in.2.part")).ok
+    assert "Resuming: 2 of 5 segments already encoded" in notes
@@ -0,0 +1,80 @@
+import datetime
+import subprocess
+
+import pytest
+
+import av1_engine as engine
+
+# 2026-10-19 is a Monday
+MONDAY = datetime.datetime(2026, 10, 19)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+def test_parse_windows():
+    assert engine.parse_windows("mon-fri 22:00-07:00; sat-sun") == [
+        (frozenset(range(5)), 22 * 60, 7 * 60), (frozenset({5, 6}), 0, 24 * 60)]
+    assert engine.parse_windows("01:30-05:00") == [(frozenset(range(7)), 90, 300)]
+    # Ranges wrap around the week
+    assert engine.parse_windows("fri-mon")[0][0] == frozenset({4, 5, 6, 0})
+
+
+@pytest.mark.parametrize("spec", ["", "mon 1:00-1:00", "someday", "mon 25:00-26:00",
+                                  "mon tue 01:00-02:00"])
+def test_parse_windows_rejects(spec):
+    with pytest.raises(ValueError):
+        engine.parse_windows(spec)
+
+
+def test_overnight_window_runs_past_midnight():
+    windows = engine.parse_windows("mon-fri 22:00-07:00")
+    assert engine.window_state(windows, at(0, 21)) == (False, at(0, 22))
+    assert engine.window_state(windows, at(0, 23)) == (True, at(1, 7))
+    # Friday night's window ends on Saturday morning
+    assert engine.window_state(windows, at(5, 3)) == (True, at(5, 7))
+    # ...and nothing opens again until Monday night
+    assert engine.window_state(windows, at(5, 8)) == (False, at(7, 22))
+
+
+def test_weekend_rolls_over_into_weeknight_window():
+    windows = engine.parse_windows("mon-fri 22:00-07:00; sat-sun")
+    # Friday 22:00 until the end of Sunday is one merged window
+    assert engine.window_state(windows, at(4, 23)) == (True, at(7, 0))
+    assert engine.window_state(windows, at(6, 12)) == (True, at(7, 0))
+    # Sunday night is no weeknight: Monday stays closed until 22:00
+    assert engine.window_state(windows, at(7, 3)) == (False, at(7, 22))
+    # Thursday night's window closes on Friday morning
+    assert engine.window_state(windows, at(11, 6, 59)) == (True, at(11, 7))
+
+
+def test_window_counts_only_its_own_suspensions(monkeypatch):
+    if engine.IS_WINDOWS:
+        pytest.skip("pausing needs POSIX signals")
+    preempted, running = (subprocess.Popen(["sleep", "30"], start_new_session=True)
+                          for _ in range(2))
+    changes = []
+    state = [True]
+    monkeypatch.setattr(engine, "window_state", lambda windows: (state[0], None))
+    windows = engine.EncodeWindows("mon-sun", on_change=lambda *args: changes.append(args))
+    try:
+        engine._live_processes.update({preempted, running})
+        assert engine.suspend_process(preempted, reason="preemptor")
+        # Opening leaves the preempted encode alone
+        windows._update(initial=True)
+        assert changes[-1] == (True, None, 0)
+        state[0] = False
+        windows._update()
+        assert changes[-1] == (False, None, 2)
+        state[0] = True
+        windows._update()
+        assert changes[-1] == (True, None, 2)
+        assert engine._suspended[preempted]["reasons"] == {"preemptor"}
+        assert running not in engine._suspended
+    finally:
+        engine.resume_process(preempted, reason="preemptor")
+        engine._live_processes.difference_update({preempted, running})
+        for process in (preempted, running):
+            process.kill()
+            process.wait()
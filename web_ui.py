@@ -5,23 +5,26 @@ Browser-based UI for AV1 video encoding via Gradio.
 """
 
 import gradio as gr
-import subprocess
-import os
 from pathlib import Path
 from datetime import datetime
 
+import av1_async
+import av1_engine as engine
+
 
 # Constants
-ENCODERS = ["libsvtav1", "libaom-av1", "librav1e", "av1_nvenc", "av1_amf", "av1_qsv"]
-CLI_SCRIPT = os.environ.get("CLI_PATH", str(Path(__file__).parent / "encode_cli.py"))
-AUDIO_CODECS = ["libopus", "aac", "copy", "none"]
-RESOLUTIONS = ["original", "4k", "1080p", "720p", "480p"]
+ENCODERS = engine.ENCODERS
+AUDIO_CODECS = engine.AUDIO_CODECS
+RESOLUTIONS = ["original"] + list(engine.RESOLUTIONS)
 TUNE_OPTIONS = ["VQ (Visual Quality)", "PSNR", "SSIM"]
 OUTPUT_DIR = Path("/output")
 UPLOAD_DIR = Path("/videos")
 
+# Encodes that may run at once across browser sessions (each one is an async task)
+MAX_CONCURRENT_ENCODES = 4
+
 
-def encode_video(
+async def encode_video(
     input_file,
     quality: int,
     preset: int,
@@ -34,7 +37,7 @@ def encode_video(
     output_format: str,
     progress=gr.Progress()
 ):
-    """Encode video using the CLI encoder."""
+    """Encode video in-process on the app's event loop (no worker thread held per job)."""
     
     if input_file is None:
         return None, "❌ Please upload a video file first."
@@ -56,59 +59,46 @@ def encode_video(
         tune_map = {"VQ (Visual Quality)": 0, "PSNR": 1, "SSIM": 2}
         tune_value = tune_map.get(tune, 0)
         
-        # Build command
-        cmd = [
-            "python", CLI_SCRIPT,
-            "-i", str(input_path),
-            "-o", str(output_path),
-            "-q", str(quality),
-            "-p", str(preset),
-            "-e", encoder,
-            "-a", audio_codec,
-            "-b", audio_bitrate,
-            "-t", str(tune_value),
-            "-g", str(film_grain),
-        ]
-        
-        if resolution != "original":
-            cmd.extend(["-r", resolution])
-        
-        progress(0.1, desc="Starting encode...")
-        
-        # Run encoding
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
+        progress(0.0, desc="Starting encode...")
         
         log_output = []
-        progress(0.2, desc="Encoding in progress...")
         
-        for line in process.stdout:
-            log_output.append(line.strip())
-            # Parse progress from ffmpeg output if available
-            if "frame=" in line:
-                progress(0.5, desc=f"Encoding: {line.strip()[:50]}...")
+        def on_progress(stats, line):
+            if "percent" in stats:
+                eta = f", ETA {int(stats['eta'])}s" if "eta" in stats else ""
+                progress(stats["percent"] / 100,
+                         desc=f"Encoding: {stats['percent']:.1f}% @ {stats.get('fps', 0):.1f} fps{eta}")
+            else:
+                progress(None, desc=f"Encoding: {line[:50]}...")
         
-        process.wait()
-        progress(0.9, desc="Finalizing...")
+        # FFmpeg's output is read on the event loop; other requests are served meanwhile
+        result = await av1_async.encode(
+            str(input_path), str(output_path),
+            quality=int(quality),
+            preset=int(preset),
+            encoder=encoder,
+            audio_codec=audio_codec,
+            audio_bitrate=audio_bitrate,
+            resolution=None if resolution == "original" else resolution,
+            tune=tune_value,
+            grain=int(film_grain),
+            on_progress=on_progress,
+            on_line=log_output.append,
+        )
         
-        if process.returncode == 0 and output_path.exists():
+        if result.ok and output_path.exists():
             file_size = output_path.stat().st_size / (1024 * 1024)
             progress(1.0, desc="Complete!")
             return str(output_path), f"✅ Encoding complete!\n📁 Output: {output_name}\n📊 Size: {file_size:.2f} MB"
         else:
-            error_log = "\n".join(log_output[-20:])
+            error_log = "\n".join(log_output[-20:]) or result.error or ""
             return None, f"❌ Encoding failed!\n\nLog:\n{error_log}"
             
     except Exception as e:
         return None, f"❌ Error: {str(e)}"
 
 
-def get_file_info(file):
+async def get_file_info(file):
     """Get information about uploaded file."""
     if file is None:
         return "No file uploaded"
@@ -118,16 +108,14 @@ def get_file_info(file):
         size_mb = path.stat().st_size / (1024 * 1024)
         
         # Try to get video info with ffprobe
-        result = subprocess.run(
+        output = await av1_async.capture(
             ["ffprobe", "-v", "error", "-select_streams", "v:0",
              "-show_entries", "stream=width,height,duration,codec_name",
-             "-of", "csv=p=0", str(path)],
-            capture_output=True,
-            text=True
+             "-of", "csv=p=0", str(path)]
         )
         
-        if result.returncode == 0 and result.stdout.strip():
-            parts = result.stdout.strip().split(",")
+        if output and output.strip():
+            parts = output.strip().split(",")
             if len(parts) >= 3:
                 codec = parts[0] if len(parts) > 0 else "unknown"
                 width = parts[1] if len(parts) > 1 else "?"
@@ -264,7 +252,8 @@ with gr.Blocks(
             audio_codec, audio_bitrate, resolution,
             tune, film_grain, output_format
         ],
-        outputs=[output_file, status_output]
+        outputs=[output_file, status_output],
+        concurrency_limit=MAX_CONCURRENT_ENCODES
     )
     
     gr.Markdown("""